@@ -0,0 +1,141 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# benchmark of the metadata merge. merges the metadata template with synthetic
+# dataset metadata of real-world sizes (100 KB - 5 MB, mostly FGDC eainfo attribute
+# sections) and compares the single pass merge engine with the former
+# combine_element + regular expression implementation.
+#
+# usage: python benchmarks/bench_metadata_merge.py [--sizes 100,500,1000,5000] [--repeat 5]
+
+import os
+import re
+import sys
+import time
+import argparse
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from metadata_merge import merge_metadata  # noqa: E402
+
+
+template = """<?xml version="1.0"?>
+<metadata xml:lang="en">
+    <Esri><CreaDate>20210520</CreaDate><CreaTime>101702</CreaTime><ArcGISFormat>1.0</ArcGISFormat></Esri>
+    <mdFileID>file://C:/example/input/roads.shp</mdFileID>
+    <dataIdInfo>
+        <idCitation><resTitle>roads</resTitle><date><pubDate>20210520</pubDate></date></idCitation>
+        <searchKeys><keyword>ShapeFile</keyword></searchKeys>
+        <idAbs>description roads is of type ShapeFile</idAbs>
+        <dataExt><geoEle><GeoBndBox esriExtentType="search">
+            <westBL>-90</westBL><eastBL>-81</eastBL><northBL>37</northBL><southBL>34</southBL>
+        </GeoBndBox></geoEle></dataExt>
+    </dataIdInfo>
+    <distInfo><distTranOps>
+        <onLineSrc><linkage>https://www.example.com/lyrx/roads_shp.lyrx</linkage></onLineSrc>
+        <onLineSrc><linkage>file://C:/example/input/roads.shp</linkage></onLineSrc>
+    </distTranOps></distInfo>
+</metadata>"""
+
+
+def make_dataset_metadata(size_kb):
+    # synthetic existing metadata of about size_kb kilobytes, with FGDC sections,
+    # a large eainfo attribute section and repeated ArcGIS elements
+    parts = ['<metadata xml:lang="en">',
+             '<Esri><CreaDate>20190101</CreaDate><ArcGISFormat>1.0</ArcGISFormat></Esri>',
+             '<idinfo><citation><citeinfo><title>roads</title></citeinfo></citation>'
+             '<descript><abstract>FGDC abstract</abstract></descript></idinfo>',
+             '<spref><horizsys><geograph><latres>0.0001</latres></geograph></horizsys></spref>',
+             '<dataIdInfo><idPurp>Road centerlines</idPurp>'
+             '<searchKeys><keyword>roads</keyword><keyword>transportation</keyword></searchKeys></dataIdInfo>',
+             '<eainfo><detailed><enttyp><enttypl>roads</enttypl></enttyp>']
+    size = sum(len(part) for part in parts)
+    i = 0
+    while size < size_kb * 1024:
+        attr = (f'<attr><attrlabl>FIELD_{i}</attrlabl><attrdef>Attribute {i} of the road centerlines</attrdef>'
+                f'<attrdefs>Example County</attrdefs><attrdomv><edom><edomv>{i}</edomv>'
+                f'<edomvd>Value {i}</edomvd></edom></attrdomv></attr>')
+        parts.append(attr)
+        size += len(attr)
+        i += 1
+    parts.append('</detailed></eainfo>')
+    parts.append('<distInfo><distTranOps><onLineSrc><linkage>http://data.example.com/roads</linkage></onLineSrc>'
+                 '</distTranOps></distInfo>')
+    parts.append('<metainfo><metd>20190101</metd></metainfo></metadata>')
+    return ''.join(parts)
+
+
+def combine_element(f_xml, t_xml):
+    # the former merge: recursive, with a tag -> element mapping per level
+    mapping = {el.tag: el for el in f_xml}
+    for el in t_xml:
+        if len(el) == 0:
+            try:
+                mapping[el.tag].text = el.text
+            except KeyError:
+                mapping[el.tag] = el
+                f_xml.append(el)
+        else:
+            try:
+                combine_element(mapping[el.tag], el)
+            except KeyError:
+                mapping[el.tag] = el
+                f_xml.append(el)
+
+
+def legacy_merge(t_metadata, f_metadata):
+    # the former merge followed by regular expression stripping of the FGDC sections
+    t_xml = ElementTree.fromstring(t_metadata)
+    combine_element(t_xml, ElementTree.fromstring(f_metadata))
+    merged = ElementTree.tostring(t_xml, encoding='unicode').replace("\n", "")
+    for section in ['idinfo', 'dataqual', 'spdoinfo', 'spref', 'eainfo', 'distinfo', 'metainfo', 'smusrdef']:
+        merged = re.sub(f"<{section}>.*</{section}>", " ", merged)
+    return merged
+
+
+def single_pass_merge(t_metadata, f_metadata):
+    return ElementTree.tostring(merge_metadata(t_metadata, f_metadata), encoding='unicode')
+
+
+def measure(function, t_metadata, f_metadata, repeat):
+    # returns the best time in seconds out of repeat runs
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(t_metadata, f_metadata)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the metadata merge")
+    parser.add_argument("--sizes", default="100,500,1000,5000", help="document sizes in KB (default: 100,500,1000,5000)")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs per size, the best run is reported (default: 5)")
+    args = parser.parse_args()
+
+    print(f"{'size (KB)':>10} {'legacy (ms)':>12} {'single pass (ms)':>17} {'speedup':>8}")
+    for size_kb in [int(size) for size in args.sizes.split(',')]:
+        f_metadata = make_dataset_metadata(size_kb)
+        legacy = measure(legacy_merge, template, f_metadata, args.repeat)
+        single_pass = measure(single_pass_merge, template, f_metadata, args.repeat)
+        print(f"{len(f_metadata) // 1024:>10} {legacy * 1000:>12.1f} {single_pass * 1000:>17.1f} {legacy / single_pass:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
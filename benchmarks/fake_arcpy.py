@@ -0,0 +1,415 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# fake arcpy module for benchmarks on machines without ArcGIS Pro. implements the
+# part of arcpy that generate_layer_files.py uses, on top of the synthetic trees
+# of synthetic_tree.py, with a configurable latency per call to mimic the cost of
+# the real ArcGIS calls.
+#
+# usage: fake_arcpy.install('none', addDataFromPath=0.1)  # before importing generate_layer_files
+
+import os
+import sys
+import json
+import math
+import time
+import types
+import fnmatch
+import struct
+import threading
+
+from synthetic_tree import wkt_by_wkid, shape_types
+
+
+# seconds per call. the "arcgis" profile approximates ArcGIS Pro on a workstation with local data
+latency_profiles = {
+    'none': {},
+    'arcgis': {
+        'Describe': 0.02,
+        'da.Describe': 0.02,
+        'ListFeatureClasses': 0.02,
+        'ListDatasets': 0.02,
+        'ListRasters': 0.02,
+        'Walk': 0.02,
+        'SpatialReference': 0.001,
+        'ListTransformations': 0.005,
+        'projectAs': 0.002,
+        'addDataFromPath': 0.15,
+        'saveACopy': 0.08,
+        'removeLayer': 0.01,
+        'Metadata': 0.03,
+        'ArcGISProject': 2.0,
+    },
+}
+
+latency = {}  # seconds per call, see latency_profiles
+calls = {}  # number of calls per name
+_calls_lock = threading.Lock()
+
+# size in KB of the existing metadata of geodatabase datasets
+metadata_kb = 20
+
+
+def _call(name):
+    # counts the call and waits for its latency
+    with _calls_lock:
+        calls[name] = calls.get(name, 0) + 1
+    delay = latency.get(name)
+    if delay:
+        time.sleep(delay)
+
+
+class _Env:
+    workspace = None
+
+
+env = _Env()
+
+
+class Extent:
+    def __init__(self, XMin, YMin, XMax, YMax):
+        self.XMin, self.YMin, self.XMax, self.YMax = XMin, YMin, XMax, YMax
+
+    def __repr__(self):
+        return f"{self.XMin} {self.YMin} {self.XMax} {self.YMax}"
+
+
+class SpatialReference:
+    def __init__(self, item=None):
+        _call('SpatialReference')
+        self.factoryCode = item if isinstance(item, int) else 0
+
+    def loadFromString(self, text):
+        _call('SpatialReference')
+        for wkid, wkt in wkt_by_wkid.items():
+            if wkt == text.strip():
+                self.factoryCode = wkid
+                return
+        self.factoryCode = 0
+
+
+class Point:
+    def __init__(self, X=None, Y=None):
+        self.X, self.Y = X, Y
+
+
+class Array(list):
+    def getObject(self, index):
+        return self[index]
+
+
+def _to_wgs84(x, y, wkid):
+    # approximate conversion of the synthetic coordinates to longitude/latitude
+    if wkid == 3857:
+        return x / 111319.49, math.degrees(2 * math.atan(math.exp(y / 6378137.0)) - math.pi / 2)
+    elif wkid == 26916:
+        return -87.0 + (x - 500000.0) / 90000.0, y / 110946.0
+    return x, y
+
+
+class Multipoint:
+    def __init__(self, inputs, spatial_reference=None):
+        self.points = Array(inputs)
+        self.spatialReference = spatial_reference
+
+    def projectAs(self, spatial_reference, transformation_name=None):
+        _call('projectAs')
+        in_wkid = self.spatialReference.factoryCode if self.spatialReference else 4326
+        points = [Point(*_to_wgs84(p.X, p.Y, in_wkid)) for p in self.points]
+        return Multipoint(points, spatial_reference)
+
+    @property
+    def pointCount(self):
+        return len(self.points)
+
+    def getPart(self, index=None):
+        return self.points if index is None else self.points[index]
+
+
+def ListTransformations(from_sr, to_sr, extent=None):
+    _call('ListTransformations')
+    return []
+
+
+def _split_gdb(path):
+    # returns (gdb path, [path parts inside the gdb]) or (None, None)
+    normalized = path.replace('\\', '/')
+    index = normalized.lower().find('.gdb')
+    if index < 0:
+        return None, None
+    gdb = normalized[:index + 4]
+    inside = [part for part in normalized[index + 4:].split('/') if part]
+    return gdb, inside
+
+
+_catalogs = {}
+
+
+def _catalog(gdb):
+    catalog = _catalogs.get(gdb)
+    if catalog is None:
+        with open(os.path.join(gdb, 'catalog.json')) as catalog_file:
+            catalog = json.load(catalog_file)
+        _catalogs[gdb] = catalog
+    return catalog
+
+
+def _list_files(patterns):
+    workspace = env.workspace
+    try:
+        names = sorted(os.listdir(workspace))
+    except OSError:
+        return []
+    return [name for name in names if any(fnmatch.fnmatch(name.lower(), pattern) for pattern in patterns)]
+
+
+def ListFeatureClasses(wild_card=None, feature_type=None, feature_dataset=None):
+    _call('ListFeatureClasses')
+    gdb, inside = _split_gdb(env.workspace)
+    if gdb is None:
+        return _list_files(['*.shp'])
+    catalog = _catalog(gdb)
+    if not inside:
+        return list(catalog['feature_classes'])
+    return list(catalog['feature_datasets'].get(inside[0], {}))
+
+
+def ListDatasets(wild_card=None, feature_type=None):
+    _call('ListDatasets')
+    gdb, inside = _split_gdb(env.workspace)
+    if gdb is None or inside:
+        return []
+    return list(_catalog(gdb)['feature_datasets'])
+
+
+def ListRasters(wild_card=None, raster_type=None):
+    _call('ListRasters')
+    gdb, inside = _split_gdb(env.workspace)
+    if gdb is None:
+        return _list_files(['*.tif', '*.img', '*.jp2'])
+    return [] if inside else list(_catalog(gdb)['rasters'])
+
+
+def _read_prj(path):
+    try:
+        with open(os.path.splitext(path)[0] + '.prj') as prj_file:
+            text = prj_file.read().strip()
+    except OSError:
+        return 0
+    for wkid, wkt in wkt_by_wkid.items():
+        if wkt == text:
+            return wkid
+    return 0
+
+
+def _describe(path):
+    # the properties of the dataset at path, as returned by arcpy.da.Describe
+    if not os.path.isabs(path) and env.workspace:
+        path = os.path.join(env.workspace, path)
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    extension = os.path.splitext(path)[1].lower()
+
+    gdb, inside = _split_gdb(path)
+    if gdb is not None and inside:
+        catalog = _catalog(gdb)
+        if len(inside) == 1 and inside[0] in catalog['feature_datasets']:
+            return {'dataType': 'FeatureDataset', 'baseName': inside[0], 'catalogPath': path}
+        item = catalog['feature_classes'].get(inside[-1]) or catalog['rasters'].get(inside[-1])
+        if item is None:
+            for fds in catalog['feature_datasets'].values():
+                item = item or fds.get(inside[-1])
+        if item is None:
+            raise OSError(f"{path} does not exist")
+        return {'dataType': item['dataType'], 'baseName': inside[-1], 'catalogPath': path,
+                'extent': Extent(*item['extent']), 'spatialReference': SpatialReference(item['wkid']),
+                'shapeType': item['shapeType'], 'bandCount': 1}
+
+    if extension == '.shp':
+        with open(path, 'rb') as shp_file:
+            header = shp_file.read(100)
+        shape_type = struct.unpack('<i', header[32:36])[0]
+        return {'dataType': 'ShapeFile', 'baseName': base_name, 'catalogPath': path,
+                'extent': Extent(*struct.unpack('<4d', header[36:68])),
+                'spatialReference': SpatialReference(_read_prj(path)),
+                'shapeType': shape_types.get(shape_type, 'Polygon')}
+    elif extension == '.las':
+        with open(path, 'rb') as las_file:
+            header = las_file.read(227)
+        point_count = struct.unpack('<I', header[107:111])[0]
+        max_x, min_x, max_y, min_y = struct.unpack('<4d', header[179:211])
+        return {'dataType': 'LasDataset', 'baseName': base_name, 'catalogPath': path,
+                'extent': Extent(min_x, min_y, max_x, max_y), 'spatialReference': SpatialReference(26916),
+                'constraintCount': 0, 'fileCount': 1, 'hasStatistics': False,
+                'needsUpdateStatistics': True, 'pointCount': point_count}
+    elif os.path.isfile(path):
+        xmin = ymin = xmax = ymax = None
+        try:
+            with open(os.path.splitext(path)[0] + '.tfw') as world_file:
+                dx, _, _, dy, xmin, ymax = [float(line) for line in world_file.read().split()]
+            xmax, ymin = xmin + dx * 1000, ymax + dy * 1000
+        except (OSError, ValueError):
+            pass
+        return {'dataType': 'RasterDataset', 'baseName': base_name, 'catalogPath': path,
+                'extent': Extent(xmin, ymin, xmax, ymax), 'spatialReference': SpatialReference(_read_prj(path)),
+                'bandCount': 1}
+    elif os.path.isdir(path):
+        return {'dataType': 'Folder', 'baseName': base_name, 'catalogPath': path}
+    raise OSError(f"{path} does not exist")
+
+
+class _DescribeObject:
+    def __init__(self, properties):
+        self.__dict__.update(properties)
+        self.SpatialReference = properties.get('spatialReference')
+
+
+def Describe(value, datatype=None):
+    _call('Describe')
+    return _DescribeObject(_describe(value))
+
+
+def _da_describe(value, datatype=None):
+    _call('da.Describe')
+    return _describe(value)
+
+
+def _walk(top, topdown=True, onerror=None, followlinks=False, datatype=None, type=None):
+    # arcpy.da.Walk over folders and the fake geodatabases
+    _call('Walk')
+    gdb, inside = _split_gdb(top)
+    if gdb is not None:
+        catalog = _catalog(gdb)
+        wanted = datatype if isinstance(datatype, (list, tuple)) else [datatype] if datatype else None
+        names = []
+        if wanted is None or 'FeatureClass' in wanted:
+            names += list(catalog['feature_classes'])
+        if wanted is None or 'RasterDataset' in wanted:
+            names += list(catalog['rasters'])
+        yield gdb, list(catalog['feature_datasets']), names
+        if wanted is None or 'FeatureClass' in wanted:
+            for name, feature_classes in catalog['feature_datasets'].items():
+                yield f"{gdb}/{name}", [], list(feature_classes)
+        return
+    for folder, folder_names, file_names in os.walk(top):
+        yield folder, folder_names, [name for name in file_names if name.lower().endswith(('.shp', '.tif', '.las'))]
+
+
+def dataset_fields(name):
+    # the field names of the fake dataset name that its layer files refer to
+    stem = name.upper()
+    return f"{stem}_NAME", f"{stem}_CLASS"
+
+
+class Layer:
+    def __init__(self, path):
+        self.path = path
+        self.properties = _describe(path)
+
+    def saveACopy(self, file_name):
+        _call('saveACopy')
+        folder, data_file = os.path.split(self.path)
+        data_type = self.properties['dataType']
+        name = os.path.splitext(data_file)[0]
+        uri = f"CIMPATH=map/{name.lower()}.json"
+        connection = {'type': 'CIMStandardDataConnection', 'workspaceConnectionString': f"DATABASE={folder}",
+                      'workspaceFactory': 'Shapefile', 'dataset': name, 'datasetType': 'esriDTFeatureClass'}
+        if data_type in ['ShapeFile', 'FeatureClass']:
+            # labels, display field and renderer refer to fields of this dataset, see dataset_fields
+            display_field, class_field = dataset_fields(name)
+            symbol = {'shapeType': self.properties.get('shapeType')}
+            layer = {'type': 'CIMFeatureLayer', 'name': name, 'uRI': uri,
+                     'featureTable': {'type': 'CIMFeatureTable', 'dataConnection': connection,
+                                      'displayField': display_field,
+                                      'fieldDescriptions': [{'fieldName': display_field}, {'fieldName': class_field}]},
+                     'labelVisibility': True,
+                     'labelClasses': [{'type': 'CIMLabelClass', 'expression': f"$feature.{display_field}"}],
+                     'renderer': {'type': 'CIMUniqueValueRenderer', 'fields': [class_field], 'defaultSymbol': symbol,
+                                  'groups': [{'classes': [{'values': [{'fieldValues': ['1']}], 'symbol': symbol}]}]}}
+        else:
+            connection.update(workspaceFactory='Raster', dataset=data_file, datasetType='esriDTRasterDataset')
+            layer = {'type': 'CIMRasterLayer', 'name': name, 'uRI': uri, 'dataConnection': connection,
+                     'colorizer': {'type': 'CIMRasterStretchColorizer', 'stretchStats': {'min': 0, 'max': 255}}}
+        with open(file_name, 'w') as lyrx_file:
+            json.dump({'type': 'CIMLayerDocument', 'version': '3.0.0', 'layers': [uri],
+                       'layerDefinitions': [layer]}, lyrx_file)
+        return file_name
+
+
+class Map:
+    def __init__(self):
+        self.layers = []
+
+    def addDataFromPath(self, data_path):
+        _call('addDataFromPath')
+        layer = Layer(data_path)
+        self.layers.append(layer)
+        return layer
+
+    def removeLayer(self, remove_layer):
+        _call('removeLayer')
+        self.layers.remove(remove_layer)
+
+
+class ArcGISProject:
+    def __init__(self, aprx_path):
+        _call('ArcGISProject')
+        self.filePath = aprx_path
+        self.maps = [Map()]
+
+    def listMaps(self, wildcard=None):
+        return self.maps
+
+
+class Metadata:
+    def __init__(self, uri=None):
+        _call('Metadata')
+        self.uri = uri
+
+    @property
+    def xml(self):
+        # geodatabase datasets come with FGDC metadata, other datasets without
+        gdb, inside = _split_gdb(self.uri or '')
+        if gdb is None or not inside:
+            return None
+        attributes = ''.join(f'<attr><attrlabl>FIELD_{i}</attrlabl><attrdef>Attribute {i}</attrdef></attr>'
+                             for i in range(metadata_kb * 1024 // 80))
+        return (f'<metadata><Esri><ArcGISFormat>1.0</ArcGISFormat></Esri>'
+                f'<idinfo><citation><citeinfo><title>{inside[-1]}</title></citeinfo></citation></idinfo>'
+                f'<dataIdInfo><idPurp>Synthetic dataset {inside[-1]}</idPurp></dataIdInfo>'
+                f'<eainfo><detailed>{attributes}</detailed></eainfo></metadata>')
+
+
+def install(latency_profile='none', **overrides):
+    # installs this module as arcpy, arcpy.da, arcpy.mp and arcpy.metadata
+    latency.clear()
+    latency.update(latency_profiles[latency_profile])
+    latency.update(overrides)
+
+    module = sys.modules[__name__]
+    da = types.ModuleType('arcpy.da')
+    da.Describe = _da_describe
+    da.Walk = _walk
+    mp = types.ModuleType('arcpy.mp')
+    mp.ArcGISProject = ArcGISProject
+    metadata = types.ModuleType('arcpy.metadata')
+    metadata.Metadata = Metadata
+    module.da, module.mp, module.metadata = da, mp, metadata
+
+    sys.modules['arcpy'] = module
+    sys.modules['arcpy.da'] = da
+    sys.modules['arcpy.mp'] = mp
+    sys.modules['arcpy.metadata'] = metadata
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# local stand-in for the Geoportal Server 2.x document management API
+# (/geoportal/rest/metadata/item) and of the ids returned by its search API
+# (/geoportal/rest/metadata/search), with a configurable latency and rate of
+# 429/503 responses.
+#
+# usage: python benchmarks/geoportal_stub.py --port 8080 --latency 0.05
+
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+item_path = '/geoportal/rest/metadata/item'
+search_path = '/geoportal/rest/metadata/search'
+
+
+class GeoportalStub:
+    # latency    = seconds per request
+    # error_rate = fraction of requests answered with error_status
+    # max_active = requests handled at the same time, more concurrent requests are answered with 429
+    # max_result_window = largest from + size of a search, as index.max_result_window of Elasticsearch
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, error_status=503, max_active=None,
+                 max_result_window=10000):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.max_active = max_active
+        self.max_result_window = max_result_window
+        self.lock = threading.Lock()
+        self.active = 0
+        self.items = {}  # id -> document
+        self.requests = 0
+        self.errors = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # headers and body are written separately
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_PUT(self):
+                stub.handle(self, 'PUT')
+
+            def do_DELETE(self):
+                stub.handle(self, 'DELETE')
+
+            def do_GET(self):
+                stub.handle(self, 'GET')
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{item_path}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, method):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+            overloaded = self.max_active is not None and self.active > self.max_active
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if overloaded or random.random() < self.error_rate:
+                with self.lock:
+                    self.errors += 1
+                self.respond(handler, 429 if overloaded else self.error_status, {'error': 'busy'})
+                return
+
+            path, _, query = handler.path.partition('?')
+            if method == 'GET' and path == search_path:
+                self.search(handler, parse_qs(query))
+                return
+            if not path.startswith(item_path):
+                self.respond(handler, 404, {'error': 'not found'})
+                return
+            item_id = path[len(item_path):].strip('/') or None
+
+            if method == 'PUT':
+                item_id = item_id or uuid.uuid4().hex
+                with self.lock:
+                    status = 'updated' if item_id in self.items else 'created'
+                    self.items[item_id] = body.decode('UTF-8', 'replace')
+                self.respond(handler, 200, {'id': item_id, 'status': status})
+            elif method == 'DELETE':
+                with self.lock:
+                    found = self.items.pop(item_id, None) is not None
+                self.respond(handler, 200 if found else 404, {'id': item_id})
+            elif item_id is not None and item_id in self.items:
+                self.respond(handler, 200, {'id': item_id})
+            else:
+                self.respond(handler, 404, {'error': 'not found'})
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def search(self, handler, query):
+        # a page of the ids of the items, in the format of an Elasticsearch response. pages are
+        # selected with from/size, or with search_after on the fileid (the mdFileID of the
+        # document) in an Elasticsearch query in esdsl. like Elasticsearch 8, sorting on _id and
+        # from + size beyond max_result_window are rejected
+        size = int(query.get('size', ['10'])[0])
+        start = int(query.get('from', ['0'])[0])
+        after = None
+        if 'esdsl' in query:
+            dsl = json.loads(query['esdsl'][0])
+            size = dsl.get('size', size)
+            start = dsl.get('from', start)
+            after = (dsl.get('search_after') or [None])[0]
+            fields = [field for sort in dsl.get('sort', []) for field in (sort if isinstance(sort, dict) else [sort])]
+            if '_id' in fields:
+                self.respond(handler, 400, {'error': "Fielddata access on the _id field is disallowed, "
+                                                     "you can re-enable it by updating the dynamic cluster "
+                                                     "setting: indices.id_field_data.enabled"})
+                return
+        if start + size > self.max_result_window:
+            self.respond(handler, 400, {'error': f"Result window is too large, from + size must be less than "
+                                                 f"or equal to: [{self.max_result_window}]"})
+            return
+        with self.lock:
+            keys = sorted((file_id(document) or item_id, item_id) for item_id, document in self.items.items())
+        if after is not None:
+            keys = [key for key in keys if key[0] > after]
+        hits = [{'_id': item_id, 'sort': [key]} for key, item_id in keys[start:start + size]]
+        self.respond(handler, 200, {'hits': {'total': {'value': len(self.items)}, 'hits': hits}})
+
+    def respond(self, handler, status, document):
+        body = json.dumps(document).encode('UTF-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+def file_id(document):
+    # the mdFileID of the metadata document, the fileid Geoportal indexes it under
+    match = re.search(r'<mdFileID>(.*?)</mdFileID>', document)
+    return match.group(1) if match else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Geoportal Server document management API")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--max-active", type=int, help="concurrent requests above which 429 is returned")
+    args = parser.parse_args()
+
+    stub = GeoportalStub(port=args.port, latency=args.latency, error_rate=args.error_rate, max_active=args.max_active)
+    print(f"serving {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
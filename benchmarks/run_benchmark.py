@@ -0,0 +1,253 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# offline benchmark of generate_layer_files.py. crawls a synthetic directory tree
+# with the fake arcpy module and publishes to a local Geoportal stand-in, then
+# reports the throughput (datasets/s) and the latency per stage (p50/p99).
+# reports are written as JSON and can be compared with the report of an earlier
+# release or another set of tuning options.
+#
+# usage:
+#   python benchmarks/run_benchmark.py --folders 20 --latency-profile arcgis --report before.json
+#   python benchmarks/run_benchmark.py --folders 20 --latency-profile arcgis --compare before.json -- --pipeline
+
+import os
+import sys
+import re
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import contextlib
+import functools
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repository_dir = os.path.dirname(benchmark_dir)
+sys.path.insert(0, benchmark_dir)
+sys.path.insert(0, repository_dir)
+
+import fake_arcpy  # noqa: E402
+from synthetic_tree import make_tree  # noqa: E402
+from geoportal_stub import GeoportalStub  # noqa: E402
+
+
+# functions of generate_layer_files that are timed, by stage name
+timed_stages = {
+    'describe': 'describe_dataset',
+    'layerize': 'generate_layer_file',
+    'project': 'get_projected_extents',
+    'render': 'generate_metadata',
+}
+
+
+def percentile(values, p):
+    # the p-th percentile of values, by the nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def timed(timings, function):
+    # wraps function to record the duration of every call in timings
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - start)
+    return wrapper
+
+
+def parse_latency(value):
+    name, _, seconds = value.partition('=')
+    return name, float(seconds)
+
+
+def run(args, harvest_args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='harvest_benchmark_')
+    start_dir = os.path.join(work_dir, 'input')
+    sink_folder = os.path.join(work_dir, 'lyrx')
+    os.makedirs(sink_folder, exist_ok=True)
+
+    if not os.path.exists(start_dir):
+        expected = make_tree(start_dir, folders=args.folders, shapefiles=args.shapefiles, rasters=args.rasters,
+                             las=args.las, gdbs=args.gdbs, gdb_feature_classes=args.gdb_feature_classes)
+    else:
+        expected = None
+
+    fake_arcpy.install(args.latency_profile, **dict(args.latency))
+    fake_arcpy.metadata_kb = args.metadata_kb
+
+    stub = GeoportalStub(latency=args.server_latency, error_rate=args.server_error_rate,
+                         max_active=args.server_max_active).start()
+
+    # the working project is opened relative to the repository
+    os.chdir(repository_dir)
+    import generate_layer_files
+    import geoportal_publisher
+
+    timings = {stage: [] for stage in list(timed_stages) + ['publish']}
+    for stage, name in timed_stages.items():
+        setattr(generate_layer_files, name, timed(timings[stage], getattr(generate_layer_files, name)))
+    geoportal_publisher.Publisher._request = timed(timings['publish'], geoportal_publisher.Publisher._request)
+
+    harvest_report_file = os.path.join(work_dir, 'harvest_report.json')
+    sys.argv = ['generate_layer_files.py', '--start-dir', start_dir, '--sink-folder', sink_folder, '--server', stub.url,
+                '--manifest', os.path.join(work_dir, 'manifest.sqlite'),
+                '--report', harvest_report_file, '--log-level', 'WARNING'] + harvest_args
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            generate_layer_files.main()
+    finally:
+        elapsed = time.perf_counter() - start
+        stub.stop()
+        foreign = foreign_field_layers(sink_folder)
+        harvest_report = {}
+        if os.path.exists(harvest_report_file):
+            with open(harvest_report_file) as report_file:
+                harvest_report = json.load(report_file)
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # worker processes do not report their timings to this process, count the datasets of the harvest report
+    datasets = len(timings['render']) or sum((harvest_report.get('counters', {}).get('datasets') or {}).values())
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'harvest_args': harvest_args,
+        'tree': {'folders': args.folders, 'shapefiles': args.shapefiles, 'rasters': args.rasters,
+                 'las': args.las, 'gdbs': args.gdbs, 'expected_datasets': expected},
+        'latency_profile': args.latency_profile,
+        'latency': dict(fake_arcpy.latency),
+        'server': {'latency': args.server_latency, 'error_rate': args.server_error_rate,
+                   'requests': stub.requests, 'errors': stub.errors, 'items': len(stub.items)},
+        'datasets': datasets,
+        'foreign_field_layers': foreign,
+        'seconds': elapsed,
+        'datasets_per_second': datasets / elapsed if elapsed else None,
+        'arcpy_calls': dict(fake_arcpy.calls),
+        'stages': stage_latencies(timings, harvest_report),
+        # counters and timings reported by the harvest itself, including its worker processes
+        'harvest': {'counters': harvest_report.get('counters'), 'stages': harvest_report.get('stages')},
+    }
+    return report
+
+
+def stage_latencies(timings, harvest_report):
+    # the latency per stage, from the timings of this process. with --processes or
+    # --dataset-timeout the datasets are harvested in worker processes, whose timings
+    # only reach the stages of the harvest report (with its own stage names)
+    if not timings['render'] and harvest_report.get('stages'):
+        return {stage: {name: values[name] for name in ['count', 'p50_ms', 'p99_ms', 'total_s']}
+                for stage, values in harvest_report['stages'].items()}
+    return {stage: {'count': len(values),
+                    'p50_ms': _ms(percentile(values, 50)),
+                    'p99_ms': _ms(percentile(values, 99)),
+                    'total_s': sum(values)}
+            for stage, values in timings.items()}
+
+
+def foreign_field_layers(folder):
+    # returns the layer files in folder that refer to a field of another dataset, e.g. labels
+    # or a renderer carried over from the template of --synthesize-lyrx, see fake_arcpy.dataset_fields
+    field = re.compile(r'([A-Z0-9_]+)_(?:NAME|CLASS)\b')
+    foreign = []
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if not name.endswith('.lyrx'):
+            continue
+        with open(os.path.join(folder, name)) as lyrx_file:
+            lyr_json = json.load(lyrx_file)
+        dataset = lyr_json['layerDefinitions'][0]['name'].upper()
+        if any(stem != dataset for stem in field.findall(json.dumps(lyr_json))):
+            foreign.append(name)
+    return foreign
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000.0
+
+
+def print_report(report, baseline=None):
+    print(f"datasets      = {report['datasets']}")
+    print(f"seconds       = {report['seconds']:.2f}")
+    line = f"datasets/s    = {report['datasets_per_second']:.1f}"
+    if baseline and baseline.get('datasets_per_second'):
+        line += f" (baseline {baseline['datasets_per_second']:.1f}, " \
+                f"{report['datasets_per_second'] / baseline['datasets_per_second']:.2f}x)"
+    print(line)
+    print(f"published     = {report['server']['items']} ({report['server']['errors']} errors)")
+    if report['foreign_field_layers']:
+        print(f"layer files that refer to the fields of another dataset = {len(report['foreign_field_layers'])}, "
+              f"e.g. {report['foreign_field_layers'][0]}")
+    width = max([10] + [len(stage) for stage in report['stages']])
+    print(f"{'stage':<{width}} {'count':>8} {'p50 ms':>10} {'p99 ms':>10} {'total s':>10}")
+    for stage, values in report['stages'].items():
+        p50 = f"{values['p50_ms']:.2f}" if values['p50_ms'] is not None else '-'
+        p99 = f"{values['p99_ms']:.2f}" if values['p99_ms'] is not None else '-'
+        print(f"{stage:<{width}} {values['count']:>8} {p50:>10} {p99:>10} {values['total_s']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline benchmark of generate_layer_files.py. Arguments after -- are passed to the harvest.")
+    parser.add_argument("--folders", type=int, default=10, help="number of folders (default: 10)")
+    parser.add_argument("--shapefiles", type=int, default=10, help="shapefiles per folder (default: 10)")
+    parser.add_argument("--rasters", type=int, default=2, help="rasters per folder (default: 2)")
+    parser.add_argument("--las", type=int, default=1, help="LAS files per folder (default: 1)")
+    parser.add_argument("--gdbs", type=int, default=1, help="file geodatabases per folder (default: 1)")
+    parser.add_argument("--gdb-feature-classes", type=int, default=5, help="feature classes per geodatabase (default: 5)")
+    parser.add_argument("--metadata-kb", type=int, default=20, help="size of the existing metadata of geodatabase datasets (default: 20)")
+    parser.add_argument("--latency-profile", choices=sorted(fake_arcpy.latency_profiles), default='none',
+                        help="latency of the fake arcpy calls (default: none)")
+    parser.add_argument("--latency", type=parse_latency, action="append", default=[],
+                        help="latency of a single arcpy call, e.g. addDataFromPath=0.2, may be repeated")
+    parser.add_argument("--server-latency", type=float, default=0.0, help="seconds per Geoportal request (default: 0)")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction of requests answered with 503 (default: 0)")
+    parser.add_argument("--server-max-active", type=int, help="concurrent requests above which the server answers 429")
+    parser.add_argument("--work-dir", help="folder for the synthetic tree and the output, reused between runs")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary folder with the synthetic tree and output")
+    parser.add_argument("--report", help="write the report as JSON to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare the throughput with")
+
+    argv = sys.argv[1:]
+    harvest_args = []
+    if '--' in argv:
+        harvest_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    report = run(args, harvest_args)
+    print_report(report, baseline)
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    if report['foreign_field_layers']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
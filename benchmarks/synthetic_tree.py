@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# generator of synthetic directory trees to crawl: N folders, each with M
+# shapefiles, rasters and LAS files, and file geodatabases. the files have valid
+# headers (.shp, .las) and .prj sidecars, but no real content. file geodatabases
+# are folders with a catalog.json that lists their feature classes, feature
+# datasets and rasters, which is read by the fake arcpy module.
+
+import os
+import json
+import struct
+import random
+
+
+# coordinate reference systems used by the synthetic datasets, as Esri WKT
+wkt_by_wkid = {
+    4326: 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+          'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]',
+    3857: 'PROJCS["WGS_1984_Web_Mercator_Auxiliary_Sphere",GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",'
+          'SPHEROID["WGS_1984",6378137.0,298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],'
+          'PROJECTION["Mercator_Auxiliary_Sphere"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],'
+          'PARAMETER["Central_Meridian",0.0],PARAMETER["Standard_Parallel_1",0.0],'
+          'PARAMETER["Auxiliary_Sphere_Type",0.0],UNIT["Meter",1.0]]',
+    26916: 'PROJCS["NAD_1983_UTM_Zone_16N",GEOGCS["GCS_North_American_1983",DATUM["D_North_American_1983",'
+           'SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],'
+           'PROJECTION["Transverse_Mercator"],PARAMETER["False_Easting",500000.0],PARAMETER["False_Northing",0.0],'
+           'PARAMETER["Central_Meridian",-87.0],PARAMETER["Scale_Factor",0.9996],'
+           'PARAMETER["Latitude_Of_Origin",0.0],UNIT["Meter",1.0]]',
+}
+
+# shapefile shape type codes
+shape_types = {1: 'Point', 3: 'Polyline', 5: 'Polygon', 8: 'Multipoint'}
+
+
+def random_extent(rng, wkid):
+    # a random extent of a few kilometers somewhere in Tennessee, in the units of wkid
+    lon = rng.uniform(-90.0, -82.0)
+    lat = rng.uniform(35.0, 36.5)
+    size = rng.uniform(0.01, 0.1)
+    if wkid == 4326:
+        return lon, lat, lon + size, lat + size
+    elif wkid == 3857:
+        return lon * 111319.49, lat * 130000.0, (lon + size) * 111319.49, (lat + size) * 130000.0
+    x = 500000.0 + (lon + 87.0) * 90000.0
+    y = lat * 110946.0
+    return x, y, x + size * 90000.0, y + size * 110946.0
+
+
+def write_shapefile(path, rng, wkid):
+    # writes an empty shapefile: .shp and .shx with a valid 100 byte header, .dbf and .prj
+    shape_type = rng.choice(list(shape_types))
+    xmin, ymin, xmax, ymax = random_extent(rng, wkid)
+    header = struct.pack('>7i', 9994, 0, 0, 0, 0, 0, 50) + \
+        struct.pack('<2i8d', 1000, shape_type, xmin, ymin, xmax, ymax, 0.0, 0.0, 0.0, 0.0)
+    stem = os.path.splitext(path)[0]
+    for extension in ['.shp', '.shx']:
+        with open(stem + extension, 'wb') as shp_file:
+            shp_file.write(header)
+    with open(stem + '.dbf', 'wb') as dbf_file:
+        dbf_file.write(struct.pack('<4BIHH20x', 3, 121, 1, 1, 0, 33, 1) + b'\r')
+    with open(stem + '.prj', 'w') as prj_file:
+        prj_file.write(wkt_by_wkid[wkid])
+
+
+def write_raster(path, rng, wkid):
+    # writes a placeholder raster with a world file and a .prj
+    stem = os.path.splitext(path)[0]
+    xmin, ymin, xmax, ymax = random_extent(rng, wkid)
+    with open(path, 'wb') as raster_file:
+        raster_file.write(b'II*\x00' + bytes(rng.getrandbits(8) for _ in range(60)))
+    with open(stem + '.tfw', 'w') as world_file:
+        world_file.write(f"{(xmax - xmin) / 1000}\n0\n0\n{-(ymax - ymin) / 1000}\n{xmin}\n{ymax}\n")
+    with open(stem + '.prj', 'w') as prj_file:
+        prj_file.write(wkt_by_wkid[wkid])
+
+
+def write_las(path, rng, wkid, point_count=1000):
+    # writes a LAS 1.2 file with a valid public header block, a GeoKeyDirectoryTag
+    # VLR with the EPSG code of the CRS and point_count zeroed point records
+    xmin, ymin, xmax, ymax = random_extent(rng, wkid)
+    zmin, zmax = 100.0, rng.uniform(150.0, 500.0)
+    key = 2048 if wkid == 4326 else 3072
+    geokeys = struct.pack('<8H', 1, 1, 0, 1, key, 0, 1, wkid)
+    vlr = struct.pack('<H16sHH32s', 0, b'LASF_Projection', 34735, len(geokeys), b'GeoKeyDirectoryTag') + geokeys
+    header_size = 227
+    point_format, record_length = 0, 20
+    offset_to_points = header_size + len(vlr)
+    header = struct.pack('<4sHH16sBB32s32sHHHIIBHI5I',
+                         b'LASF', 0, 0, bytes(16), 1, 2, b'synthetic', b'synthetic_tree', 1, 2024,
+                         header_size, offset_to_points, 1, point_format, record_length, point_count,
+                         point_count, 0, 0, 0, 0)
+    header += struct.pack('<12d', 0.01, 0.01, 0.01, 0.0, 0.0, 0.0, xmax, xmin, ymax, ymin, zmax, zmin)
+    with open(path, 'wb') as las_file:
+        las_file.write(header)
+        las_file.write(vlr)
+        las_file.write(bytes(point_count * record_length))
+
+
+def write_geodatabase(path, rng, feature_classes, feature_datasets, rasters):
+    # writes a fake file geodatabase: a folder with a table file and a catalog.json
+    os.makedirs(path, exist_ok=True)
+    catalog = {
+        'feature_classes': {f"fc_{i}": _gdb_dataset(rng, 'FeatureClass') for i in range(feature_classes)},
+        'feature_datasets': {f"fds_{i}": {f"fds_{i}_fc_{j}": _gdb_dataset(rng, 'FeatureClass')
+                                          for j in range(feature_classes)}
+                             for i in range(feature_datasets)},
+        'rasters': {f"raster_{i}": _gdb_dataset(rng, 'RasterDataset') for i in range(rasters)},
+    }
+    with open(os.path.join(path, 'a00000001.gdbtable'), 'wb') as table_file:
+        table_file.write(bytes(64))
+    with open(os.path.join(path, 'catalog.json'), 'w') as catalog_file:
+        json.dump(catalog, catalog_file)
+
+
+def _gdb_dataset(rng, data_type):
+    wkid = rng.choice(list(wkt_by_wkid))
+    return {'dataType': data_type, 'wkid': wkid, 'extent': random_extent(rng, wkid),
+            'shapeType': rng.choice(list(shape_types.values())) if data_type == 'FeatureClass' else None}
+
+
+def make_tree(root, folders=10, shapefiles=10, rasters=2, las=1, gdbs=1, gdb_feature_classes=5, seed=1):
+    # generates the synthetic tree below root. returns the number of datasets
+    rng = random.Random(seed)
+    datasets = 0
+    for i in range(folders):
+        # spread the folders over two levels
+        folder = os.path.join(root, f"group_{i % 10}", f"folder_{i}")
+        os.makedirs(folder, exist_ok=True)
+        for j in range(shapefiles):
+            write_shapefile(os.path.join(folder, f"features_{j}.shp"), rng, rng.choice(list(wkt_by_wkid)))
+        for j in range(rasters):
+            write_raster(os.path.join(folder, f"image_{j}.tif"), rng, rng.choice(list(wkt_by_wkid)))
+        for j in range(las):
+            write_las(os.path.join(folder, f"points_{j}.las"), rng, rng.choice([4326, 26916]))
+        for j in range(gdbs):
+            write_geodatabase(os.path.join(folder, f"data_{j}.gdb"), rng, gdb_feature_classes, 1, 1)
+        datasets += shapefiles + rasters + las + gdbs * (2 * gdb_feature_classes + 1)
+    return datasets
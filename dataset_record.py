@@ -0,0 +1,130 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# compact record of the facts about a dataset that are needed to generate its
+# layer file and metadata. the record is filled once, from a single
+# arcpy.da.Describe call or from the file header of the dataset, and passed
+# along the pipeline instead of the lazy arcpy Describe object.
+
+import os
+import math
+from collections import namedtuple
+
+
+Extent = namedtuple('Extent', ['XMin', 'YMin', 'XMax', 'YMax'])
+
+
+def _number(value):
+    # returns value as float, or None if it is missing or not a number
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+class DatasetRecord:
+    # path         = full path of the dataset
+    # fingerprint  = fingerprint of the dataset files when the record was made, see harvest_manifest
+    # data_type    = arcpy data type, e.g. ShapeFile, FeatureClass, RasterDataset, LasDataset
+    # base_name    = name of the dataset without extension
+    # extent       = Extent in the coordinate reference system of the dataset, or None
+    # wkid         = well-known id of the coordinate reference system, or None
+    # shape_type   = geometry type of feature classes, e.g. Polygon
+    # band_count   = number of bands of rasters
+    # las          = LAS statistics: dict of constraintCount, fileCount, hasStatistics,
+    #                needsUpdateStatistics, pointCount, or of the header values of a LAS file
+    __slots__ = ('path', 'fingerprint', 'data_type', 'base_name', 'extent', 'wkid',
+                 'shape_type', 'band_count', 'las')
+
+    las_properties = ['constraintCount', 'fileCount', 'hasStatistics', 'needsUpdateStatistics', 'pointCount']
+
+    def __init__(self, path, fingerprint=None, data_type=None, base_name=None, extent=None, wkid=None,
+                 shape_type=None, band_count=None, las=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.data_type = data_type
+        self.base_name = base_name
+        self.extent = extent
+        self.wkid = wkid
+        self.shape_type = shape_type
+        self.band_count = band_count
+        self.las = las
+
+    @classmethod
+    def from_describe(cls, path, describe, fingerprint=None):
+        # creates the record from the dictionary returned by arcpy.da.Describe
+        extent = None
+        e = describe.get('extent')
+        if e is not None:
+            corners = [_number(getattr(e, name, None)) for name in Extent._fields]
+            if None not in corners:
+                extent = Extent(*corners)
+
+        wkid = None
+        sr = describe.get('spatialReference')
+        if sr is not None:
+            wkid = getattr(sr, 'factoryCode', None)
+
+        las = None
+        if describe.get('dataType') == 'LasDataset':
+            las = {name: describe.get(name) for name in cls.las_properties}
+
+        return cls(path, fingerprint,
+                   data_type=describe.get('dataType'),
+                   base_name=describe.get('baseName'),
+                   extent=extent,
+                   wkid=wkid,
+                   shape_type=describe.get('shapeType'),
+                   band_count=describe.get('bandCount'),
+                   las=las)
+
+    @classmethod
+    def from_las_header(cls, path, header, fingerprint=None):
+        # creates the record of a LAS or LAZ file from its header, see las_header.read_las_header
+        return cls(path, fingerprint,
+                   data_type='LasDataset',
+                   base_name=os.path.splitext(os.path.basename(path))[0],
+                   extent=Extent(header.min_x, header.min_y, header.max_x, header.max_y),
+                   wkid=header.wkid,
+                   las={'fileCount': 1, 'pointCount': header.point_count, 'pointFormat': header.point_format,
+                        'version': header.version, 'compressed': header.compressed})
+
+    @classmethod
+    def from_shapefile_header(cls, path, header, wkid, fingerprint=None):
+        # creates the record of a shapefile from its header, see shapefile_header.read_shapefile_header
+        return cls(path, fingerprint,
+                   data_type='ShapeFile',
+                   base_name=os.path.splitext(os.path.basename(path))[0],
+                   extent=Extent(*header.extent) if header.extent is not None else None,
+                   wkid=wkid,
+                   shape_type=header.shape_type)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        values = dict(values)
+        if values.get('extent') is not None:
+            values['extent'] = Extent(*values['extent'])
+        if values.get('fingerprint') is not None:
+            values['fingerprint'] = tuple(values['fingerprint'])
+        return cls(**values)
+
+    def __repr__(self):
+        return f"DatasetRecord({self.path!r}, data_type={self.data_type!r}, wkid={self.wkid!r})"
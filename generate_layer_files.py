@@ -20,23 +20,74 @@
 
 import os
 import sys
-import requests
+import argparse
+import logging
 from requests.auth import HTTPBasicAuth
-import arcpy
-import arcpy.da
 import uuid
+import atexit
+import importlib
+import time
 import tempfile
 import shutil
+import glob
+import threading
+import contextlib
+import itertools
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import multiprocessing.util
 import urllib
-from string import Template
 from datetime import datetime
 import json
 from pathlib import Path
 from xml.etree import ElementTree
 import re
+import struct
 from xml.etree import ElementTree as et
-
-
+from harvest_manifest import Manifest, fingerprint, clear_caches
+from geoportal_publisher import Publisher
+from harvest_pipeline import Stage, run_pipeline
+from harvest_discovery import discover_workspaces
+from metadata_merge import merge_metadata
+from metadata_template import CompiledTemplate, make_element
+from dataset_record import DatasetRecord
+from las_header import read_las_header
+from shapefile_header import read_shapefile_header
+from wkt_lookup import wkid_from_wkt
+from lyrx_emitter import LayerTemplates, patch_connection, read_json, write_json_atomic
+from harvest_metrics import metrics, start_http_server
+from harvest_bundle import BundleWriter, finish_bundle
+from harvest_leases import LeaseStore, work
+from harvest_watch import watch
+from harvest_reconcile import get_item_id, content_hash, fetch_catalog_ids
+from harvest_watchdog import SupervisedPool, guard
+from harvest_index import MetadataIndex
+
+
+class LazyModule:
+    # stands in for a module that is imported when one of its attributes is first used.
+    # importing arcpy takes seconds and checks out a license, which is not needed to
+    # list the datasets or to describe them from their headers
+
+    def __init__(self, name, *submodules):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            with metrics.time('import_' + self._name):
+                for submodule in self._submodules:
+                    importlib.import_module(self._name + '.' + submodule)
+                self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+arcpy = LazyModule('arcpy', 'da')
+
+
+# configuration, the defaults can be changed here or overridden on the command line or in a --config file.
 # The URL for the geoportal 2.x's document management API.
 server = 'https://www.example.com/geoportal/rest/metadata/item'
 auth = HTTPBasicAuth('<username>', '<password>')
@@ -44,15 +95,16 @@ headers = {'Content-type': 'application/json'}
 
 # setup working ArcGIS Pro project
 aprx_base = r"work.aprx"
-tmp_aprx = tempfile.gettempdir() + str(uuid.uuid4()) + ".aprx"
-shutil.copy(aprx_base, tmp_aprx)
-aprx = arcpy.mp.ArcGISProject(tmp_aprx)
-the_map = aprx.listMaps()[0]
 
 start_dir = r"C:\example\input"             # the physical (local) top of the network data structure to be crawled
 sink_folder = r"C:\example\lyrx"            # the physical (local) folder of the virtual directory of layer files
 waf_base = "https://www.example.com/lyrx/"  # the top level URL for the virtual directory to the folder containing the layer files that will be included in the metadata
 overwrite_lyrx = True                       # if False, existing layer files will be reused. if True, existing layer files are removed and new layer file is written
+synthesize_lyrx = False                     # if True, layer files of shapefiles, rasters and LAS datasets are generated from a per-type template without ArcGIS
+manifest_file = os.path.join(sink_folder, "harvest_manifest.sqlite")  # manifest of harvested datasets, used with --incremental
+report_file = os.path.join(sink_folder, "harvest_report.json")  # run report with the stage timings and counters
+index_file = os.path.join(sink_folder, "harvest_index.sqlite")  # local index of the harvested metadata, see harvest_index.py
+configuration_names = ['server', 'auth', 'aprx_base', 'start_dir', 'sink_folder', 'waf_base']  # settings of configure
 
 # the default CRS. If no CRS is found in the data then the default CRS will be assumed.
 # see https://www.spatialreference.org/ref/?search=Tennessee&srtext=Search
@@ -193,9 +245,175 @@ arcgis_template = """<?xml version="1.0"?>
         </distTranOps>
     </distInfo>
 </metadata>"""  # template metadata in ArcGIS XML format
-metadata_template = Template(arcgis_template)  # setup metadata template
+metadata_template = CompiledTemplate(arcgis_template)  # setup metadata template, parsed once
+
+log = logging.getLogger('generate_layer_files')  # levelled log, configured by configure_logging
+log_format = "%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s"
+
+# projection caches. datasets use only a few coordinate reference systems, and
+# tiled rasters often share the exact same extent
+ProjectedExtent = namedtuple('ProjectedExtent', ['XMin', 'YMin', 'XMax', 'YMax'])
+spatial_references = {}  # arcpy.SpatialReference by wkid
+transformations = {}  # geographic transformation name by (in_wkid, wkid)
+wkids_by_wkt = {}  # well-known id by WKT, for the WKT that is not in the lookup table of wkt_lookup
+projected_extents = {}  # ProjectedExtent by (xmin, ymin, xmax, ymax, in_wkid, wkid)
+projected_extents_size = 100000  # maximum number of memoised projected extents
+projection_batch = 100  # datasets of a serial crawl whose extents are projected together, see project_extents
+
+# DatasetRecord by path, valid as long as the fingerprint of the dataset is unchanged
+dataset_records = {}
+dataset_records_size = 100000  # maximum number of cached dataset records
+manifest = None  # manifest of harvested datasets, set in incremental and reconcile mode
+incremental = False  # if True, datasets that did not change since the last run are skipped
+reconcile_run = None  # id of this run in reconcile mode, see harvest_reconcile.py
+manifest_path = None  # path of the manifest, reopened by worker processes
+metadata_index = None  # local index of the harvested metadata, updated when a metadata file is written
+index_path = None  # path of the metadata index, reopened by worker processes
+unwalked_geodatabases = set()  # geodatabases whose walk failed in this run, their items are not deleted
+publisher = None  # background publisher, started on the first published document
+publisher_options = {}  # options of the background publisher, see Publisher
+layer_templates = LayerTemplates()  # per-type layer file templates, used with synthesize_lyrx
+lyrx_template_folder = None  # folder with layer file templates, used with synthesize_lyrx
+bundle_writer = None  # writer of the metadata bundle, started on the first exported document
+bundle_options = {}  # folder, bundle_format and records_per_chunk of the bundle, only set in export mode
+metadata_only = False  # if True, no layer files are generated, the metadata links to the existing layer files
+max_attempts = 3  # number of failed attempts after which a dataset in the quarantine is skipped
+slow_extensions = ['.las', '.laz']  # datasets that are known to be slow to add to a map
+slow_bytes = 256 * 1024 * 1024  # datasets larger than this are known to be slow, e.g. large rasters
+arcpy_lock = threading.RLock()  # held by every arcpy call, arcpy is not supported from several threads
+work_projects = threading.local()  # working ArcGIS Pro project of every thread, opened on first use by get_map
+project_files = {}  # temporary project files by the id of the process that opened them
+
+
+def open_work_project():
+    # copy the working ArcGIS Pro project to a temporary project and open its map.
+    # every thread works on a private copy, as the map is modified for every dataset
+    project_file = os.path.join(tempfile.gettempdir(), f"harvest_{os.getpid()}_{uuid.uuid4().hex}.aprx")
+    shutil.copy(aprx_base, project_file)
+    project_files.setdefault(os.getpid(), []).append(project_file)
+    with arcpy_lock:
+        project = arcpy.mp.ArcGISProject(project_file)
+        return project, project.listMaps()[0]
+
+
+def get_map():
+    # returns the map of the working project of the current thread. the project is only
+    # opened when the first layer file is generated, and again in a forked process
+    if getattr(work_projects, 'pid', None) != os.getpid():
+        work_projects.aprx, work_projects.the_map = open_work_project()
+        work_projects.pid = os.getpid()
+    return work_projects.the_map
+
+
+def remove_work_projects(pid=None):
+    # remove the temporary project files opened by the threads of this process, or
+    # those of the worker process pid that was terminated
+    if pid is None:
+        work_projects.__dict__.clear()
+        names = project_files.pop(os.getpid(), [])
+    else:
+        names = glob.glob(os.path.join(tempfile.gettempdir(), f"harvest_{pid}_*.aprx"))
+    for project_file in names:
+        try:
+            os.remove(project_file)
+        except OSError:
+            pass
+
+
+atexit.register(remove_work_projects)
+
 
-log = sys.stdout  # Log stream
+def get_spatial_reference(wkid):
+    # returns the arcpy.SpatialReference for wkid, created once per wkid
+    sr = spatial_references.get(wkid)
+    if sr is None:
+        with arcpy_lock:
+            sr = arcpy.SpatialReference(wkid)
+        spatial_references[wkid] = sr
+    return sr
+
+
+def get_wkid(wkt):
+    # returns the well-known id of the CRS described by wkt, or None. WKT that is not in
+    # the lookup table is resolved by arcpy, once per distinct WKT
+    wkid = wkid_from_wkt(wkt)
+    if wkid is None and wkt:
+        if wkt not in wkids_by_wkt:
+            try:
+                with arcpy_lock:
+                    sr = arcpy.SpatialReference()
+                    sr.loadFromString(wkt)
+                    wkids_by_wkt[wkt] = sr.factoryCode or None
+            except (RuntimeError, ValueError) as e:
+                log.warning("cannot resolve the coordinate system %s: %s", wkt, e)
+                wkids_by_wkt[wkt] = None
+        wkid = wkids_by_wkt[wkt]
+    return wkid
+
+
+def get_transformation(in_wkid, wkid):
+    # returns the name of the geographic transformation from in_wkid to wkid, or None
+    # if both use the same datum. looked up once per pair of wkids
+    key = (in_wkid, wkid)
+    if key not in transformations:
+        with arcpy_lock:
+            names = arcpy.ListTransformations(get_spatial_reference(in_wkid), get_spatial_reference(wkid))
+        transformations[key] = names[0] if names else None
+    return transformations[key]
+
+
+@contextlib.contextmanager
+def arcpy_call(stage):
+    # an ArcGIS call: holds arcpy_lock, is timed as stage and is guarded by the call budget
+    with arcpy_lock, metrics.time(stage), guard(stage):
+        yield
+
+
+def get_projected_extents(extents, in_wkid, wkid=4326):
+    # projects many extents that share the same source CRS in a single call.
+    # extents = list of extents (anything with XMin, YMin, XMax, YMax)
+    # in_wkid = well-known id of the source extents
+    # wkid = well-known id of output coordinate reference system (default to 4326)
+    # returns a list with a ProjectedExtent for every extent, None for empty extents
+
+    if in_wkid == wkid:
+        return [None if None in (e.XMin, e.YMin, e.XMax, e.YMax) else ProjectedExtent(e.XMin, e.YMin, e.XMax, e.YMax)
+                for e in extents]
+
+    keys = [(e.XMin, e.YMin, e.XMax, e.YMax, in_wkid, wkid) for e in extents]
+    missing = [key for key in dict.fromkeys(keys)
+               if key not in projected_extents and None not in key[:4]]
+
+    if missing:
+        # convert the extents into a multipoint of their diagonal corners and project
+        # all of them at once. adjacent tiles share corners and the corners of a point
+        # dataset coincide, every distinct corner is projected once. the projected points
+        # are only matched to the corners if arcpy returned all of them, in order
+        corners = list(dict.fromkeys(corner for key in missing for corner in [key[0:2], key[2:4]]))
+        with arcpy_lock:
+            e_points = [arcpy.Point(x, y) for x, y in corners]
+            e_geometry = arcpy.Multipoint(arcpy.Array(e_points), get_spatial_reference(in_wkid))
+
+            # project the geometry and get the projected extents
+            transformation = get_transformation(in_wkid, wkid)
+            with arcpy_call('project'):
+                if transformation:
+                    e_proj = e_geometry.projectAs(get_spatial_reference(wkid), transformation)
+                else:
+                    e_proj = e_geometry.projectAs(get_spatial_reference(wkid))
+            if e_proj is None or e_proj.pointCount != len(corners):
+                raise RuntimeError(f"{len(corners)} corners projected to "
+                                   f"{e_proj.pointCount if e_proj is not None else 0} points")
+            p_points = e_proj.getPart()
+            projected = {corner: (p_points.getObject(i).X, p_points.getObject(i).Y) for i, corner in enumerate(corners)}
+
+        if len(projected_extents) + len(missing) > projected_extents_size:
+            projected_extents.clear()
+        for key in missing:
+            (x1, y1), (x2, y2) = projected[key[0:2]], projected[key[2:4]]
+            projected_extents[key] = ProjectedExtent(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+    return [projected_extents.get(key) for key in keys]
 
 
 def get_projected_extent(e, in_wkid, wkid=4326):
@@ -203,237 +421,338 @@ def get_projected_extent(e, in_wkid, wkid=4326):
     # in_wkid = well-known id of the source extent
     # wkid = well-known id of output coordinate reference system (default to 4326)
 
-    in_sr = arcpy.SpatialReference(in_wkid)
-    out_sr = arcpy.SpatialReference(wkid)
+    e_proj = get_projected_extents([e], in_wkid, wkid)[0]
+    if e_proj is None:
+        raise ValueError(f"empty extent {e}")
 
-    # convert the extent into a geometry
-    # either as polygon of all 4 points or as a diagonal polyline
-    e_points = [
-        arcpy.Point(e.XMin, e.YMin),
-        arcpy.Point(e.XMax, e.YMax),
-        ]
-    e_geometry = arcpy.Polyline(arcpy.Array(e_points), in_sr)
+    return e_proj
 
-    # project the geometry and get the projected extent
-    e_proj = e_geometry.projectAs(out_sr).extent
 
-    return e_proj
+def get_source_wkid(record):
+    # the well-known id of the CRS of a dataset, the default CRS if the dataset has none
+    if record.wkid is None or record.wkid < 1:
+        return default_src_wkid
+    return record.wkid
 
 
-def publish_metadata(metadata):
-    # use HTTP PUT on the Geoportal Server API to add this metadata to the catalog
+def project_extents(records):
+    # projects the extents of many datasets with one call per source CRS, so that
+    # generate_metadata finds them in projected_extents
+    extents = {}
+    for record in records:
+        if record.extent is not None:
+            extents.setdefault(get_source_wkid(record), []).append(record.extent)
+    for in_wkid, group in extents.items():
+        try:
+            get_projected_extents(group, in_wkid, 4326)
+        except (RuntimeError, ValueError) as e:
+            # generate_metadata projects them one at a time and reports the extents that fail
+            log.debug("cannot project %s extents from %s together: %s", len(group), in_wkid, e)
 
-    r = requests.put(url=server, data=metadata, auth=auth, headers=headers)
-    print(f"{r.status_code} - {r.text}\n'")
 
+def get_publisher():
+    # returns the background publisher of this process, started on first use
 
-def get_hierarchy_from_file(f):
-    # returns the folder hierarchy from file f
-    # example:
-    #   C:/data/arcgis/USA\USFS_AdministrativeRegion.mxd
-    # results in:
-    #   C|data|arcgis|USA|USFS_AdministrativeRegion.mxd
+    global publisher
+    if publisher is None:
+        publisher = Publisher(server, auth=auth, headers=headers, **publisher_options)
+    return publisher
 
-    hierarchy = os.path.dirname(f).split(start_dir)[-1].replace("\\\\", "\\").replace("\\", "|").replace("/", "|")[1:]
-    # print(f"hierarchy = {hierarchy}")
-    return hierarchy
 
+def publish_metadata(metadata, item_id=None, on_done=None):
+    # use HTTP PUT on the Geoportal Server API to add this metadata to the catalog.
+    # the document is queued and uploaded in the background, so the crawl can continue
 
-def combine_element(f_xml, t_xml):
-    # This function recursively updates either the text or the children
-    # of an element if another element is found in `one`, or adds it
-    # from `other` if not found.
+    get_publisher().submit(metadata, item_id, on_done)
 
-    # Create a mapping from tag name to element, as that's what we are fltering with
-    mapping = {el.tag: el for el in f_xml}
-    for el in t_xml:
-        if len(el) == 0:
-            # Not nested
-            try:
-                # Update the text
-                mapping[el.tag].text = el.text
-            except KeyError:
-                # An element with this name is not in the mapping
-                mapping[el.tag] = el
-                # Add it
-                f_xml.append(el)
-        else:
-            try:
-                # Recursively process the element, and update it in the same way
-                combine_element(mapping[el.tag], el)
-            except KeyError:
-                # Not in the mapping
-                mapping[el.tag] = el
-                # Just add it
-                f_xml.append(el)
 
+def close_publisher():
+    # wait for all queued documents to be published
 
-def merge_metadata(f_metadata, t_metadata):
-    # merges existing metadata for datasets with what was extracted by this script
-    # removes FGDC metadata elements, since we're publishing ArcGIS XML metadata
+    global publisher
+    if publisher is not None:
+        publisher.close()
+        publisher = None
 
-    merged_metadata = ""
 
-    f_xml = ElementTree.fromstring(f_metadata)  # geodatabase metadata
-    t_xml = ElementTree.fromstring(t_metadata)  # template-based metadata
+def export_metadata(md_file_id, metadata, f):
+    # write the metadata to the bundle instead of publishing it, see harvest_bundle.py
 
-    # merge the metadata from the geodatabase and the template
-    f_xml.extend(t_xml)
-    merged_metadata = ElementTree.tostring(f_xml).decode('UTF-8').replace("\\", "/").replace("\n", "")
+    global bundle_writer
+    if bundle_writer is None:
+        bundle_writer = BundleWriter(**bundle_options)
+    bundle_writer.write(md_file_id, metadata, f)
 
-    # stripping FGDC metadata elements
-    merged_metadata = re.sub(r"<idinfo>.*</idinfo>", " ", merged_metadata)
-    merged_metadata = re.sub(r"<dataqual>.*</dataqual>", " ", merged_metadata)
-    merged_metadata = re.sub(r"<spdoinfo>.*</spdoinfo>", " ", merged_metadata)
-    merged_metadata = re.sub(r"<spref>.*</spref>", " ", merged_metadata)
-    merged_metadata = re.sub(r"<eainfo>.*</eainfo>", " ", merged_metadata)
-    merged_metadata = re.sub(r"<distinfo>.*</distinfo>", " ", merged_metadata)
-    merged_metadata = re.sub(r"<metainfo>.*</metainfo>", " ", merged_metadata)
-    merged_metadata = re.sub(r"<smusrdef>.*</smusrdef>", " ", merged_metadata)
 
-    print(f"merged_metadata = {merged_metadata}")
+def close_bundle():
+    # close the chunk of this process and write its part of the bundle manifest
 
-    return merged_metadata
+    global bundle_writer
+    if bundle_writer is not None:
+        bundle_writer.close()
+        bundle_writer = None
 
 
-def generate_layer_file(folder, data_file):
-    # generates an ArcGIS Pro layer file (.lyrx) for the dataset.
-    # the dataset is added to an empty ArcGIS Pro project file.
-    # this function then generates the path to the layer file as it will be
-    # referenced in the metadata. It exports the layer file to the current
-    # workspace. For some datasets, the reference to the dataset needs to be
-    # updated as the layer file in the sink folder (the one that should have a URL
-    # and is referenced in the metadata) is not in the same location as the
-    # dataset itself. Finally, the layer of the data_file is removed from
-    # the ArcGIS Pro project file
+def get_md_file_id(f):
+    # the mdFileID of the metadata of dataset f
+    return f"file://{f}"
+
+
+def start_reconcile(run):
+    # start a reconciled run: forget the published documents that are missing from
+    # the catalog, so that they are published again
+    global reconcile_run
+    reconcile_run = run
+    catalog_ids = fetch_catalog_ids(server, auth)
+    if catalog_ids is not None:
+        forgotten = manifest.retain_published(catalog_ids)
+        log.info("catalog: %s items, %s published documents missing", len(catalog_ids), forgotten)
+
+
+def delete_stale_items():
+    # delete the catalog items of the datasets that were not seen in this run. after
+    # errors in the discovery, not seeing a dataset does not mean it no longer exists,
+    # and the items of geodatabases that could not be walked are kept
+    if metrics.value('errors', 'discover'):
+        log.warning("not deleting items, the discovery of the folders was incomplete")
+        return
+    if metrics.value('errors', 'walk') > len(unwalked_geodatabases):
+        log.warning("not deleting items, geodatabases that could not be walked are not known")
+        return
+    for gdb in sorted(unwalked_geodatabases):
+        log.warning("not deleting the items of %s, it could not be walked", gdb)
+    stale = manifest.stale_published(reconcile_run, keep=[get_md_file_id(gdb) for gdb in unwalked_geodatabases])
+    log.info("deleting %s items of datasets that no longer exist", len(stale))
+    for item_id in stale:
+        get_publisher().delete(item_id, on_done=lambda item_id=item_id: forget_item(item_id))
 
-    f = os.path.join(folder, data_file)
-    desc = arcpy.Describe(f)
-    print(f"Parsing = {data_file}")
 
-    # generate the layer file
+def forget_item(item_id):
+    # forgets a deleted catalog item in the manifest and the metadata index
+    manifest.forget_published(item_id)
+    if metadata_index is not None:
+        metadata_index.remove(item_id)
+
+
+def get_data_time(record):
+    # the modification time of the dataset, used for the dates in its metadata so that
+    # the metadata of an unchanged dataset is the same on every run. None if unknown
+    if record.fingerprint is not None:
+        return datetime.fromtimestamp(record.fingerprint[1] / 1e9)
     try:
-        layer = the_map.addDataFromPath(f)
-    except RuntimeError as e:
-        print(f"RuntimeError: {e}")
-        return ""
+        return datetime.fromtimestamp(os.stat(record.path).st_mtime)
+    except OSError:
+        return None
 
-    dataset_file_name = os.path.join(folder, data_file)
-    lyr_file_name = os.path.splitext(dataset_file_name)[0].replace('.sde/', '_sde/').replace('.gdb/', '_gdb/').replace('\\', '/') \
-                    + '_' + os.path.splitext(dataset_file_name)[-1].replace('.', '') + '.lyrx'
-    print(f"dataset_file_name = {dataset_file_name}")
 
+def get_hierarchy_from_file(f):
+    # returns the folder hierarchy from file f
+    # example:
+    #   C:/data/arcgis/USA\USFS_AdministrativeRegion.mxd
+    # results in:
+    #   C|data|arcgis|USA|USFS_AdministrativeRegion.mxd
+
+    hierarchy = os.path.dirname(f).split(start_dir)[-1].replace("\\\\", "\\").replace("\\", "|").replace("/", "|")[1:]
+    return hierarchy
+
+
+def read_dataset_header(f, dataset_fingerprint=None):
+    # returns the DatasetRecord of dataset f read from its file header without arcpy,
+    # or None if there is no header reader for the format or the header cannot be read
+    extension = os.path.splitext(f)[1].lower()
+    try:
+        if extension in ['.las', '.laz'] and os.path.isfile(f):
+            with metrics.time('read_header'):
+                header = read_las_header(f)
+                record = DatasetRecord.from_las_header(f, header, dataset_fingerprint)
+                if record.wkid is None:
+                    record.wkid = get_wkid(header.wkt)
+            return record
+        elif extension == '.shp' and os.path.isfile(f):
+            with metrics.time('read_header'):
+                header = read_shapefile_header(f)
+                return DatasetRecord.from_shapefile_header(f, header, get_wkid(header.wkt), dataset_fingerprint)
+    except (OSError, ValueError, struct.error) as e:
+        log.warning("cannot read the header of %s, using arcpy: %s", f, e)
+    return None
+
+
+def describe_dataset(f, dataset_fingerprint=None):
+    # returns the DatasetRecord of dataset f. the record is read from the file header
+    # for the formats that have a header reader, otherwise described once with
+    # arcpy.da.Describe, and cached on the path and fingerprint of the dataset, in
+    # memory and, in incremental mode, in the manifest for the next runs
+
+    record = dataset_records.get(f)
+    if record is not None and dataset_fingerprint is not None and record.fingerprint == dataset_fingerprint:
+        return record
+
+    record = manifest.get_record(f, dataset_fingerprint) if manifest is not None else None
+    if record is None:
+        record = read_dataset_header(f, dataset_fingerprint)
+        if record is None:
+            with arcpy_call('describe'):
+                describe_dict = arcpy.da.Describe(f)
+            record = DatasetRecord.from_describe(f, describe_dict, dataset_fingerprint)
+        if manifest is not None:
+            manifest.put_record(record)
+
+    if dataset_fingerprint is not None:
+        if len(dataset_records) >= dataset_records_size:
+            dataset_records.clear()
+        dataset_records[f] = record
+    return record
+
+
+def get_layer_file_name(folder, data_file):
+    # returns the name of the layer file next to the dataset.
     # if the workspace is a file geodatabase or enterprise geodatabase, the layer file
     # cannot be stored inside the workspace itself. In this case, create a folder
     # with name similar to the geodatabase name to put the lyrx in.
-    if any(word in lyr_file_name for word in [".sde", ".gdb"]):
+
+    dataset_file_name = os.path.join(folder, data_file)
+    log.debug("dataset_file_name = %s", dataset_file_name)
+
+    normalized_name = dataset_file_name.replace('\\', '/')
+    gdb_match = re.search(r'\.(sde|gdb)/', normalized_name)
+    if gdb_match:
         # If the folder doesn't exist yet, create it here
-        gdb_lyrx_folder = lyr_file_name.rsplit('.', 2)[0] + ".gdb_layers"
-        print(f"creating folder {gdb_lyrx_folder}")
+        gdb_lyrx_folder = normalized_name[:gdb_match.start()] + ".gdb_layers"
         if not os.path.exists(gdb_lyrx_folder):
+            log.debug("creating folder %s", gdb_lyrx_folder)
             Path(gdb_lyrx_folder).mkdir(parents=True, exist_ok=True)
 
         lyr_file_name = os.path.join(gdb_lyrx_folder, data_file) + '_fc.lyrx'
+    else:
+        lyr_file_name = os.path.splitext(normalized_name)[0] + '_' + os.path.splitext(normalized_name)[-1].replace('.', '') + '.lyrx'
 
-    print(f"lyr_file_name     = {lyr_file_name}")
+    log.debug("lyr_file_name = %s", lyr_file_name)
+    return lyr_file_name
 
-    # if the layer file already existed, remove it now if so set
-    lyr_file = ""
-    if os.path.exists(lyr_file_name):
-        if overwrite_lyrx:
-            # remove existing layer file and save dataset to a layer file locally with the data
-            os.remove(lyr_file_name)
-            lyr_file = layer.saveACopy(lyr_file_name)
-        else:
-            lyr_file = lyr_file_name
-    else:
-        # save to a new layer file locally with the data
-        lyr_file = layer.saveACopy(lyr_file_name)
 
-    print(f"lyr_file = {lyr_file_name}")
+def save_layer_file(f, lyr_file_name):
+    # adds the dataset to the map of the working project and saves it as a layer file,
+    # through a temporary file so that the layer file is replaced atomically.
+    # the layer of the dataset is removed from the map again
+    # returns False if ArcGIS cannot add the dataset to a map
 
-    # now save a copy of the layer file to the web-accessible folder
-    # overwriting a pre-existing version of the layer file again
-    dataset_download_name = os.path.join(sink_folder, os.path.basename(lyr_file))
-    # print(f"lyr_download_name = {dataset_download_name}")
-    lyr_download_name = os.path.splitext(dataset_download_name)[0] + '.lyrx'
-    if os.path.exists(lyr_download_name):
-        os.remove(lyr_download_name)
-    lyr_file_copy = layer.saveACopy(dataset_download_name)
+    the_map = get_map()
+    try:
+        with arcpy_call('add_data'):
+            layer = the_map.addDataFromPath(f)
+    except RuntimeError as e:
+        log.error("cannot add %s to a map: %s", f, e)
+        metrics.count('errors', 'add_data')
+        return False
 
-    # fix data source to be absolute for the download version
-    connection_string = ""
-    lyr_json = {}
-    with open(lyr_file_copy) as lyrx_json_file:
-        lyr_json = json.load(lyrx_json_file)
-        print(f"type = {desc.dataType}")
-
-        if desc.dataType in ["ShapeFile"]:
-            lyr_json["layerDefinitions"][0]["featureTable"]["dataConnection"]["workspaceConnectionString"] = f"DATABASE={folder}"
-        elif desc.dataType in ["RasterDataset", "LasDataset"]:
-            lyr_json["layerDefinitions"][0]["dataConnection"]["workspaceConnectionString"] = f"DATABASE={folder}"
-        elif desc.dataType in ["FeatureClass"]:
-            print(f"desc = {desc}")
-        else:
-            print(f"ERROR - Unknown Data Type: {desc.dataType}")
+    try:
+        tmp_lyr_file_name = os.path.splitext(lyr_file_name)[0] + '.' + uuid.uuid4().hex + '.lyrx'
+        with arcpy_call('save_layer'):
+            layer.saveACopy(tmp_lyr_file_name)
+        os.replace(tmp_lyr_file_name, lyr_file_name)
+    finally:
+        with arcpy_lock:
+            the_map.removeLayer(layer)
+    return True
 
-    with open(lyr_file_copy, 'w') as lyrx_json_file:
-        json.dump(lyr_json, lyrx_json_file)
 
-    the_map.removeLayer(layer)
+def generate_layer_file(folder, data_file, record=None):
+    # generates an ArcGIS Pro layer file (.lyrx) for the dataset.
+    # the dataset is added to an empty ArcGIS Pro project file and saved as a layer
+    # file next to the dataset. this function then generates the path to the layer
+    # file as it will be referenced in the metadata. The copy of the layer file in the
+    # sink folder (the one that should have a URL and is referenced in the metadata) is
+    # derived from the layer file next to the dataset: for some datasets, the reference
+    # to the dataset needs to be updated as the sink folder is not in the same location
+    # as the dataset itself. In synthesize_lyrx mode, layer files of shapefiles, rasters
+    # and LAS datasets are generated from a template without using the ArcGIS Pro project.
+    # In metadata_only mode, no layer files are written and the metadata links to the
+    # layer files of an earlier run.
 
-    # metadata = get_metadata(f, desc, lyr_file_copy, lyr_download_name)
-    return f, desc, lyr_file_copy, lyr_download_name
+    f = os.path.join(folder, data_file)
+    if record is None:
+        record = describe_dataset(f, fingerprint(f))
+    log.debug("parsing = %s", f)
+
+    lyr_file_name = get_layer_file_name(folder, data_file)
+    lyr_file_copy = os.path.join(sink_folder, os.path.basename(lyr_file_name))
+    lyr_download_name = os.path.splitext(lyr_file_copy)[0] + '.lyrx'
+    if metadata_only:
+        return f, record, lyr_file_copy, lyr_download_name
+
+    # if the layer file already existed, reuse it unless so set
+    lyr_json = None
+    if os.path.exists(lyr_file_name) and not overwrite_lyrx:
+        lyr_json = read_json(lyr_file_name)
+    elif synthesize_lyrx:
+        lyr_json = layer_templates.synthesize(record, folder, data_file)
+        if lyr_json is not None:
+            write_json_atomic(lyr_file_name, lyr_json)
+
+    if lyr_json is None:
+        # save to a new layer file locally with the data
+        if not save_layer_file(f, lyr_file_name):
+            return ""
+        lyr_json = read_json(lyr_file_name)
+        if synthesize_lyrx:
+            layer_templates.learn(record, lyr_json)
 
+    # now write the copy of the layer file to the web-accessible folder
+    # overwriting a pre-existing version of the layer file again
+    # fix data source to be absolute for the download version
+    if not patch_connection(lyr_json, record.data_type, folder):
+        if record.data_type not in ["FeatureClass"]:
+            log.warning("unknown data type %s of %s", record.data_type, f)
 
-def generate_metadata(f, desc, lyr_file_copy, lyr_download_name):
+    write_json_atomic(lyr_file_copy, lyr_json)
+
+    return f, record, lyr_file_copy, lyr_download_name
+
+
+def generate_metadata(f, record, lyr_file_copy, lyr_download_name):
     # generate metadata for the dataset f, but use lyr_file_copy as the link in the metadata
 
     file_path = os.path.basename(lyr_file_copy)
     file_path_no_drive = file_path.split(":")[-1]
     link = waf_base + f"{file_path_no_drive}"
-    file_link = f"file://{f}"
-    # print(f"link = {link}")
+    file_link = get_md_file_id(f)
 
-    now = datetime.now()
-    this_day_time = now.strftime("%Y-%m-%dT%H:%M:%S")
-    this_day = now.strftime("%Y%m%d")
-    this_time = now.strftime("%H%M%S")
+    data_time = get_data_time(record)
+    this_day_time = data_time.strftime("%Y-%m-%dT%H:%M:%S") if data_time else ''
+    this_day = data_time.strftime("%Y%m%d") if data_time else ''
+    this_time = data_time.strftime("%H%M%S") if data_time else ''
 
     # store hierarchy and data type as keywords
     hierarchy = get_hierarchy_from_file(f)
-    search_keys = ''  # '<keyword>' + hierarchy + '</keyword>'
-    search_keys += '<keyword>' + desc.dataType + '</keyword>'
+    search_keys = []  # [make_element('keyword', hierarchy)]
+    search_keys.append(make_element('keyword', record.data_type))
 
     # get the title and clean it from unallowed characters
-    title = re.sub(r"[_\.\$]", " ", desc.baseName)
+    title = re.sub(r"[_\.\$]", " ", record.base_name)
 
     # get the description. add LAS attributes here
-    description = f"description {desc.baseName} is of type {desc.dataType}"
-    if desc.dataType == "LasDataset":
-        description += f". constraintCount = {desc.constraintCount}, fileCount = {desc.fileCount}, hasStatistics = {desc.hasStatistics}, needsUpdateStatistics = {desc.needsUpdateStatistics}, pointCount = {desc.pointCount}"
+    description = f"description {record.base_name} is of type {record.data_type}"
+    if record.data_type == "LasDataset" and record.las:
+        description += ". " + ", ".join(f"{name} = {value}" for name, value in record.las.items())
 
     # get extent. the default CRS needs to be set at the top of this script
-    extent = desc.extent
-    src_wkid = desc.SpatialReference.factoryCode
-    if src_wkid is None:
-        src_wkid = default_src_wkid
-    elif src_wkid < 1:
-        src_wkid = default_src_wkid
-    print(f"Source wkid = {src_wkid}, converting to 4326 for boudning box")
-
-    try:
-        extent_4326 = get_projected_extent(extent, src_wkid, 4326)
-        xmin = min(max(extent_4326.XMin if extent_4326.XMin is not None else -180, -180), 180)
-        xmax = max(min(extent_4326.XMax if extent_4326.XMax is not None else 180, 180), -180)
-        ymin = min(max(extent_4326.YMin if extent_4326.YMin is not None else -90, -90), 90)
-        ymax = max(min(extent_4326.YMax if extent_4326.YMax is not None else 90, 90), -90)
-
-    except:
-        xmin = -180
-        xmax = 180
-        ymin = -90
-        ymax = 90
+    extent = record.extent
+    src_wkid = get_source_wkid(record)
+
+    xmin, ymin, xmax, ymax = -180, -90, 180, 90
+    if extent is not None:
+        try:
+            extent_4326 = get_projected_extent(extent, src_wkid, 4326)
+            xmin = min(max(extent_4326.XMin if extent_4326.XMin is not None else -180, -180), 180)
+            xmax = max(min(extent_4326.XMax if extent_4326.XMax is not None else 180, 180), -180)
+            ymin = min(max(extent_4326.YMin if extent_4326.YMin is not None else -90, -90), 90)
+            ymax = max(min(extent_4326.YMax if extent_4326.YMax is not None else 90, 90), -90)
+        except ValueError:
+            # empty extent, e.g. a feature class without features
+            pass
+        except RuntimeError as e:
+            log.warning("cannot project the extent of %s from %s: %s", f, src_wkid, e)
+            metrics.count('errors', 'project')
 
     # fill content structure that will be put into the metadata template
     content = {
@@ -463,104 +782,784 @@ def generate_metadata(f, desc, lyr_file_copy, lyr_download_name):
         'linkage': link,
         'file_link': file_link
     }
-    # print(f"content => {content}")
-    t_metadata = metadata_template.substitute(content)
+    with metrics.time('render'):
+        t_metadata = metadata_template.render(content)
 
     # if the data already has metadata (e.g. in geodatabase), fetch it
     # and merge the above templetized metadata with it
-    metadata = t_metadata
-    f_metadata = arcpy.metadata.Metadata(f)
-    if f_metadata:
-        # metadata = merge_metadata(f_metadata.xml, t_metadata)
-        f_xml = ElementTree.fromstring(metadata)  # geodatabase metadata
-        t_xml = ElementTree.fromstring(f_metadata.xml)  # template-based metadata
-
-        combine_element(f_xml, t_xml)
-    metadata = ElementTree.tostring(f_xml, encoding='unicode', method='xml')
+    # FGDC sections of the existing metadata are dropped while merging
+    with arcpy_call('read_metadata'):
+        f_metadata = arcpy.metadata.Metadata(f)
+        f_xml = f_metadata.xml if f_metadata else None
+    with metrics.time('merge'):
+        m_xml = merge_metadata(t_metadata, f_xml)
+        metadata = ElementTree.tostring(m_xml, encoding='unicode', method='xml')
 
     xml_download_name = lyr_download_name + '.xml'
     with open(xml_download_name, 'w') as xml_file:
         xml_file.write(metadata)
-        print(f"xml_file => {xml_file}")
+    log.debug("xml_file = %s", xml_download_name)
+    if metadata_index is not None:
+        with metrics.time('index'):
+            metadata_index.add(file_link, title, hierarchy, record.data_type, (xmin, ymin, xmax, ymax),
+                               path=f, link=link, xml=xml_download_name, item_id=get_item_id(file_link))
 
     return metadata
 
 
-def parse_workspace(workspace):
-    # parse a single folder as a workspace
-    print(f"workspace = {workspace}")
-
-    arcpy.env.workspace = workspace
+def describe_stage(job):
+    # first stage of a dataset: describe the dataset. in incremental mode, datasets
+    # that did not change since the last run are dropped here and their existing
+    # layer file and metadata file are reused
+    f = os.path.join(job['workspace'], job['dataset'])
+    job['f'] = f
+    job['fingerprint'] = fingerprint(f)
+    published = True
+    if reconcile_run is not None:
+        item_id = get_item_id(get_md_file_id(f))
+        manifest.mark_seen(item_id, reconcile_run)
+        published = manifest.published_hash(item_id) is not None
+    if incremental and published and manifest.is_unchanged(f, job['fingerprint']):
+        log.debug("unchanged = %s", f)
+        metrics.count('skipped', 'unchanged')
+        return None
+    if manifest is not None:
+        job['attempts'] = manifest.quarantine_attempts(f)
+        if job['attempts'] >= max_attempts:
+            log.warning("quarantined = %s", f)
+            metrics.count('skipped', 'quarantined')
+            return None
+
+    job['record'] = describe_dataset(f, job['fingerprint'])
+    job['data_type'] = job['record'].data_type
+    return job
+
+
+def layerize_stage(job):
+    # generate the layer files of the dataset
+    result = generate_layer_file(job['workspace'], job['dataset'], job['record'])
+    if not result:
+        return None
+
+    job['f'], job['record'], job['lyr_file_copy'], job['lyr_download_name'] = result
+    return job
+
+
+def render_stage(job, keep_document=True):
+    # generate the metadata of the dataset and write it next to the layer file.
+    # without keep_document the publish stage reads the document back from disk,
+    # so that jobs waiting to be published hold no more than a few paths
+    metadata = generate_metadata(job['f'], job['record'], job['lyr_file_copy'], job['lyr_download_name'])
+    job['xml_file'] = job['lyr_download_name'] + '.xml'
+    job['metadata'] = metadata if keep_document else None
+    job['record'] = None
+    if len(metadata) == 0:
+        job['xml_file'] = None
+    return job
+
+
+def publish_stage(job):
+    # publish the metadata of the dataset, or add it to the bundle in export mode,
+    # and record it in the manifest. a published dataset is only recorded once its
+    # document was accepted by Geoportal, so that a failed upload is retried by the next run
+    metadata = job.get('metadata')
+    if metadata is None and job['xml_file'] is not None:
+        with open(job['xml_file']) as xml_file:
+            metadata = xml_file.read()
+    f, dataset_fingerprint, lyr_file, attempts = job['f'], job['fingerprint'], job['lyr_file_copy'], job.get('attempts')
+    xml_file = job['lyr_download_name'] + '.xml'
+
+    def harvested():
+        record_dataset(f, dataset_fingerprint, lyr_file, xml_file, attempts)
+
+    if not metadata or bundle_options:
+        if metadata:
+            export_metadata(get_md_file_id(f), metadata, f)
+        harvested()
+    elif reconcile_run is not None:
+        # only publish documents that differ from the published document
+        md_file_id = get_md_file_id(f)
+        item_id = get_item_id(md_file_id)
+        metadata_hash = content_hash(metadata)
+        if manifest.published_hash(item_id) == metadata_hash:
+            metrics.count('skipped', 'unchanged_document')
+            harvested()
+        else:
+            def published():
+                manifest.record_published(item_id, md_file_id, metadata_hash, reconcile_run)
+                harvested()
+            publish_metadata(metadata, item_id, published)
+    else:
+        publish_metadata(metadata, on_done=harvested)
+    metrics.count('datasets', job['data_type'])
+    return job
+
+
+def record_dataset(f, dataset_fingerprint, lyr_file, xml_file, attempts=None):
+    # record a harvested dataset in the manifest and release it from the quarantine
+    if manifest is not None:
+        manifest.record(f, dataset_fingerprint, lyr_file, xml_file)
+        if attempts:
+            manifest.release(f)
+
+
+def process_dataset(workspace, dataset):
+    # generate the layer file and metadata for a single dataset and publish the metadata,
+    # running all stages of the dataset one after another
+
+    job = {'workspace': workspace, 'dataset': dataset}
+    for stage in [describe_stage, layerize_stage, render_stage, publish_stage]:
+        job = stage(job)
+        if job is None:
+            return
+
+
+def list_datasets(workspace):
+    # generator of the (workspace, dataset) pairs of all ArcGIS compatible datasets
+    # in a single folder, file geodatabase or feature dataset. lists through the
+    # process-global arcpy.env.workspace, geodatabases are walked by walk_geodatabase
+    log.info("workspace = %s", workspace)
+
+    # make a list of ArcGIS compatible datasets, feature datasets and rasters while
+    # holding arcpy_lock, arcpy.env.workspace is shared by all threads
+    # datasets are described once, by the describe stage
+    with arcpy_lock:
+        arcpy.env.workspace = workspace
+        datasets = arcpy.ListFeatureClasses()
+        feature_datasets = [feature_dataset for feature_dataset in arcpy.ListDatasets('', 'feature')
+                            if arcpy.Describe(feature_dataset).dataType == "FeatureDataset"]
+        rasters = arcpy.ListRasters()
 
-    # make a list of ArcGIS compatible datasets
-    # then create a layer file for the dataset
-    # then create a metadata file for the layer file
-    # then publish metadata of the layer file to the geoportal
-    datasets = arcpy.ListFeatureClasses()
     for dataset in datasets:
-        desc = arcpy.Describe(dataset)
-        print(f"dataset.dataType = {desc.dataType}")
-
-        f, desc, lyr_file_copy, lyr_download_name = generate_layer_file(workspace, dataset)
-        metadata = generate_metadata(f, desc, lyr_file_copy, lyr_download_name)
-
-        if len(metadata) > 0:
-            publish_metadata(metadata)
+        yield workspace, dataset
 
     # if not inside a Feature Dataset
     # do the same for Feature Datasets and the Feature Classes they contain
-    print(f"Getting feature classes")
-    for feature_dataset in arcpy.ListDatasets('', 'feature'):
-        desc = arcpy.Describe(feature_dataset)
-        print(f"desc.dataType = {desc.dataType}")
-        if desc.dataType == "FeatureDataset":
-            gdb_workspace = arcpy.env.workspace
-            arcpy.env.workspace = workspace + "/" + feature_dataset
-            print(f"crawling feature dataset {feature_dataset}")
-            parse_workspace(workspace + "/" + feature_dataset)
-            arcpy.env.workspace = gdb_workspace
-
-    print(f"Getting rasters")
-    rasters = arcpy.ListRasters()
+    for feature_dataset in feature_datasets:
+        log.debug("crawling feature dataset %s", feature_dataset)
+        yield from list_datasets(workspace + "/" + feature_dataset)
+
     for raster in rasters:
         if raster.endswith('.pmf'):
-            print("ALERT: ArcReader files not supported")
+            log.warning("ArcReader files not supported: %s", raster)
+            metrics.count('skipped', 'unsupported')
             continue
         elif raster.endswith(".cej"):
-            print("ALERT: CityEngine files not supported")
+            log.warning("CityEngine files not supported: %s", raster)
+            metrics.count('skipped', 'unsupported')
             continue
         elif raster.endswith(".ttf"):
-            print("ALERT: Font files not supported")
+            log.warning("Font files not supported: %s", raster)
+            metrics.count('skipped', 'unsupported')
             continue
-        elif raster.endswith(".las"):
-            print(f"LAS file {raster}!")
 
-        f, desc, lyr_file_copy, lyr_download_name = generate_layer_file(workspace, raster)
-        metadata = generate_metadata(f, desc, lyr_file_copy, lyr_download_name)
-        if len(metadata) > 0:
-            publish_metadata(metadata)
+        yield workspace, raster
 
-    print(f"Getting LAS files")
-    lasses = [f for f in os.listdir(workspace) if re.match(r'.*\.las', f)]
+    # feature datasets and enterprise geodatabases are not folders
+    lasses = [f for f in os.listdir(workspace) if re.match(r'.*\.la[sz]$', f, re.IGNORECASE)] if os.path.isdir(workspace) else []
     for las in lasses:
-        print(f"LAS file {las}!")
+        yield workspace, las
+
+
+def quarantine_dataset(f, reason):
+    # puts a dataset that timed out or failed in the quarantine of the manifest.
+    # returns True if it may be tried again
+    metrics.count('quarantined', reason.split(':')[0])
+    if manifest is None:
+        return False
+    return manifest.quarantine(f, reason) < max_attempts
+
+
+def harvest_stages(job, stages):
+    # runs stages of a dataset one after another. returns the job, or None if a stage
+    # dropped the dataset or failed. a dataset that fails is put in the quarantine
+    try:
+        for stage in stages:
+            job = stage(job)
+            if job is None:
+                return None
+    except Exception as e:
+        f = os.path.join(job['workspace'], job['dataset'])
+        log.exception("%s: %s", f, e)
+        metrics.count('errors', 'dataset')
+        quarantine_dataset(f, f"error: {type(e).__name__}: {e}")
+        return None
+    return job
+
+
+def harvest_datasets(items, batch_size=None):
+    # process many (workspace, dataset) pairs in batches: the datasets of a batch are described
+    # and layerized first, then their extents are projected together, see project_extents,
+    # and then their metadata is rendered and published
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, batch_size or projection_batch))
+        if not batch:
+            break
+        jobs = [harvest_stages({'workspace': workspace, 'dataset': dataset}, [describe_stage, layerize_stage])
+                for workspace, dataset in batch]
+        jobs = [job for job in jobs if job is not None]
+        project_extents([job['record'] for job in jobs])
+        for job in jobs:
+            harvest_stages(job, [render_stage, publish_stage])
+
+
+def is_geodatabase(workspace):
+    # True for file geodatabases and enterprise geodatabase connection files
+    return re.search(r'\.(gdb|sde)$', workspace.rstrip('\\/'), re.IGNORECASE) is not None
+
+
+def walk_geodatabase(gdb, lock=arcpy_lock):
+    # returns the (workspace, dataset) pairs of all feature classes and rasters of a file or
+    # enterprise geodatabase, including those in feature datasets, from a single arcpy.da.Walk
+    # pass over one connection. unlike list_datasets, arcpy.env.workspace is not used, so
+    # geodatabases can be walked concurrently with lock=contextlib.nullcontext(), see --walk-threads.
+    # the workspace of a feature class in a feature dataset is <gdb>/<feature dataset>, as listed
+    # by list_datasets
+    datasets = []
+    try:
+        with lock, metrics.time('walk'):
+            for dirpath, _, filenames in arcpy.da.Walk(gdb, datatype=['FeatureClass', 'RasterDataset']):
+                feature_dataset = os.path.relpath(dirpath, gdb)
+                workspace = gdb if feature_dataset == '.' else gdb + "/" + feature_dataset
+                datasets.extend((workspace, name) for name in filenames)
+    except (RuntimeError, OSError) as e:
+        log.error("cannot walk %s: %s", gdb, e)
+        metrics.count('errors', 'walk')
+        unwalked_geodatabases.add(gdb)
+    log.info("workspace = %s, datasets = %s", gdb, len(datasets))
+    return datasets
+
+
+def list_workspace(workspace):
+    # the (workspace, dataset) pairs of a single workspace
+    return walk_geodatabase(workspace) if is_geodatabase(workspace) else list_datasets(workspace)
+
+
+def enumerate_datasets(workspaces, walk_threads=1):
+    # generator of the (workspace, dataset) pairs of all datasets in the workspaces. folders are
+    # listed in this thread while up to walk_threads geodatabases are walked concurrently, their
+    # datasets are yielded in the order of the geodatabases once their walk is done. concurrent
+    # walks do not hold arcpy_lock, they are an opt-in to arcpy calls from several threads
+    if walk_threads <= 1:
+        for workspace in workspaces:
+            yield from list_workspace(workspace)
+        return
+
+    with ThreadPoolExecutor(max_workers=walk_threads, thread_name_prefix="walk") as executor:
+        walks = deque()
+        for workspace in workspaces:
+            if is_geodatabase(workspace):
+                walks.append(executor.submit(walk_geodatabase, workspace, contextlib.nullcontext()))
+            else:
+                yield from list_datasets(workspace)
+            while walks and (walks[0].done() or len(walks) > 2 * walk_threads):
+                yield from walks.popleft().result()
+        while walks:
+            yield from walks.popleft().result()
+
+
+def close_worker():
+    # flush the publisher and manifest of a worker process and remove its working projects
+    close_publisher()
+    close_bundle()
+    if manifest is not None:
+        manifest.close()
+    if metadata_index is not None:
+        metadata_index.close()
+    remove_work_projects()
+
+
+def flush_worker(stage):
+    # called by the watchdog of a worker process whose dataset or ArcGIS call exceeded its
+    # time budget, see harvest_watchdog.py: publish what was rendered before the worker ends
+    log.error("time budget of %s exceeded, ending the worker", stage)
+    close_publisher()
+    close_bundle()
+    remove_work_projects()
+
+
+def configure_layer_files(synthesize, template_folder):
+    # sets up synthesised layer files, see synthesize_lyrx
+    global synthesize_lyrx, lyrx_template_folder, layer_templates
+    synthesize_lyrx = synthesize
+    lyrx_template_folder = template_folder
+    layer_templates = LayerTemplates(template_folder)
+
+
+def configure(**settings):
+    # overrides the configuration at the top of this script, see configuration_names.
+    # settings that are None keep their default
+    for name, value in settings.items():
+        if name not in configuration_names:
+            raise ValueError(f"unknown setting {name}")
+        if value is not None:
+            globals()[name] = value
+
+
+def configure_logging(level='INFO', log_file=None):
+    # sets up the levelled log of this process, to stderr or to log_file
+    logging.basicConfig(level=getattr(logging, level.upper()), format=log_format, filename=log_file, force=True)
+
+
+def worker_settings():
+    # settings of this process that are passed on to the worker processes
+    root = logging.getLogger()
+    log_file = next((h.baseFilename for h in root.handlers if isinstance(h, logging.FileHandler)), None)
+    return {
+        'log_level': logging.getLevelName(root.level),
+        'log_file': log_file,
+        'manifest_path': manifest_path,
+        'index_path': index_path,
+        'publisher_options': dict(publisher_options),
+        'synthesize_lyrx': synthesize_lyrx,
+        'lyrx_template_folder': lyrx_template_folder,
+        'bundle_options': dict(bundle_options),
+        'incremental': incremental,
+        'reconcile_run': reconcile_run,
+        'metadata_only': metadata_only,
+        'max_attempts': max_attempts,
+        'configuration': {name: globals()[name] for name in configuration_names},
+    }
 
-        f, desc, lyr_file_copy, lyr_download_name = generate_layer_file(workspace, las)
-        metadata = generate_metadata(f, desc, lyr_file_copy, lyr_download_name)
-        if len(metadata) > 0:
-            publish_metadata(metadata)
+
+def init_worker(settings):
+    # initialise a worker process of the process pool. every worker gets its own
+    # copy of the working ArcGIS Pro project (opened on first use, see get_map), its
+    # own manifest connection and its own publisher
+    global manifest, metadata_index, incremental, reconcile_run, metadata_only, max_attempts
+
+    configure_logging(settings['log_level'], settings['log_file'])
+    configure(**settings['configuration'])
+    metrics.drain()  # a forked worker starts with the metrics the parent merged so far
+    if settings['manifest_path'] is not None:
+        manifest = Manifest(settings['manifest_path'], commit_interval=1)
+    if settings['index_path'] is not None:
+        metadata_index = MetadataIndex(settings['index_path'], commit_interval=1)
+    publisher_options.update(settings['publisher_options'])
+    configure_layer_files(settings['synthesize_lyrx'], settings['lyrx_template_folder'])
+    bundle_options.update(settings['bundle_options'])
+    incremental = settings['incremental']
+    reconcile_run = settings['reconcile_run']
+    metadata_only = settings['metadata_only']
+    max_attempts = settings['max_attempts']
+
+    # worker processes do not run atexit handlers, use a multiprocessing finalizer instead
+    multiprocessing.util.Finalize(None, close_worker, exitpriority=10)
+
+
+def process_dataset_task(item):
+    # worker process task: process a single (workspace, dataset) pair. returns the
+    # metrics collected by the worker since its previous task, merged by the parent,
+    # and the error of a dataset that failed, which the parent puts in the quarantine.
+    # documents that are still being published when a worker exits are not counted
+    workspace, dataset = item
+    error = None
+    try:
+        process_dataset(workspace, dataset)
+    except Exception as e:
+        log.exception("%s: %s", os.path.join(workspace, dataset), e)
+        metrics.count('errors', 'dataset')
+        error = f"error: {type(e).__name__}: {e}"
+    return {'metrics': metrics.drain(), 'error': error}
+
+
+def is_slow_dataset(item, quarantined=()):
+    # True for datasets that are known to be slow: LAS files, large rasters, datasets in
+    # enterprise geodatabases and datasets that failed before
+    workspace, dataset = item
+    f = os.path.join(workspace, dataset)
+    if f in quarantined or os.path.splitext(dataset)[1].lower() in slow_extensions:
+        return True
+    if re.search(r'\.sde([\\/]|$)', workspace, re.IGNORECASE):
+        return True
+    try:
+        return os.path.getsize(f) >= slow_bytes
+    except OSError:
+        return False
+
+
+def crawl_parallel(workspaces, args):
+    # crawl the workspaces with supervised worker processes, see harvest_watchdog.py.
+    # datasets are listed in this process and handed out one at a time, cheap datasets
+    # first and known-slow datasets to the slow workers. every worker is replaced by a
+    # fresh process after recycle_after datasets, to limit leaks in long-lived ArcGIS
+    # sessions, and when a dataset or ArcGIS call exceeds its time budget. datasets that
+    # time out or fail are put in the quarantine and tried once more at the end
+    quarantined = manifest.quarantined() if manifest is not None else {}
+    slow_workers = args.slow_workers if args.slow_workers is not None else 1
+
+    def on_result(item, result):
+        metrics.merge(result['metrics'])
+        if result['error'] is not None:
+            return quarantine_dataset(os.path.join(*item), result['error'])
+        return False
+
+    def on_timeout(item, stage, pid):
+        remove_work_projects(pid)
+        f = os.path.join(*item)
+        log.error("%s: %s", f, "worker crashed" if stage == 'crashed' else f"time budget of {stage} exceeded")
+        metrics.count('errors', 'timeout' if stage != 'crashed' else 'crashed')
+        return quarantine_dataset(f, f"timeout: {stage}" if stage != 'crashed' else "crashed")
+
+    datasets = enumerate_datasets(workspaces, args.walk_threads)
+    pool = SupervisedPool(process_dataset_task, processes=args.processes, slow_workers=slow_workers,
+                          initializer=init_worker, initargs=(worker_settings(),),
+                          recycle_after=args.recycle_after, dataset_timeout=args.dataset_timeout,
+                          call_timeout=args.call_timeout, on_expired=flush_worker)
+    pool.run(datasets, is_slow=lambda item: is_slow_dataset(item, quarantined),
+             on_result=on_result, on_timeout=on_timeout)
+
+
+def crawl_pipeline(workspaces, stage_workers, queue_size, walk_threads=1):
+    # crawl the workspaces as a staged pipeline: discover -> describe -> layerize -> render -> publish.
+    # the stages run concurrently and are connected by bounded queues. the publish queue only
+    # holds paths, so a slow Geoportal does not hold up discovery and layer file generation
+    datasets = ({'workspace': workspace, 'dataset': dataset}
+                for workspace, dataset in enumerate_datasets(workspaces, walk_threads))
+    stages = [
+        Stage("describe", describe_stage, stage_workers.get('describe', 1), queue_size),
+        Stage("layerize", layerize_stage, stage_workers.get('layerize', 1), queue_size),
+        Stage("render", lambda job: render_stage(job, keep_document=False), stage_workers.get('render', 2), queue_size),
+        Stage("publish", publish_stage, stage_workers.get('publish', 1), 100 * queue_size),
+    ]
+
+    def on_error(job, stage, e):
+        # a dataset that fails is put in the quarantine, as in the other modes
+        quarantine_dataset(os.path.join(job['workspace'], job['dataset']), f"error: {type(e).__name__}: {e}")
+
+    run_pipeline(datasets, stages, on_error)
+
+
+def crawl(workspaces, args):
+    # crawl the workspaces in the mode selected on the command line
+    if args.pipeline:
+        crawl_pipeline(workspaces, args.stage_workers, args.queue_size, args.walk_threads)
+    elif args.processes > 1 or args.dataset_timeout or args.call_timeout:
+        crawl_parallel(workspaces, args)
+    else:
+        # create a layer file for every dataset
+        # then create a metadata file for the layer file
+        # then publish metadata of the layer file to the geoportal
+        harvest_datasets(enumerate_datasets(workspaces, args.walk_threads))
+
+
+def crawl_shared(workspaces, args):
+    # crawl as one of the hosts of a shared crawl, see harvest_leases.py. with --coordinate,
+    # this host also resets the store and discovers the workspaces and records them as
+    # shards, from a background thread so that the hosts can start on the first shards
+    # right away
+    store = LeaseStore(args.leases, lease_seconds=args.lease_seconds)
+
+    def coordinate():
+        relative = (os.path.relpath(workspace, start_dir) for workspace in workspaces)
+        shards = store.add_shards(relative, args.shard_size)
+        log.info("coordinator: %s shards recorded in %s", shards, args.leases)
+
+    def crawl_shard(shard):
+        before = metrics.totals()
+        start = time.monotonic()
+        crawl([os.path.normpath(os.path.join(start_dir, workspace)) for workspace in shard.workspaces], args)
+        after = metrics.totals()
+        result = {name: after.get(name, 0) - before.get(name, 0) for name in after}
+        result['seconds'] = time.monotonic() - start
+        return result
+
+    coordinator = None
+    if args.coordinate:
+        # reset before claiming, work() must not see the shards or the seal of the last crawl
+        store.reset(start_dir=start_dir)
+        coordinator = threading.Thread(target=coordinate, name="coordinator", daemon=True)
+        coordinator.start()
+    try:
+        shards = work(store, crawl_shard, poll_interval=min(30, args.lease_seconds / 3.0))
+        log.info("%s shards crawled by this host, shards = %s", shards, store.status())
+    finally:
+        if coordinator is not None:
+            coordinator.join()
+        store.close()
+
+
+def harvest_changes(folder, names):
+    # harvest the datasets of folder that are affected by the changed files in names, or
+    # all datasets of folder if names is None. a dataset is affected by changes to its
+    # own file and its sidecars, unchanged datasets are skipped by the manifest
+    if not os.path.isdir(folder):
+        return
+    if re.search(r'\.gdb$', folder, re.IGNORECASE):
+        # the tables of a file geodatabase do not map to its datasets
+        names = None
+    log.info("changed = %s", folder)
+    clear_caches()  # the fingerprints of the previous batch are out of date
+    def affected(item):
+        stem = os.path.splitext(item[1])[0] + '.'
+        return names is None or any(name == item[1] or name.startswith(stem) for name in names)
+
+    harvest_datasets(filter(affected, list_workspace(folder)))
+
+
+def crawl_watch(args):
+    # keep harvesting the datasets that change below start_dir until interrupted
+    watch(start_dir, harvest_changes, quiet_seconds=args.watch_quiet, poll_interval=args.watch_poll,
+          native=not args.watch_polling, ignored_folders=[sink_folder],
+          prune_hidden=not args.include_hidden, exclude=args.exclude)
+
+
+def list_harvest(workspaces, changed_only=False, walk_threads=1):
+    # prints the datasets of the workspaces, one path per line, without describing them.
+    # with changed_only, datasets that are unchanged in the manifest are left out
+    for workspace, dataset in enumerate_datasets(workspaces, walk_threads):
+        f = os.path.join(workspace, dataset)
+        if changed_only and manifest.is_unchanged(f, fingerprint(f)):
+            metrics.count('skipped', 'unchanged')
+            continue
+        print(f, flush=True)
+        metrics.count('datasets', 'listed')
+
+
+def parse_stage_workers(value):
+    # parses a list of worker counts per stage, e.g. describe=2,render=4
+    stage_workers = {}
+    for option in value.split(','):
+        if option:
+            stage, _, workers = option.partition('=')
+            if stage not in ['describe', 'layerize', 'render', 'publish']:
+                raise argparse.ArgumentTypeError(f"unknown stage {stage}")
+            stage_workers[stage] = int(workers)
+    return stage_workers
+
+
+def parse_arguments():
+    # command line options. options can also be given in a --config file, a JSON object of
+    # option names and values, e.g. {"server": "https://...", "start_dir": "D:\\data", "processes": 4}.
+    # options on the command line take precedence over the --config file
+    parser = argparse.ArgumentParser(description="Crawl a folder structure, generate layer files and metadata and publish the metadata to Geoportal Server")
+    parser.add_argument("--config",
+                        help="JSON file with the options of this harvest, keyed by option name, e.g. start_dir")
+    parser.add_argument("--server",
+                        help=f"URL of the document management API of Geoportal Server (default: {server})")
+    parser.add_argument("--user",
+                        help="user name of the Geoportal account (default: the account at the top of this script)")
+    parser.add_argument("--password", default=os.environ.get('GEOPORTAL_PASSWORD'),
+                        help="password of the Geoportal account (default: $GEOPORTAL_PASSWORD)")
+    parser.add_argument("--start-dir",
+                        help=f"top folder of the data structure that is crawled (default: {start_dir})")
+    parser.add_argument("--sink-folder",
+                        help=f"folder of the virtual directory of the layer files (default: {sink_folder})")
+    parser.add_argument("--waf-base",
+                        help=f"URL of the virtual directory of the sink folder (default: {waf_base})")
+    parser.add_argument("--project",
+                        help=f"ArcGIS Pro project that is copied to add the datasets to a map (default: {aprx_base})")
+    parser.add_argument("--list", action="store_true",
+                        help="only print the datasets below the start folder, nothing is generated or published")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the datasets that would be harvested, e.g. the changed datasets with --incremental")
+    parser.add_argument("--metadata-only", action="store_true",
+                        help="do not generate layer files, publish metadata that links to the layer files of an earlier run")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip datasets that did not change since the last run and reuse their layer file and metadata")
+    parser.add_argument("--manifest",
+                        help=f"manifest of harvested datasets used by --incremental and --reconcile (default: {os.path.basename(manifest_file)} in the sink folder)")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="publish documents with ids derived from their mdFileID, only PUT documents that changed "
+                             "and delete the items of datasets that no longer exist")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="glob pattern of folder names or paths that are not crawled, may be repeated")
+    parser.add_argument("--include-hidden", action="store_true",
+                        help="also crawl hidden folders")
+    parser.add_argument("--walk-threads", type=int, default=1,
+                        help="number of geodatabases that are enumerated concurrently with arcpy.da.Walk. arcpy is not "
+                             "supported from several threads, more than 1 is at your own risk (default: 1)")
+    parser.add_argument("--synthesize-lyrx", action="store_true", default=synthesize_lyrx,
+                        help="generate layer files of shapefiles, rasters and LAS datasets from a per-type template instead of ArcGIS")
+    parser.add_argument("--lyrx-templates",
+                        help="folder with the per-type layer file templates used by --synthesize-lyrx")
+    parser.add_argument("--publish-min-window", type=int, default=1,
+                        help="minimum number of concurrent requests to Geoportal (default: 1)")
+    parser.add_argument("--publish-max-window", type=int, default=16,
+                        help="maximum number of concurrent requests to Geoportal (default: 16)")
+    parser.add_argument("--publish-retries", type=int, default=5,
+                        help="number of retries of a document that could not be published (default: 5)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="number of worker processes, each with a private copy of the ArcGIS Pro project (default: 1)")
+    parser.add_argument("--recycle-after", type=int, default=500,
+                        help="number of datasets after which a worker process is replaced (default: 500)")
+    parser.add_argument("--slow-workers", type=int,
+                        help="number of the worker processes that take the known-slow datasets first, "
+                             "e.g. LAS files and large rasters (default: 1)")
+    parser.add_argument("--dataset-timeout", type=float,
+                        help="seconds after which a dataset is given up and put in the quarantine, "
+                             "datasets are then processed in worker processes")
+    parser.add_argument("--call-timeout", type=float,
+                        help="seconds after which an ArcGIS call (Describe, addDataFromPath, saveACopy, metadata, "
+                             "projection) is given up and its dataset put in the quarantine")
+    parser.add_argument("--max-attempts", type=int, default=max_attempts,
+                        help=f"number of failed attempts after which a dataset in the quarantine is skipped (default: {max_attempts})")
+    parser.add_argument("--clear-quarantine", action="store_true",
+                        help="forget the failed attempts of the datasets in the quarantine, so they are tried again")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="run the describe, layerize, render and publish stages concurrently")
+    parser.add_argument("--stage-workers", type=parse_stage_workers, default={},
+                        help="worker threads per pipeline stage, e.g. render=4,publish=2. the arcpy calls of all "
+                             "stages hold one process-wide lock, more threads only overlap the work without arcpy")
+    parser.add_argument("--queue-size", type=int, default=100,
+                        help="maximum number of datasets waiting for a pipeline stage (default: 100)")
+    parser.add_argument("--leases",
+                        help="SQLite lease store on a shared drive: crawl the shards of a crawl that is shared by several hosts")
+    parser.add_argument("--coordinate", action="store_true",
+                        help="discover the workspaces and record them as shards in the --leases store, then crawl shards too")
+    parser.add_argument("--shard-size", type=int, default=50,
+                        help="number of workspaces per shard of a shared crawl (default: 50)")
+    parser.add_argument("--lease-seconds", type=int, default=300,
+                        help="seconds after which the shard of a host that stopped renewing its lease is reclaimed (default: 300)")
+    parser.add_argument("--watch", action="store_true",
+                        help="after the crawl, keep watching the folders and harvest changed datasets (implies --incremental)")
+    parser.add_argument("--watch-quiet", type=float, default=5.0,
+                        help="seconds without changes before the changed datasets of a folder are harvested (default: 5)")
+    parser.add_argument("--watch-poll", type=float, default=60.0,
+                        help="seconds between two polls of the folders without file system notifications (default: 60)")
+    parser.add_argument("--watch-polling", action="store_true",
+                        help="poll the folders even if file system notifications are available, e.g. on network drives")
+    parser.add_argument("--export",
+                        help="write the metadata to a bundle in this folder instead of publishing it, see harvest_bundle.py")
+    parser.add_argument("--export-format", choices=["ndjson", "zip"], default="ndjson",
+                        help="format of the bundle chunks: gzipped NDJSON or ZIP of XML documents (default: ndjson)")
+    parser.add_argument("--export-chunk", type=int, default=10000,
+                        help="number of documents per bundle chunk (default: 10000)")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="level of the log messages (default: INFO)")
+    parser.add_argument("--log-file",
+                        help="write the log to this file instead of stderr")
+    parser.add_argument("--index",
+                        help=f"local full text and spatial index of the harvested metadata, see harvest_index.py "
+                             f"(default: {os.path.basename(index_file)} in the sink folder)")
+    parser.add_argument("--no-index", action="store_true",
+                        help="do not index the harvested metadata")
+    parser.add_argument("--report",
+                        help=f"JSON run report with the stage timings and counters (default: {os.path.basename(report_file)} in the sink folder)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve the metrics in the Prometheus text format on this port at /metrics")
+    args = parser.parse_args()
+    if args.config:
+        try:
+            with open(args.config) as config_file:
+                config = json.load(config_file)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read {args.config}: {e}")
+        unknown = sorted(set(config) - set(vars(args)))
+        if unknown:
+            parser.error(f"unknown options in {args.config}: {', '.join(unknown)}")
+        parser.set_defaults(**config)
+        args = parser.parse_args()
+    if args.pipeline and (args.processes > 1 or args.dataset_timeout or args.call_timeout):
+        parser.error("--pipeline cannot be combined with --processes, --dataset-timeout or --call-timeout")
+    if args.coordinate and not args.leases:
+        parser.error("--coordinate requires --leases")
+    if args.watch and args.leases:
+        parser.error("--watch and --leases cannot be combined")
+    if args.watch:
+        args.incremental = True
+    if args.reconcile and (args.leases or args.export):
+        parser.error("--reconcile cannot be combined with --leases or --export")
+    if (args.list or args.dry_run) and (args.leases or args.watch or args.export or args.reconcile):
+        parser.error("--list and --dry-run cannot be combined with --leases, --watch, --export or --reconcile")
+    return args
+
+
+def redact_arguments(arguments):
+    # the command line arguments without the value of --password, for the run report
+    redacted = list(arguments)
+    for i, argument in enumerate(redacted):
+        if argument.startswith('--password='):
+            redacted[i] = '--password=***'
+        elif argument == '--password' and i + 1 < len(redacted):
+            redacted[i + 1] = '***'
+    return redacted
 
 
 def main():
-    # build list of folders recursively, skipping file geodatabase folders
-    workspaces = [x[0] for x in os.walk(start_dir)]  # if not (x[0].endswith('.gdb') or ('_alllayers' in x[0]))]
+    global manifest, manifest_path, metadata_index, index_path, incremental, metadata_only, max_attempts
+
+    args = parse_arguments()
+    configure_logging(args.log_level, args.log_file)
+    configure(server=args.server,
+              auth=HTTPBasicAuth(args.user, args.password) if args.user else None,
+              aprx_base=args.project,
+              start_dir=args.start_dir,
+              sink_folder=args.sink_folder,
+              waf_base=args.waf_base)
+    if args.manifest is None:
+        args.manifest = os.path.join(sink_folder, os.path.basename(manifest_file)) if args.sink_folder else manifest_file
+    if args.report is None:
+        args.report = os.path.join(sink_folder, os.path.basename(report_file)) if args.sink_folder else report_file
+    if args.index is None:
+        args.index = os.path.join(sink_folder, os.path.basename(index_file)) if args.sink_folder else index_file
+    metadata_only = args.metadata_only
+    max_attempts = args.max_attempts
+    metrics_server = start_http_server(args.metrics_port) if args.metrics_port is not None else None
+
+    # the quarantine of datasets that timed out or failed is kept in the manifest
+    if args.incremental or args.reconcile or args.dataset_timeout or args.call_timeout or args.clear_quarantine:
+        manifest_path = args.manifest
+        manifest = Manifest(manifest_path)
+        if args.clear_quarantine:
+            manifest.clear_quarantine()
+    if not (args.no_index or args.list or args.dry_run):
+        index_path = args.index
+        metadata_index = MetadataIndex(index_path)
+    incremental = args.incremental
+    if args.reconcile:
+        start_reconcile(datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f"))
+    publisher_options.update(min_window=args.publish_min_window,
+                             max_window=args.publish_max_window,
+                             max_retries=args.publish_retries)
+    configure_layer_files(args.synthesize_lyrx, args.lyrx_templates)
+    if args.export:
+        bundle_options.update(folder=args.export, bundle_format=args.export_format,
+                              records_per_chunk=args.export_chunk)
+
+    # discover folders recursively while crawling, skipping the internals of file geodatabases,
+    # tile caches, hidden and excluded folders. hosts of a shared crawl get their workspaces from the coordinator
+    workspaces = None
+    if not args.leases or args.coordinate:
+        workspaces = discover_workspaces(start_dir, prune_hidden=not args.include_hidden, exclude=args.exclude)
 
     # use only start_dir by turning that into a 1-element list
     # workspaces = [start_dir]
 
     # crawl each of the folders as a workspace
-    for workspace in workspaces:
-        parse_workspace(workspace)
+    mode = 'pipeline' if args.pipeline else 'processes' if args.processes > 1 or args.dataset_timeout or args.call_timeout else 'serial'
+    if args.list or args.dry_run:
+        mode = 'list' if args.list else 'dry_run'
+    try:
+        if args.list or args.dry_run:
+            list_harvest(workspaces, changed_only=args.dry_run and incremental, walk_threads=args.walk_threads)
+        elif args.leases:
+            crawl_shared(workspaces, args)
+        else:
+            crawl(workspaces, args)
+        if args.reconcile:
+            manifest.commit()
+            delete_stale_items()
+        if args.watch:
+            manifest.commit()
+            crawl_watch(args)
+    except KeyboardInterrupt:
+        log.info("interrupted")
+    finally:
+        close_publisher()
+        close_bundle()
+        if args.export:
+            bundle = finish_bundle(args.export, format=args.export_format, source=start_dir)
+            log.info("bundle %s: %s documents in %s chunks", args.export, bundle['records'], len(bundle['chunks']))
+        if manifest is not None:
+            manifest.close()
+        if metadata_index is not None:
+            metadata_index.close()
+        if args.report:
+            metrics.write_report(args.report, mode=mode, start_dir=start_dir, arguments=redact_arguments(sys.argv[1:]))
+        if metrics_server is not None:
+            metrics_server.shutdown()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# asynchronous publisher for the Geoportal Server 2.x document management API.
+# documents are queued by the crawl and uploaded by a pool of background threads
+# over pooled keep-alive connections. the number of requests in flight adapts to
+# the observed latency and to 429/503 responses of the server (additive increase,
+# multiplicative decrease) and failed requests are retried with exponential
+# backoff and jitter. documents are PUT to the item collection, or to
+# item/{id} when the caller chose the id, and items can be deleted by id.
+
+import time
+import random
+import queue
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from harvest_metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+# HTTP status codes that indicate the server is overloaded or temporarily unavailable
+retry_status_codes = {429, 502, 503, 504}
+
+# HTTP status codes that indicate the server wants us to slow down
+throttle_status_codes = {429, 503}
+
+_stop = object()  # queue sentinel that stops a publisher thread
+
+
+class Publisher:
+    # publishes metadata documents with HTTP PUT from background threads
+
+    def __init__(self, url, auth=None, headers=None, min_window=1, max_window=16, initial_window=4,
+                 queue_size=1000, max_retries=5, backoff_base=0.5, backoff_cap=60.0,
+                 latency_factor=3.0, timeout=60, session=None):
+        # url            = document management API, e.g. https://host/geoportal/rest/metadata/item
+        # min_window     = minimum number of requests in flight
+        # max_window     = maximum number of requests in flight, also the size of the connection pool
+        # initial_window = number of requests in flight at start
+        # queue_size     = maximum number of queued documents. submit() blocks when the queue is full
+        # max_retries    = number of retries of a document before it is counted as failed
+        # backoff_base   = first retry delay in seconds, doubled on every retry up to backoff_cap
+        # latency_factor = the window shrinks when latency exceeds latency_factor times the best observed latency
+        self.url = url
+        self.auth = auth
+        self.headers = headers
+        self.min_window = max(1, min_window)
+        self.max_window = max(self.min_window, max_window)
+        self.window = float(min(max(initial_window, self.min_window), self.max_window))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.latency_factor = latency_factor
+        self.timeout = timeout
+
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_window)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.latency = None       # exponentially weighted moving average of the request latency
+        self.best_latency = None  # lowest latency observed, baseline for the latency signal
+        self.last_decrease = 0.0
+
+        self.published = 0
+        self.deleted = 0
+        self.failed = 0
+        self.retries = 0
+
+        self.threads = [threading.Thread(target=self._run, name=f"publisher-{i}", daemon=True)
+                        for i in range(self.max_window)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, metadata, item_id=None, on_done=None):
+        # queue a metadata document for publication. blocks when the queue is full.
+        # item_id = id of the item in the catalog, chosen by the server if None
+        # on_done = called from a publisher thread once the document was published
+        self.queue.put(('PUT', item_id, metadata, on_done))
+
+    def delete(self, item_id, on_done=None):
+        # queue the deletion of an item. on_done is called once the item is gone
+        self.queue.put(('DELETE', item_id, None, on_done))
+
+    def close(self):
+        # wait for all queued documents to be published and stop the background threads
+        for _ in self.threads:
+            self.queue.put(_stop)
+        for thread in self.threads:
+            thread.join()
+        self.session.close()
+        log.info("published = %s, deleted = %s, failed = %s, retries = %s",
+                 self.published, self.deleted, self.failed, self.retries)
+
+    def _acquire(self):
+        # wait for a free slot in the in-flight window
+        with self.condition:
+            while self.in_flight >= int(self.window):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def _release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _increase(self):
+        # additive increase: about one extra slot per window of successful requests
+        with self.condition:
+            self.window = min(self.max_window, self.window + 1.0 / self.window)
+            self.condition.notify_all()
+
+    def _decrease(self):
+        # multiplicative decrease, at most once per observed round trip
+        with self.condition:
+            now = time.monotonic()
+            if now - self.last_decrease < (self.latency or 0.0):
+                return
+            self.last_decrease = now
+            self.window = max(self.min_window, self.window / 2)
+
+    def _observe(self, elapsed):
+        # update the latency statistics, returns True if the server appears congested
+        with self.condition:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            self.best_latency = elapsed if self.best_latency is None else min(self.best_latency, elapsed)
+            return self.latency > self.latency_factor * self.best_latency
+
+    def _count(self, counter):
+        with self.condition:
+            setattr(self, counter, getattr(self, counter) + 1)
+        metrics.count(counter)
+
+    def _backoff(self, attempt, retry_after=None):
+        # exponential backoff with full jitter, honouring a Retry-After header
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        time.sleep(delay)
+
+    def _request(self, method, item_id, metadata):
+        # send a single PUT or DELETE, retrying when the server is overloaded.
+        # returns True if the request succeeded
+        url = self.url if item_id is None else f"{self.url}/{item_id}"
+        stage = method.lower()
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._count('retries')
+
+            self._acquire()
+            start = time.monotonic()
+            try:
+                r = self.session.request(method, url=url, data=metadata, auth=self.auth, headers=self.headers,
+                                         timeout=self.timeout)
+            except requests.RequestException as e:
+                self._release()
+                metrics.observe(stage, time.monotonic() - start)
+                log.warning("RequestException: %s", e)
+                self._decrease()
+                self._backoff(attempt)
+                continue
+            self._release()
+            elapsed = time.monotonic() - start
+            metrics.observe(stage, elapsed)
+
+            congested = self._observe(elapsed)
+            if r.status_code in throttle_status_codes or congested:
+                self._decrease()
+            else:
+                self._increase()
+
+            if r.status_code in retry_status_codes:
+                log.debug("%s - retrying", r.status_code)
+                self._backoff(attempt, r.headers.get('Retry-After'))
+                continue
+
+            # an item that is already gone counts as deleted
+            ok = r.ok or (method == 'DELETE' and r.status_code == 404)
+            if ok:
+                log.debug("%s %s - %s", method, r.status_code, r.text)
+            else:
+                log.error("%s %s - %s", method, r.status_code, r.text)
+            self._count(('published' if method == 'PUT' else 'deleted') if ok else 'failed')
+            return ok
+
+        self._count('failed')
+        return False
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _stop:
+                    return
+                method, item_id, metadata, on_done = item
+                if self._request(method, item_id, metadata) and on_done is not None:
+                    on_done()
+            except Exception as e:
+                log.exception("publisher: %s", e)
+            finally:
+                self.queue.task_done()
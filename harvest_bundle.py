@@ -0,0 +1,251 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# metadata bundles: harvested documents written to a folder of compressed
+# chunks instead of being published one at a time, so that the crawl and the
+# loading of the catalog can run separately, or on different networks.
+#
+# a chunk is either gzipped NDJSON, one {"id": mdFileID, "path": ..., "metadata": xml}
+# object per line, or a ZIP of XML documents with an index.ndjson of their ids.
+# chunks are rotated every records_per_chunk documents. every writer (one per
+# worker process) records its chunks in a <prefix>.manifest.json part, and the
+# parts are combined into manifest.json with the checksums of all chunks when
+# the harvest is done.
+#
+# usage:
+#   python harvest_bundle.py info C:\example\bundle
+#   python harvest_bundle.py load C:\example\bundle --url https://www.example.com/geoportal/rest/metadata/item --user <username>
+
+import os
+import sys
+import glob
+import gzip
+import json
+import uuid
+import hashlib
+import logging
+import zipfile
+import argparse
+import threading
+from datetime import datetime
+from harvest_reconcile import get_item_id
+
+
+log = logging.getLogger(__name__)
+
+bundle_formats = ['ndjson', 'zip']
+chunk_extensions = {'ndjson': '.ndjson.gz', 'zip': '.zip'}
+manifest_name = 'manifest.json'
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as chunk_file:
+        for block in iter(lambda: chunk_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BundleWriter:
+    # writes documents to rotated chunks in folder, safe to use from many threads
+
+    def __init__(self, folder, bundle_format='ndjson', records_per_chunk=10000, prefix=None):
+        # folder            = folder of the bundle, created if needed
+        # bundle_format     = 'ndjson' (gzipped NDJSON) or 'zip' (ZIP of XML documents)
+        # records_per_chunk = number of documents after which a new chunk is started
+        # prefix            = name prefix of the chunks of this writer, unique by default
+        if bundle_format not in bundle_formats:
+            raise ValueError(f"unknown bundle format {bundle_format}")
+        self.folder = folder
+        self.bundle_format = bundle_format
+        self.records_per_chunk = max(1, records_per_chunk)
+        self.prefix = prefix or f"part-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.lock = threading.Lock()
+        self.chunks = []  # manifest entries of the closed chunks
+        self.sequence = 0
+        self.chunk = None  # open chunk file
+        self.chunk_name = None
+        self.chunk_ids = []
+        os.makedirs(folder, exist_ok=True)
+
+    def write(self, md_file_id, metadata, path=None):
+        # adds a single metadata document to the bundle
+        with self.lock:
+            if self.chunk is None:
+                self._open_chunk()
+            if self.bundle_format == 'ndjson':
+                self.chunk.write(json.dumps({'id': md_file_id, 'path': path, 'metadata': metadata}))
+                self.chunk.write('\n')
+            else:
+                entry = f"{len(self.chunk_ids):08d}.xml"
+                self.chunk.writestr(entry, metadata)
+            self.chunk_ids.append((md_file_id, path))
+            if len(self.chunk_ids) >= self.records_per_chunk:
+                self._close_chunk()
+
+    def close(self):
+        # closes the open chunk and writes the manifest part of this writer
+        with self.lock:
+            if self.chunk is not None:
+                self._close_chunk()
+            if self.chunks:
+                part = os.path.join(self.folder, f"{self.prefix}.manifest.json")
+                with open(part + '.tmp', 'w') as part_file:
+                    json.dump({'format': self.bundle_format, 'chunks': self.chunks}, part_file)
+                os.replace(part + '.tmp', part)
+
+    def _open_chunk(self):
+        self.sequence += 1
+        self.chunk_name = f"{self.prefix}-{self.sequence:05d}{chunk_extensions[self.bundle_format]}"
+        tmp_path = os.path.join(self.folder, self.chunk_name + '.tmp')
+        if self.bundle_format == 'ndjson':
+            self.chunk = gzip.open(tmp_path, 'wt', encoding='UTF-8')
+        else:
+            self.chunk = zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED)
+        self.chunk_ids = []
+
+    def _close_chunk(self):
+        # closes the open chunk and moves it into place, only complete chunks carry their final name
+        if self.bundle_format == 'zip':
+            index = ''.join(json.dumps({'entry': f"{i:08d}.xml", 'id': md_file_id, 'path': path}) + '\n'
+                            for i, (md_file_id, path) in enumerate(self.chunk_ids))
+            self.chunk.writestr('index.ndjson', index)
+        self.chunk.close()
+        path = os.path.join(self.folder, self.chunk_name)
+        os.replace(path + '.tmp', path)
+        self.chunks.append({'name': self.chunk_name, 'records': len(self.chunk_ids),
+                            'bytes': os.path.getsize(path), 'sha256': _sha256(path)})
+        log.info("bundle chunk %s: %s documents", self.chunk_name, len(self.chunk_ids))
+        self.chunk = None
+        self.chunk_ids = []
+
+
+def finish_bundle(folder, **properties):
+    # combines the manifest parts of all writers into the manifest of the bundle.
+    # chunks of an earlier harvest into the same folder are kept. returns the manifest
+    path = os.path.join(folder, manifest_name)
+    manifest = read_manifest(folder) if os.path.exists(path) else {'chunks': []}
+    parts = sorted(glob.glob(os.path.join(folder, '*.manifest.json')))
+    for part in parts:
+        with open(part) as part_file:
+            part_manifest = json.load(part_file)
+        if manifest.get('format', part_manifest['format']) != part_manifest['format']:
+            raise ValueError(f"{part} is not in the {manifest['format']} format of the bundle")
+        manifest['format'] = part_manifest['format']
+        manifest['chunks'].extend(part_manifest['chunks'])
+
+    manifest.update(properties)
+    manifest['created'] = datetime.now().isoformat(timespec='seconds')
+    manifest['records'] = sum(chunk['records'] for chunk in manifest['chunks'])
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(path + '.tmp', path)
+    for part in parts:
+        os.remove(part)
+    return manifest
+
+
+def read_manifest(folder):
+    with open(os.path.join(folder, manifest_name)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def read_bundle(folder, verify=True):
+    # generator of the (md_file_id, path, metadata) of all documents in the bundle.
+    # with verify, chunks whose checksum does not match the manifest raise ValueError
+    manifest = read_manifest(folder)
+    for chunk in manifest['chunks']:
+        chunk_path = os.path.join(folder, chunk['name'])
+        if verify and _sha256(chunk_path) != chunk['sha256']:
+            raise ValueError(f"checksum mismatch of {chunk_path}")
+        if manifest['format'] == 'ndjson':
+            with gzip.open(chunk_path, 'rt', encoding='UTF-8') as chunk_file:
+                for line in chunk_file:
+                    if line.strip():
+                        document = json.loads(line)
+                        yield document['id'], document.get('path'), document['metadata']
+        else:
+            with zipfile.ZipFile(chunk_path) as chunk_file:
+                for line in chunk_file.read('index.ndjson').decode('UTF-8').splitlines():
+                    entry = json.loads(line)
+                    yield entry['id'], entry.get('path'), chunk_file.read(entry['entry']).decode('UTF-8')
+
+
+def load_bundle(folder, publisher, verify=True):
+    # publishes all documents of the bundle with the publisher, with the ids used by
+    # the reconciliation so that loading a bundle again updates the same items. the
+    # publisher uploads them concurrently, submit() blocks while its queue is full.
+    # returns the number of submitted documents
+    submitted = 0
+    for md_file_id, _, metadata in read_bundle(folder, verify):
+        publisher.submit(metadata, get_item_id(md_file_id))
+        submitted += 1
+    return submitted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a metadata bundle or load it into Geoportal Server")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    info = commands.add_parser('info', help="print the manifest of a bundle")
+    info.add_argument('folder')
+    info.add_argument("--verify", action="store_true", help="also verify the checksums of the chunks")
+
+    load = commands.add_parser('load', help="publish all documents of a bundle to Geoportal Server")
+    load.add_argument('folder')
+    load.add_argument("--url", required=True, help="document management API, e.g. https://host/geoportal/rest/metadata/item")
+    load.add_argument("--user", help="user name of the Geoportal account")
+    load.add_argument("--password", default=os.environ.get('GEOPORTAL_PASSWORD'),
+                      help="password of the Geoportal account (default: $GEOPORTAL_PASSWORD)")
+    load.add_argument("--max-window", type=int, default=32,
+                      help="maximum number of concurrent requests to Geoportal (default: 32)")
+    load.add_argument("--retries", type=int, default=5,
+                      help="number of retries of a document that could not be published (default: 5)")
+    load.add_argument("--no-verify", action="store_true", help="do not verify the checksums of the chunks")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.command == 'info':
+        manifest = read_manifest(args.folder)
+        if args.verify:
+            for chunk in manifest['chunks']:
+                if _sha256(os.path.join(args.folder, chunk['name'])) != chunk['sha256']:
+                    log.error("checksum mismatch of %s", chunk['name'])
+                    sys.exit(1)
+        json.dump(manifest, sys.stdout, indent=2)
+        print()
+        return
+
+    from requests.auth import HTTPBasicAuth
+    from geoportal_publisher import Publisher
+
+    auth = HTTPBasicAuth(args.user, args.password) if args.user else None
+    publisher = Publisher(args.url, auth=auth, headers={'Content-type': 'application/json'},
+                          max_window=args.max_window, initial_window=args.max_window // 2,
+                          max_retries=args.retries)
+    try:
+        submitted = load_bundle(args.folder, publisher, verify=not args.no_verify)
+    finally:
+        publisher.close()
+    log.info("submitted = %s, published = %s, failed = %s", submitted, publisher.published, publisher.failed)
+    if publisher.failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# lazy discovery of the workspaces (folders) to crawl. folders are listed with
+# os.scandir and yielded as soon as they are found, so the crawl can start on
+# the first workspace while the rest of the tree is still being discovered.
+# folders that cannot hold datasets of their own are pruned: the internals of
+# file geodatabases, tile caches, hidden folders and excluded folders.
+
+import os
+import stat
+import time
+import logging
+from fnmatch import fnmatch
+from harvest_metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+# folder names of tile caches, never descended into
+tile_cache_folders = ['_alllayers']
+
+# seconds between two progress reports
+progress_interval = 10
+
+
+def _is_hidden(entry):
+    # hidden folders start with a dot, or have the hidden attribute set on Windows
+    if entry.name.startswith('.'):
+        return True
+    attributes = getattr(entry.stat(follow_symlinks=False), 'st_file_attributes', 0)
+    return bool(attributes & getattr(stat, 'FILE_ATTRIBUTE_HIDDEN', 0))
+
+
+def _is_excluded(entry, exclude):
+    # True if the name or the path of the folder matches any of the exclude globs
+    path = entry.path.replace('\\', '/')
+    return any(fnmatch(entry.name, pattern) or fnmatch(path, pattern) for pattern in exclude)
+
+
+def print_progress(counts):
+    # default progress report
+    log.info("discovery: scanned = %s, workspaces = %s, pruned = %s", counts['scanned'], counts['workspaces'], counts['pruned'])
+
+
+def discover_workspaces(start_dir, prune_geodatabases=True, prune_tile_caches=True, prune_hidden=True,
+                        exclude=(), progress=print_progress):
+    # generator of all workspaces in the folder structure below start_dir, start_dir included.
+    # prune_geodatabases = yield file geodatabases, but do not descend into them
+    # prune_tile_caches  = skip tile cache folders
+    # prune_hidden       = skip hidden folders
+    # exclude            = glob patterns of folder names or paths to skip
+    # progress           = called with the discovery counts every progress_interval seconds
+
+    counts = {'scanned': 0, 'workspaces': 0, 'pruned': 0}
+    last_report = time.monotonic()
+
+    # depth first, in the same top-down order as os.walk
+    stack = [start_dir]
+    while stack:
+        folder = stack.pop()
+        counts['workspaces'] += 1
+        yield folder
+
+        if prune_geodatabases and folder.lower().endswith('.gdb'):
+            continue
+
+        subfolders = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        if (prune_tile_caches and entry.name in tile_cache_folders) \
+                                or (prune_hidden and _is_hidden(entry)) \
+                                or (exclude and _is_excluded(entry, exclude)):
+                            counts['pruned'] += 1
+                            continue
+                    except OSError:
+                        continue
+                    subfolders.append(entry.path)
+        except OSError as e:
+            log.error("cannot list %s: %s", folder, e)
+            metrics.count('errors', 'discover')
+
+        counts['scanned'] += 1
+        stack.extend(sorted(subfolders, reverse=True))
+
+        if progress is not None and time.monotonic() - last_report >= progress_interval:
+            last_report = time.monotonic()
+            progress(counts)
+
+    if progress is not None:
+        progress(counts)
@@ -0,0 +1,269 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# local index of the harvested metadata, next to the metadata files in the sink
+# folder. every document is indexed when it is written, with its title, folder
+# hierarchy, data type, mdFileID, the link to its layer file and its bounding box
+# in WGS 84. the text is indexed with SQLite FTS5 and the bounding boxes with an
+# R-tree, so what was harvested can be looked up without grepping the metadata
+# files or querying Geoportal. SQLite builds without FTS5 or R-tree fall back to
+# plain table scans.
+#
+# usage:
+#   python harvest_index.py search C:\example\lyrx\harvest_index.sqlite roads "trans*" --bbox=-90,35,-81,37
+#   python harvest_index.py show C:\example\lyrx\harvest_index.sqlite file://C:\example\input\roads.shp
+#   python harvest_index.py stats C:\example\lyrx\harvest_index.sqlite
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+
+# number of indexed documents after which the index is committed to disk
+commit_interval = 100
+
+# columns of a search result
+columns = ['md_file_id', 'title', 'hierarchy', 'data_type', 'path', 'link', 'xml', 'xmin', 'ymin', 'xmax', 'ymax', 'indexed']
+
+
+def match_expression(text):
+    # FTS5 query of the words in text, all of which must match. a word ending in * matches as a prefix
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+class MetadataIndex:
+    # SQLite index of the harvested metadata documents
+
+    def __init__(self, index_file, commit_interval=commit_interval):
+        # commit_interval = number of indexed documents after which the index is committed,
+        #                   processes that share the index commit every document
+        self.index_file = index_file
+        self.commit_interval = commit_interval
+        self.pending = 0
+        self.lock = threading.Lock()  # the connection is shared by the pipeline threads
+        self.connection = sqlite3.connect(index_file, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " id INTEGER PRIMARY KEY,"
+            " md_file_id TEXT UNIQUE,"
+            " item_id TEXT,"
+            " title TEXT,"
+            " hierarchy TEXT,"
+            " data_type TEXT,"
+            " path TEXT,"
+            " link TEXT,"
+            " xml TEXT,"
+            " xmin REAL, ymin REAL, xmax REAL, ymax REAL,"
+            " indexed TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS documents_item_id ON documents (item_id)")
+        self.fts = self._create_virtual_table(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS documents_text USING fts5(title, hierarchy, data_type, md_file_id)")
+        self.rtree = self._create_virtual_table(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS documents_bbox USING rtree(id, xmin, xmax, ymin, ymax)")
+        self.connection.commit()
+
+    def _create_virtual_table(self, statement):
+        # returns False if this SQLite build does not have the module of the virtual table
+        try:
+            self.connection.execute(statement)
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def add(self, md_file_id, title, hierarchy, data_type, bbox, path=None, link=None, xml=None, item_id=None):
+        # indexes a document, replacing an earlier version with the same md_file_id.
+        # bbox = (xmin, ymin, xmax, ymax) in WGS 84
+        xmin, ymin, xmax, ymax = bbox
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM documents WHERE md_file_id = ?", (md_file_id,)).fetchone()
+            values = (md_file_id, item_id, title, hierarchy, data_type, path, link, xml, xmin, ymin, xmax, ymax,
+                      datetime.now().strftime("%Y-%m-%dT%H:%M:%S"))
+            if row is None:
+                document_id = self.connection.execute(
+                    "INSERT INTO documents (md_file_id, item_id, title, hierarchy, data_type, path, link, xml,"
+                    " xmin, ymin, xmax, ymax, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    values).lastrowid
+            else:
+                document_id = row[0]
+                self.connection.execute(
+                    "UPDATE documents SET md_file_id = ?, item_id = ?, title = ?, hierarchy = ?, data_type = ?,"
+                    " path = ?, link = ?, xml = ?, xmin = ?, ymin = ?, xmax = ?, ymax = ?, indexed = ? WHERE id = ?",
+                    values + (document_id,))
+                self._remove_entries(document_id)
+            if self.fts:
+                self.connection.execute(
+                    "INSERT INTO documents_text (rowid, title, hierarchy, data_type, md_file_id) VALUES (?, ?, ?, ?, ?)",
+                    (document_id, title, hierarchy, data_type, md_file_id))
+            if self.rtree:
+                self.connection.execute(
+                    "INSERT INTO documents_bbox (id, xmin, xmax, ymin, ymax) VALUES (?, ?, ?, ?, ?)",
+                    (document_id, xmin, xmax, ymin, ymax))
+            self._written()
+
+    def remove(self, item_id):
+        # removes the document that was published as item_id, e.g. after its dataset was deleted
+        with self.lock:
+            for row in self.connection.execute("SELECT id FROM documents WHERE item_id = ?", (item_id,)).fetchall():
+                self._remove_entries(row[0])
+                self.connection.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+            self._written()
+
+    def _remove_entries(self, document_id):
+        # removes the text and bounding box of a document. call with the lock held
+        if self.fts:
+            self.connection.execute("DELETE FROM documents_text WHERE rowid = ?", (document_id,))
+        if self.rtree:
+            self.connection.execute("DELETE FROM documents_bbox WHERE id = ?", (document_id,))
+
+    def search(self, text=None, bbox=None, data_type=None, limit=20):
+        # returns the documents as dicts of columns that match all words of text and whose
+        # bounding box intersects bbox = (xmin, ymin, xmax, ymax), best text matches first
+        query = f"SELECT {', '.join('d.' + column for column in columns)} FROM documents d"
+        where = []
+        parameters = []
+        order = " ORDER BY d.title"
+        if text and match_expression(text):
+            if self.fts:
+                query += " JOIN documents_text ON documents_text.rowid = d.id"
+                where.append("documents_text MATCH ?")
+                parameters.append(match_expression(text))
+                order = " ORDER BY bm25(documents_text)"
+            else:
+                for word in text.split():
+                    where.append("(d.title || ' ' || d.hierarchy || ' ' || d.data_type || ' ' || d.md_file_id) LIKE ?")
+                    parameters.append('%' + word.rstrip('*') + '%')
+        if bbox is not None:
+            xmin, ymin, xmax, ymax = bbox
+            if self.rtree:
+                query += " JOIN documents_bbox b ON b.id = d.id"
+                where.append("b.xmax >= ? AND b.xmin <= ? AND b.ymax >= ? AND b.ymin <= ?")
+            else:
+                where.append("d.xmax >= ? AND d.xmin <= ? AND d.ymax >= ? AND d.ymin <= ?")
+            parameters.extend([xmin, xmax, ymin, ymax])
+        if data_type:
+            where.append("d.data_type = ?")
+            parameters.append(data_type)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += order + " LIMIT ?"
+        parameters.append(limit)
+        with self.lock:
+            return [dict(zip(columns, row)) for row in self.connection.execute(query, parameters)]
+
+    def get(self, key):
+        # returns the document with the mdFileID, item id or dataset path key, or None
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {', '.join(columns)} FROM documents WHERE md_file_id = ? OR item_id = ? OR path = ?",
+                (key, key, key)).fetchone()
+        return dict(zip(columns, row)) if row is not None else None
+
+    def stats(self):
+        # returns the number of documents by data type
+        with self.lock:
+            return dict(self.connection.execute(
+                "SELECT data_type, COUNT(*) FROM documents GROUP BY data_type ORDER BY data_type").fetchall())
+
+    def _written(self):
+        # counts a written document, the index is committed every commit_interval documents. call with the lock held
+        self.pending += 1
+        if self.pending >= self.commit_interval:
+            self.connection.commit()
+            self.pending = 0
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def parse_bbox(value):
+    # parses xmin,ymin,xmax,ymax
+    try:
+        bbox = [float(v) for v in value.split(',')]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4:
+        raise argparse.ArgumentTypeError("expected xmin,ymin,xmax,ymax")
+    return bbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the local index of the harvested metadata")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    search = commands.add_parser('search', help="find documents by words and bounding box")
+    search.add_argument('index')
+    search.add_argument('words', nargs='*', help="words that must all match, a word ending in * matches as a prefix")
+    search.add_argument("--bbox", type=parse_bbox, help="xmin,ymin,xmax,ymax in WGS 84 that the documents intersect, e.g. --bbox=-90,35,-81,37")
+    search.add_argument("--type", help="data type of the documents, e.g. ShapeFile, RasterDataset")
+    search.add_argument("--limit", type=int, default=20, help="maximum number of documents (default: 20)")
+    search.add_argument("--json", action="store_true", help="print the documents as JSON lines")
+
+    show = commands.add_parser('show', help="print the metadata of a document")
+    show.add_argument('index')
+    show.add_argument('key', help="mdFileID, catalog item id or dataset path of the document")
+
+    stats = commands.add_parser('stats', help="print the number of documents by data type")
+    stats.add_argument('index')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.index):
+        parser.error(f"{args.index} does not exist")
+    index = MetadataIndex(args.index)
+    try:
+        if args.command == 'search':
+            for document in index.search(' '.join(args.words), args.bbox, args.type, args.limit):
+                if args.json:
+                    print(json.dumps(document))
+                else:
+                    print(f"{document['title']}\t{document['data_type']}\t{document['md_file_id']}\t{document['link']}")
+        elif args.command == 'show':
+            document = index.get(args.key)
+            if document is None:
+                print(f"{args.key} is not in the index", file=sys.stderr)
+                sys.exit(1)
+            if document['xml'] and os.path.exists(document['xml']):
+                with open(document['xml']) as xml_file:
+                    print(xml_file.read())
+            else:
+                print(json.dumps(document, indent=2))
+        else:
+            for data_type, count in index.stats().items():
+                print(f"{data_type}\t{count}")
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# lease store of a crawl that is shared by several harvest hosts. the
+# coordinator splits the discovered workspaces into shards and records them in
+# a SQLite database on the shared drive. worker hosts claim a shard, renew its
+# lease while they crawl it and hand back their results. the lease of a shard
+# whose worker stopped renewing it (e.g. the host crashed) expires and the
+# shard is claimed by another worker. a shard that failed max_attempts times
+# is given up.
+#
+# workspaces are stored relative to the start folder of the crawl, so hosts
+# that mount the share at a different path can work on the same crawl. leases
+# are compared with the clock of every host, lease_seconds should be well
+# above the clock difference between the hosts.
+#
+# usage:
+#   python harvest_leases.py status \\server\share\harvest_leases.sqlite
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import sqlite3
+import argparse
+import threading
+
+
+log = logging.getLogger(__name__)
+
+# shard states
+pending = 'pending'
+leased = 'leased'
+done = 'done'
+failed = 'failed'
+
+
+class Shard:
+    # a shard claimed by a worker
+    __slots__ = ['id', 'workspaces', 'attempts']
+
+    def __init__(self, shard_id, workspaces, attempts):
+        self.id = shard_id
+        self.workspaces = workspaces  # paths relative to the start folder of the crawl
+        self.attempts = attempts
+
+
+class LeaseStore:
+    # SQLite backed store of the shards of a crawl and their leases
+
+    def __init__(self, lease_file, lease_seconds=300, max_attempts=3):
+        # lease_file    = SQLite database on the drive shared by the harvest hosts
+        # lease_seconds = time after which a shard whose lease was not renewed is reclaimed
+        # max_attempts  = number of claims of a shard before it is given up
+        self.lease_file = lease_file
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()  # the connection is shared with the heartbeat thread
+        # WAL mode needs shared memory and does not work on network drives, use a rollback journal
+        self.connection = sqlite3.connect(lease_file, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS shards ("
+            " id INTEGER PRIMARY KEY,"
+            " workspaces TEXT,"
+            " state TEXT,"
+            " owner TEXT,"
+            " expires REAL,"
+            " attempts INTEGER DEFAULT 0,"
+            " result TEXT,"
+            " updated REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS shards_state ON shards (state, id)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS properties (name TEXT PRIMARY KEY, value TEXT)")
+
+    def _transaction(self, function):
+        # runs function(connection) in a write transaction, BEGIN IMMEDIATE takes the
+        # write lock up front so that two hosts cannot claim the same shard
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(self.connection)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return result
+
+    def reset(self, **properties):
+        # starts a new crawl: forgets the shards of the previous crawl and records the
+        # properties of the crawl, unsealed. call before the workers start claiming
+        def reset(connection):
+            connection.execute("DELETE FROM shards")
+            connection.execute("DELETE FROM properties")
+            connection.executemany(
+                "INSERT INTO properties (name, value) VALUES (?, ?)",
+                [(name, json.dumps(value)) for name, value in dict(properties, sealed=False).items()])
+
+        self._transaction(reset)
+
+    def add_shards(self, workspaces, shard_size=50):
+        # splits the iterable of relative workspace paths into shards of shard_size
+        # workspaces. shards are recorded as they fill up, so workers can start on the
+        # first shards while the coordinator is still discovering. the crawl is sealed
+        # when all workspaces are recorded. returns the number of shards
+        def insert(shard):
+            self._transaction(lambda connection: connection.execute(
+                "INSERT INTO shards (workspaces, state, updated) VALUES (?, ?, ?)",
+                (json.dumps(shard), pending, time.time())))
+
+        shards = 0
+        shard = []
+        for workspace in workspaces:
+            shard.append(workspace)
+            if len(shard) >= shard_size:
+                insert(shard)
+                shards += 1
+                shard = []
+        if shard:
+            insert(shard)
+            shards += 1
+        self._transaction(lambda connection: connection.execute(
+            "INSERT OR REPLACE INTO properties (name, value) VALUES (?, ?)", ('sealed', json.dumps(True))))
+        return shards
+
+    def properties(self):
+        with self.lock:
+            return {name: json.loads(value) for name, value in
+                    self.connection.execute("SELECT name, value FROM properties")}
+
+    def claim(self, owner):
+        # claims the next pending shard for owner, after reclaiming expired leases.
+        # returns the Shard, or None if no shard is pending
+        def claim(connection):
+            now = time.time()
+            connection.execute(
+                "UPDATE shards SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, updated = ?"
+                " WHERE state = ? AND expires < ?",
+                (self.max_attempts, failed, pending, now, leased, now))
+            row = connection.execute(
+                "SELECT id, workspaces, attempts FROM shards WHERE state = ? ORDER BY id LIMIT 1", (pending,)).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE shards SET state = ?, owner = ?, expires = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (leased, owner, now + self.lease_seconds, now, row[0]))
+            return Shard(row[0], json.loads(row[1]), row[2] + 1)
+        return self._transaction(claim)
+
+    def heartbeat(self, shard_id, owner):
+        # renews the lease of a shard. returns False if owner lost the lease
+        def renew(connection):
+            now = time.time()
+            return connection.execute(
+                "UPDATE shards SET expires = ?, updated = ? WHERE id = ? AND owner = ? AND state = ?",
+                (now + self.lease_seconds, now, shard_id, owner, leased)).rowcount == 1
+        return self._transaction(renew)
+
+    def complete(self, shard_id, owner, result):
+        # hands back the result of a shard. returns False if owner lost the lease,
+        # the result of the worker that holds the lease is kept in that case
+        return self._transaction(lambda connection: connection.execute(
+            "UPDATE shards SET state = ?, result = ?, expires = NULL, updated = ? WHERE id = ? AND owner = ? AND state = ?",
+            (done, json.dumps(result), time.time(), shard_id, owner, leased)).rowcount == 1)
+
+    def release(self, shard_id, owner, error):
+        # returns a shard that could not be crawled, to be claimed again up to max_attempts
+        return self._transaction(lambda connection: connection.execute(
+            "UPDATE shards SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, expires = NULL,"
+            " result = ?, updated = ? WHERE id = ? AND owner = ? AND state = ?",
+            (self.max_attempts, failed, pending, json.dumps({'error': str(error)}), time.time(),
+             shard_id, owner, leased)).rowcount == 1)
+
+    def status(self):
+        # returns the number of shards by state
+        with self.lock:
+            counts = dict(self.connection.execute("SELECT state, COUNT(*) FROM shards GROUP BY state"))
+        return {state: counts.get(state, 0) for state in [pending, leased, done, failed]}
+
+    def is_finished(self):
+        # True if the crawl is sealed and no shard is pending or leased
+        counts = self.status()
+        return bool(self.properties().get('sealed')) and counts[pending] == 0 and counts[leased] == 0
+
+    def results(self):
+        # the results of the completed shards, summed per key
+        totals = {}
+        with self.lock:
+            rows = self.connection.execute("SELECT result FROM shards WHERE state = ?", (done,)).fetchall()
+        for (result,) in rows:
+            for key, value in json.loads(result).items():
+                if isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class Heartbeat:
+    # renews the lease of a shard from a background thread while the shard is crawled.
+    # use as a context manager, lost is set when the lease was taken over by another host
+
+    def __init__(self, store, shard_id, owner, interval=None):
+        self.store = store
+        self.shard_id = shard_id
+        self.owner = owner
+        self.interval = interval or store.lease_seconds / 3.0
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                if not self.store.heartbeat(self.shard_id, self.owner):
+                    log.warning("lease of shard %s lost", self.shard_id)
+                    self.lost.set()
+                    return
+            except sqlite3.Error as e:
+                # the share may be briefly unavailable, try again at the next beat
+                log.warning("heartbeat of shard %s failed: %s", self.shard_id, e)
+
+
+def worker_id():
+    # identifies a worker in the lease store
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def work(store, crawl_shard, owner=None, poll_interval=30):
+    # claims and crawls shards until the crawl is finished.
+    # crawl_shard = called with the Shard, returns the result of the shard as a dict of numbers
+    # returns the number of shards crawled by this worker
+    owner = owner or worker_id()
+    crawled = 0
+    while True:
+        shard = store.claim(owner)
+        if shard is None:
+            if store.is_finished():
+                return crawled
+            # shards are still being added, or leased by other hosts and may expire
+            time.sleep(poll_interval)
+            continue
+
+        log.info("shard %s: %s workspaces, attempt %s", shard.id, len(shard.workspaces), shard.attempts)
+        with Heartbeat(store, shard.id, owner) as heartbeat:
+            try:
+                result = crawl_shard(shard)
+            except Exception as e:
+                log.exception("shard %s: %s", shard.id, e)
+                store.release(shard.id, owner, e)
+                continue
+        if heartbeat.lost.is_set() or not store.complete(shard.id, owner, result):
+            log.warning("shard %s was reclaimed by another host, its result is dropped", shard.id)
+        crawled += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the progress of a shared crawl")
+    parser.add_argument("command", choices=['status'])
+    parser.add_argument("lease_file")
+    args = parser.parse_args()
+
+    store = LeaseStore(args.lease_file)
+    try:
+        json.dump({'properties': store.properties(), 'shards': store.status(), 'results': store.results()},
+                  sys.stdout, indent=2)
+        print()
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
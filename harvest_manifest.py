@@ -0,0 +1,354 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# persistent manifest of harvested datasets, used by the incremental crawl.
+# every dataset is keyed by its path and stores the size, modification time
+# and a fingerprint of its sidecar files, together with the layer file and
+# metadata file that were generated for it. for the reconciliation with the
+# catalog, it also stores the id and content hash of every published document
+# and the last run in which its dataset was seen. datasets that timed out or
+# failed are kept in a quarantine with the number of failed attempts.
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from dataset_record import DatasetRecord
+
+
+# number of recorded datasets after which the manifest is committed to disk
+commit_interval = 100
+
+# cache of the directory listings of the last listing_cache_size folders,
+# folder -> (folder mtime, names). only the folders being crawled are needed
+listing_cache_size = 8
+_listing_cache = OrderedDict()
+_listing_lock = threading.Lock()
+
+# cache of geodatabase fingerprints, keyed by geodatabase path. an edit of a table
+# does not change the mtime of the geodatabase folder, see clear_caches
+_gdb_cache = {}
+
+
+def _stat_signature(path):
+    # returns (size, mtime in ns) for path, or None if path cannot be accessed
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _list_folder(folder):
+    # returns the sorted file names in folder. the listing is cached on the folder
+    # mtime, which changes whenever files are added, removed or renamed
+    try:
+        folder_mtime = os.stat(folder).st_mtime_ns
+    except OSError:
+        return []
+    with _listing_lock:
+        cached = _listing_cache.get(folder)
+        if cached is not None and cached[0] == folder_mtime:
+            _listing_cache.move_to_end(folder)
+            return cached[1]
+    try:
+        names = sorted(entry.name for entry in os.scandir(folder) if entry.is_file())
+    except OSError:
+        names = []
+    with _listing_lock:
+        _listing_cache[folder] = folder_mtime, names  # replaces the listing of an earlier mtime
+        _listing_cache.move_to_end(folder)
+        while len(_listing_cache) > listing_cache_size:
+            _listing_cache.popitem(last=False)
+    return names
+
+
+def clear_caches():
+    # forgets the cached listings and geodatabase fingerprints. a long running process,
+    # e.g. in watch mode, clears them before every batch of changes
+    with _listing_lock:
+        _listing_cache.clear()
+    _gdb_cache.clear()
+
+
+def _hash_files(digest, folder, names):
+    # adds name, size and mtime of every file in names to digest
+    for name in names:
+        signature = _stat_signature(os.path.join(folder, name))
+        if signature is not None:
+            digest.update(f"{name}|{signature[0]}|{signature[1]};".encode('UTF-8'))
+
+
+def _split_geodatabase(f):
+    # returns the path of the file or enterprise geodatabase that contains f,
+    # or None if f is not inside a geodatabase
+    normalized = f.replace('\\', '/')
+    for extension in ['.gdb/', '.sde/']:
+        index = normalized.lower().find(extension)
+        if index >= 0:
+            return f[:index + len(extension) - 1]
+    return None
+
+
+def _gdb_fingerprint(gdb):
+    # fingerprint of all table files of a file geodatabase. computed once per run or
+    # batch of changes, any change to the geodatabase marks all of its datasets as changed
+    fingerprint = _gdb_cache.get(gdb)
+    if fingerprint is None:
+        digest = hashlib.sha1()
+        _hash_files(digest, gdb, _list_folder(gdb))
+        fingerprint = digest.hexdigest()
+        _gdb_cache[gdb] = fingerprint
+    return fingerprint
+
+
+def fingerprint(f):
+    # returns the fingerprint (size, mtime_ns, sidecars) of dataset f, or None
+    # if the dataset cannot be fingerprinted (e.g. it lives in an enterprise
+    # geodatabase) and must always be processed
+
+    gdb = _split_geodatabase(f)
+    if gdb is not None:
+        if gdb.lower().endswith('.sde'):
+            return None
+        signature = _stat_signature(gdb)
+        if signature is None:
+            return None
+        return 0, signature[1], _gdb_fingerprint(gdb)
+
+    signature = _stat_signature(f)
+    if signature is None:
+        return None
+
+    digest = hashlib.sha1()
+    if os.path.isdir(f):
+        # raster formats such as ESRI grids are stored as a folder of files
+        for folder, _, names in os.walk(f):
+            _hash_files(digest, folder, sorted(names))
+    else:
+        # sidecars share the base name of the dataset, e.g. roads.shp, roads.dbf,
+        # roads.prj, roads.shp.xml or image.tif, image.tfw, image.tif.aux.xml
+        folder, data_file = os.path.split(f)
+        stem = os.path.splitext(data_file)[0] + '.'
+        _hash_files(digest, folder, [name for name in _list_folder(folder) if name.startswith(stem)])
+
+    return signature[0], signature[1], digest.hexdigest()
+
+
+class Manifest:
+    # SQLite backed manifest of harvested datasets
+
+    def __init__(self, manifest_file, commit_interval=commit_interval):
+        # commit_interval = number of written rows after which the manifest is committed. a write
+        #                   transaction locks the manifest for all other processes, processes that
+        #                   share the manifest commit every row
+        self.manifest_file = manifest_file
+        self.commit_interval = commit_interval
+        self.pending = 0
+        self.lock = threading.Lock()  # the connection is shared by the pipeline threads
+        self.connection = sqlite3.connect(manifest_file, timeout=60, check_same_thread=False)  # shared by worker processes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS datasets ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER,"
+            " mtime INTEGER,"
+            " sidecars TEXT,"
+            " lyrx TEXT,"
+            " xml TEXT,"
+            " harvested TEXT)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " path TEXT PRIMARY KEY,"
+            " fingerprint TEXT,"
+            " record TEXT)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS published ("
+            " id TEXT PRIMARY KEY,"
+            " md_file_id TEXT,"
+            " hash TEXT,"
+            " seen TEXT,"
+            " published TEXT)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS quarantine ("
+            " path TEXT PRIMARY KEY,"
+            " reason TEXT,"
+            " attempts INTEGER,"
+            " updated TEXT)")
+        self.connection.commit()
+
+    def is_unchanged(self, f, dataset_fingerprint):
+        # True if f was harvested before with the same fingerprint and
+        # both the layer file and the metadata file are still in place
+        if dataset_fingerprint is None:
+            return False
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT size, mtime, sidecars, lyrx, xml FROM datasets WHERE path = ?", (f,)).fetchone()
+        if row is None:
+            return False
+        if tuple(row[:3]) != tuple(dataset_fingerprint):
+            return False
+        return all(output and os.path.exists(output) for output in row[3:])
+
+    def outputs(self, f):
+        # returns (lyrx, xml) recorded for f, or None
+        with self.lock:
+            row = self.connection.execute("SELECT lyrx, xml FROM datasets WHERE path = ?", (f,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def get_record(self, f, dataset_fingerprint):
+        # returns the DatasetRecord of f if it was described with the same fingerprint, or None
+        if dataset_fingerprint is None:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT record FROM records WHERE path = ? AND fingerprint = ?",
+                (f, json.dumps(dataset_fingerprint))).fetchone()
+        return DatasetRecord.from_dict(json.loads(row[0])) if row is not None else None
+
+    def put_record(self, record):
+        # stores the DatasetRecord of a dataset, keyed by its path and fingerprint
+        if record.fingerprint is None:
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO records (path, fingerprint, record) VALUES (?, ?, ?)",
+                (record.path, json.dumps(record.fingerprint), json.dumps(record.to_dict())))
+            self._written()
+
+    def record(self, f, dataset_fingerprint, lyr_file, xml_file):
+        # stores the fingerprint and outputs of a harvested dataset
+        size, mtime, sidecars = dataset_fingerprint if dataset_fingerprint is not None else (None, None, None)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO datasets (path, size, mtime, sidecars, lyrx, xml, harvested)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (f, size, mtime, sidecars, lyr_file, xml_file, datetime.now().strftime("%Y-%m-%dT%H:%M:%S")))
+            self._written()
+
+    def published_hash(self, item_id):
+        # returns the content hash of the document published as item_id, or None
+        with self.lock:
+            row = self.connection.execute("SELECT hash FROM published WHERE id = ?", (item_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def record_published(self, item_id, md_file_id, content_hash, run):
+        # stores the content hash of a document that was published as item_id
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO published (id, md_file_id, hash, seen, published) VALUES (?, ?, ?, ?, ?)",
+                (item_id, md_file_id, content_hash, run, datetime.now().strftime("%Y-%m-%dT%H:%M:%S")))
+            self._written()
+
+    def mark_seen(self, item_id, run):
+        # records that the dataset of item_id still exists in this run
+        with self.lock:
+            self.connection.execute("UPDATE published SET seen = ? WHERE id = ?", (run, item_id))
+            self._written()
+
+    def retain_published(self, item_ids):
+        # forgets the published documents that are not in item_ids, e.g. the items that
+        # are missing from the catalog after a reindex, so that they are published again.
+        # returns the number of forgotten documents
+        with self.lock:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS catalog (id TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM catalog")
+            self.connection.executemany("INSERT OR IGNORE INTO catalog (id) VALUES (?)", ((i,) for i in item_ids))
+            forgotten = self.connection.execute(
+                "DELETE FROM published WHERE id NOT IN (SELECT id FROM catalog)").rowcount
+            self.connection.execute("DELETE FROM catalog")
+            self.connection.commit()
+            self.pending = 0
+        return forgotten
+
+    def stale_published(self, run, keep=()):
+        # returns the ids of the published documents whose dataset was not seen in run, except
+        # those whose md_file_id is in one of the folders keep, given as md_file_ids of folders,
+        # e.g. geodatabases that could not be listed in this run
+        keep = [folder.rstrip('\\/') for folder in keep]
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, md_file_id FROM published WHERE seen IS NULL OR seen <> ?", (run,)).fetchall()
+        return [item_id for item_id, md_file_id in rows
+                if not any(md_file_id.startswith(folder) and md_file_id[len(folder):len(folder) + 1] in ('/', '\\')
+                           for folder in keep)]
+
+    def forget_published(self, item_id):
+        # removes a deleted document
+        with self.lock:
+            self.connection.execute("DELETE FROM published WHERE id = ?", (item_id,))
+            self._written()
+
+    def quarantine(self, f, reason):
+        # records a failed attempt to harvest f and returns the number of failed attempts.
+        # committed right away, the process that harvested f may be about to be terminated
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO quarantine (path, reason, attempts, updated) VALUES (?, ?, 1, ?)"
+                " ON CONFLICT(path) DO UPDATE SET reason = excluded.reason, attempts = attempts + 1,"
+                " updated = excluded.updated",
+                (f, reason, datetime.now().strftime("%Y-%m-%dT%H:%M:%S")))
+            self.connection.commit()
+            self.pending = 0
+            row = self.connection.execute("SELECT attempts FROM quarantine WHERE path = ?", (f,)).fetchone()
+        return row[0]
+
+    def quarantine_attempts(self, f):
+        # returns the number of failed attempts to harvest f, 0 if f is not in the quarantine
+        with self.lock:
+            row = self.connection.execute("SELECT attempts FROM quarantine WHERE path = ?", (f,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def quarantined(self):
+        # returns {path: (reason, attempts)} of all datasets in the quarantine
+        with self.lock:
+            return {row[0]: (row[1], row[2]) for row in self.connection.execute(
+                "SELECT path, reason, attempts FROM quarantine")}
+
+    def release(self, f):
+        # removes f from the quarantine after it was harvested
+        with self.lock:
+            self.connection.execute("DELETE FROM quarantine WHERE path = ?", (f,))
+            self._written()
+
+    def clear_quarantine(self):
+        # forgets the failed attempts of all datasets in the quarantine
+        with self.lock:
+            self.connection.execute("DELETE FROM quarantine")
+            self.connection.commit()
+            self.pending = 0
+
+    def _written(self):
+        # counts a written row, the manifest is committed every commit_interval rows. call with the lock held
+        self.pending += 1
+        if self.pending >= self.commit_interval:
+            self.connection.commit()
+            self.pending = 0
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
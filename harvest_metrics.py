@@ -0,0 +1,258 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# instrumentation of the harvest: the time spent per stage (arcpy calls, XML
+# render and merge, HTTP PUT) and counters of datasets by type, skips, errors
+# and retries. durations are kept in fixed histogram buckets, so the memory
+# does not grow with the number of datasets. at the end of a run the metrics
+# are written as a JSON report, and while the harvest runs they can be served
+# in the Prometheus text format.
+
+import os
+import json
+import time
+import logging
+import platform
+import threading
+import contextlib
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+log = logging.getLogger(__name__)
+
+# upper bounds in seconds of the histogram buckets of the stage durations
+buckets = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf')]
+
+
+class Timing:
+    # histogram of the durations of a single stage
+
+    __slots__ = ['count', 'total', 'max', 'buckets']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(buckets)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(buckets):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def merge(self, other):
+        self.count += other['count']
+        self.total += other['total']
+        self.max = max(self.max, other['max'])
+        for i, n in enumerate(other['buckets']):
+            self.buckets[i] += n
+
+    def percentile(self, p):
+        # estimate of the p-th percentile: the upper bound of the bucket it falls into
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(buckets[i], self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max, 'buckets': list(self.buckets)}
+
+
+class Metrics:
+    # stage timings and counters of a harvest, safe to update from many threads
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.timings = {}   # Timing by stage name
+        self.counters = {}  # count by (name, label)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            timing = self.timings.get(stage)
+            if timing is None:
+                timing = self.timings[stage] = Timing()
+            timing.observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        # times the body of a with statement as stage, also when it raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, name, label=None, n=1):
+        # adds n to counter name, e.g. count('datasets', 'ShapeFile') or count('errors', 'layerize')
+        with self.lock:
+            key = (name, label)
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def value(self, name, label=None):
+        # returns the value of a single counter
+        with self.lock:
+            return self.counters.get((name, label), 0)
+
+    def totals(self):
+        # returns the counters summed over their labels, by name
+        totals = {}
+        with self.lock:
+            for (name, _), n in self.counters.items():
+                totals[name] = totals.get(name, 0) + n
+        return totals
+
+    def drain(self):
+        # returns the metrics collected since the last drain and resets them.
+        # worker processes drain their metrics into the results they return
+        with self.lock:
+            snapshot = {'timings': {stage: timing.to_dict() for stage, timing in self.timings.items()},
+                        'counters': [[name, label, n] for (name, label), n in self.counters.items()]}
+            self.timings = {}
+            self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        # adds the drained metrics of a worker process
+        if not snapshot:
+            return
+        with self.lock:
+            for stage, other in snapshot['timings'].items():
+                timing = self.timings.get(stage)
+                if timing is None:
+                    timing = self.timings[stage] = Timing()
+                timing.merge(other)
+            for name, label, n in snapshot['counters']:
+                key = (name, label)
+                self.counters[key] = self.counters.get(key, 0) + n
+
+    def report(self, **extra):
+        # the run report as a JSON compatible dict
+        with self.lock:
+            seconds = time.time() - self.started
+            counters = {}
+            for (name, label), n in sorted(self.counters.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+                if label is None:
+                    counters[name] = counters.get(name, 0) + n
+                else:
+                    counters.setdefault(name, {})[label] = n
+            datasets = counters.get('datasets', {})
+            processed = sum(datasets.values()) if isinstance(datasets, dict) else datasets
+            report = {
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'seconds': seconds,
+                'datasets_per_second': processed / seconds if seconds else None,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'counters': counters,
+                'stages': {stage: {'count': timing.count,
+                                   'total_s': timing.total,
+                                   'mean_ms': 1000.0 * timing.total / timing.count if timing.count else None,
+                                   'p50_ms': _ms(timing.percentile(50)),
+                                   'p99_ms': _ms(timing.percentile(99)),
+                                   'max_ms': 1000.0 * timing.max}
+                           for stage, timing in sorted(self.timings.items())},
+            }
+        report.update(extra)
+        return report
+
+    def write_report(self, path, **extra):
+        # writes the run report to path, through a temporary file
+        report = self.report(**extra)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        os.replace(tmp_path, path)
+        log.info("report written to %s", path)
+        return report
+
+    def prometheus(self):
+        # the metrics in the Prometheus text exposition format
+        lines = []
+        with self.lock:
+            lines.append("# HELP harvest_uptime_seconds Seconds since the harvest started.")
+            lines.append("# TYPE harvest_uptime_seconds gauge")
+            lines.append(f"harvest_uptime_seconds {time.time() - self.started:.3f}")
+
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE harvest_{name}_total counter")
+                for (counter, label), n in sorted(self.counters.items(), key=lambda item: item[0][1] or ''):
+                    if counter == name:
+                        labels = '' if label is None else f'{{label="{_escape(label)}"}}'
+                        lines.append(f"harvest_{name}_total{labels} {n}")
+
+            lines.append("# HELP harvest_stage_seconds Time spent per harvest stage.")
+            lines.append("# TYPE harvest_stage_seconds histogram")
+            for stage, timing in sorted(self.timings.items()):
+                cumulative = 0
+                for bound, n in zip(buckets, timing.buckets):
+                    cumulative += n
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'harvest_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'harvest_stage_seconds_sum{{stage="{stage}"}} {timing.total:.6f}')
+                lines.append(f'harvest_stage_seconds_count{{stage="{stage}"}} {timing.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000.0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def start_http_server(port, host='', registry=None):
+    # serves the metrics at http://host:port/metrics from a background thread.
+    # returns the server, stop it with shutdown()
+    registry = registry or metrics
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode('UTF-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("serving metrics on port %s", server.server_address[1])
+    return server
+
+
+metrics = Metrics()  # metrics of this process
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# staged streaming pipeline. items produced by a source are passed through a chain
+# of stages, each with its own pool of worker threads. stages are connected by
+# bounded queues, so a slow stage applies backpressure to the stages before it
+# instead of letting the number of items in memory grow.
+
+import queue
+import logging
+import threading
+from harvest_metrics import metrics
+
+
+log = logging.getLogger(__name__)
+
+
+_done = object()  # queue sentinel, signals the end of the items of the previous stage
+
+
+class Stage:
+    # a single pipeline stage
+    # name       = name of the stage, used in log messages
+    # function   = called with every item, returns the item for the next stage or None to drop it
+    # workers    = number of worker threads of the stage
+    # queue_size = maximum number of items waiting for this stage
+
+    def __init__(self, name, function, workers=1, queue_size=100):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.running = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def run_pipeline(source, stages, on_error=None):
+    # pass every item of the iterable source through the stages and wait until
+    # all items have been processed by the last stage.
+    # on_error(item, stage, error) = called for every item that a stage failed on
+
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+
+    def feed():
+        # the discovery stage: iterate the source in its own thread
+        try:
+            for item in source:
+                queues[0].put(item)
+        except Exception as e:
+            log.exception("discover: %s", e)
+            metrics.count('errors', 'discover')
+        finally:
+            for _ in range(stages[0].workers):
+                queues[0].put(_done)
+
+    def work(index):
+        stage = stages[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+
+        while True:
+            item = inbox.get()
+            if item is _done:
+                break
+            try:
+                result = stage.function(item)
+            except Exception as e:
+                log.exception("%s: %s", stage.name, e)
+                stage.count('errors')
+                metrics.count('errors', stage.name)
+                if on_error is not None:
+                    try:
+                        on_error(item, stage.name, e)
+                    except Exception as callback_error:
+                        log.exception("%s: on_error: %s", stage.name, callback_error)
+                continue
+            if result is None:
+                stage.count('dropped')
+                continue
+            stage.count('processed')
+            if outbox is not None:
+                outbox.put(result)
+
+        # the last worker of a stage to finish signals the end to the next stage
+        with stage.lock:
+            stage.running -= 1
+            last = stage.running == 0
+        if last and outbox is not None:
+            for _ in range(stages[index + 1].workers):
+                outbox.put(_done)
+
+    threads = [threading.Thread(target=feed, name="discover", daemon=True)]
+    for index, stage in enumerate(stages):
+        stage.running = stage.workers
+        threads.extend(threading.Thread(target=work, args=(index,), name=f"{stage.name}-{i}", daemon=True)
+                       for i in range(stage.workers))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for stage in stages:
+        log.info("%s: processed = %s, dropped = %s, errors = %s", stage.name, stage.processed, stage.dropped, stage.errors)
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# reconciliation of the harvest with the Geoportal catalog. every document is
+# published with an id derived from its mdFileID, so a dataset keeps the same
+# catalog item across runs, and with a content hash recorded in the manifest.
+# a document is only PUT when its hash differs from the published one, and the
+# items of datasets that no longer exist are deleted. at the start of a run the
+# ids in the catalog are fetched once, documents that are missing from the
+# catalog (e.g. after a reindex) are published again.
+
+import json
+import hashlib
+import logging
+import requests
+
+
+log = logging.getLogger(__name__)
+
+# number of items per page of the catalog search
+page_size = 1000
+# keyword field of the Geoportal index the pages are sorted on, the file identifier of
+# the metadata (the mdFileID of the harvested documents). Elasticsearch does not sort
+# on _id (deprecated in 7.x, rejected in 8.x)
+sort_field = 'fileid'
+
+
+def get_item_id(md_file_id):
+    # the catalog id of the document with md_file_id
+    return hashlib.sha1(md_file_id.encode('UTF-8')).hexdigest()
+
+
+def content_hash(metadata):
+    return hashlib.sha256(metadata.encode('UTF-8')).hexdigest()
+
+
+def search_url(item_url):
+    # the search API next to the document management API, e.g.
+    # https://host/geoportal/rest/metadata/item -> https://host/geoportal/rest/metadata/search
+    return item_url.rstrip('/').rsplit('/', 1)[0] + '/search'
+
+
+def fetch_catalog_ids(item_url, auth=None, session=None, timeout=60):
+    # returns the set of ids of all items in the catalog, paging through the search
+    # API of Geoportal (an Elasticsearch response) with search_after on sort_field,
+    # so that catalogs larger than the max_result_window of the index (10,000 by
+    # default) are listed completely. returns None if the catalog cannot be searched
+    # or not all ids were returned, the reconciliation then relies on the manifest only
+    url = search_url(item_url)
+    session = session or requests.Session()
+    ids = set()
+    total = 0
+    last_sort = None
+    try:
+        while True:
+            query = {'size': page_size, 'sort': [{sort_field: 'asc'}], '_source': False}
+            if last_sort is not None:
+                query['search_after'] = last_sort
+            r = session.get(url, params={'f': 'json', 'size': page_size, 'esdsl': json.dumps(query)},
+                            auth=auth, timeout=timeout)
+            r.raise_for_status()
+            hits = r.json().get('hits', {})
+            page = hits.get('hits', [])
+            ids.update(hit['_id'] for hit in page)
+            if last_sort is None:
+                total = hits.get('total', 0)
+                if isinstance(total, dict):
+                    total = total.get('value', 0)
+            if len(page) < page_size:
+                break
+            last_sort = page[-1]['sort']
+    except (requests.RequestException, ValueError, KeyError) as e:
+        log.error("cannot fetch the ids in the catalog from %s, documents missing from the catalog "
+                  "will not be published again: %s", url, e)
+        return None
+    if len(ids) < total:
+        log.error("the catalog search %s returned %s of %s ids, documents missing from the catalog "
+                  "will not be published again", url, len(ids), total)
+        return None
+    return ids
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# watches the folder structure below the start folder for changed files and
+# reports them per folder once the folder has been quiet for a while, so that a
+# dataset whose sidecar files are still being copied is harvested only once.
+# file system notifications (inotify, ReadDirectoryChangesW) are used through
+# the optional watchdog package. without watchdog, or on network drives that do
+# not deliver notifications, the folders are polled: every poll lists the
+# folders with os.scandir and compares the size and mtime of their files with
+# the previous poll.
+
+import os
+import time
+import queue
+import logging
+import threading
+from harvest_discovery import discover_workspaces
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+log = logging.getLogger(__name__)
+
+# files written by the harvest or by ArcGIS while reading the data, changes to these are ignored
+ignored_suffixes = ['.lyrx', '.tmp', '.lock', '.aux.xml']
+
+# folders written by the harvest, changes below these are ignored
+ignored_folder_suffixes = ['.gdb_layers']
+
+
+def is_ignored(path, ignored_folders=()):
+    # True if a change of path should not trigger a harvest
+    normalized = os.path.normcase(os.path.normpath(path))
+    if any(normalized == folder or normalized.startswith(folder + os.sep) for folder in ignored_folders):
+        return True
+    name = os.path.basename(normalized)
+    if any(name.endswith(suffix) for suffix in ignored_suffixes):
+        return True
+    return any(part.endswith(suffix) for part in normalized.split(os.sep) for suffix in ignored_folder_suffixes)
+
+
+class Debouncer:
+    # collects changed file names per folder and releases a folder when no change
+    # was seen for quiet_seconds, or at the latest max_delay after its first change
+
+    def __init__(self, quiet_seconds=2.0, max_delay=None):
+        self.quiet_seconds = quiet_seconds
+        self.max_delay = max_delay if max_delay is not None else 10 * quiet_seconds
+        self.pending = {}  # folder -> [first change, last change, names or None for the whole folder]
+
+    def add(self, folder, name=None):
+        # name = changed file in folder, or None if the whole folder changed (e.g. a new folder)
+        now = time.monotonic()
+        entry = self.pending.get(folder)
+        if entry is None:
+            entry = self.pending[folder] = [now, now, set()]
+        entry[1] = now
+        if name is None:
+            entry[2] = None
+        elif entry[2] is not None:
+            entry[2].add(name)
+
+    def ready(self):
+        # returns the (folder, names) that are ready and forgets them
+        now = time.monotonic()
+        ready = [folder for folder, (first, last, _) in self.pending.items()
+                 if now - last >= self.quiet_seconds or now - first >= self.max_delay]
+        return [(folder, self.pending.pop(folder)[2]) for folder in ready]
+
+
+class PollingWatcher:
+    # detects changes by comparing the size and mtime of all files between polls
+
+    def __init__(self, start_dir, ignored_folders=(), **discover_options):
+        self.start_dir = start_dir
+        self.ignored_folders = ignored_folders
+        self.discover_options = discover_options
+        self.snapshot = None  # {folder: {name: (size, mtime_ns)}}
+
+    def _scan(self):
+        snapshot = {}
+        for folder in discover_workspaces(self.start_dir, progress=None, **self.discover_options):
+            if is_ignored(folder, self.ignored_folders):
+                continue
+            files = {}
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_file(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                files[entry.name] = (st.st_size, st.st_mtime_ns)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+            snapshot[folder] = files
+        return snapshot
+
+    def poll(self):
+        # returns the (folder, name) changes since the previous poll, name is None for new folders.
+        # the first poll only takes the snapshot
+        snapshot = self._scan()
+        previous, self.snapshot = self.snapshot, snapshot
+        if previous is None:
+            return []
+        changes = []
+        for folder, files in snapshot.items():
+            before = previous.get(folder)
+            if before is None:
+                changes.append((folder, None))
+                continue
+            for name in files.keys() | before.keys():
+                if files.get(name) != before.get(name) and not is_ignored(name):
+                    changes.append((folder, name))
+        return changes
+
+
+class _EventHandler(FileSystemEventHandler):
+    # forwards watchdog events as (folder, name) changes to a queue
+
+    def __init__(self, changes, ignored_folders):
+        self.changes = changes
+        self.ignored_folders = ignored_folders
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        for path in [event.src_path, getattr(event, 'dest_path', None)]:
+            if not path or is_ignored(path, self.ignored_folders):
+                continue
+            if event.is_directory:
+                if event.event_type in ('created', 'moved'):
+                    self.changes.put((path, None))
+            else:
+                self.changes.put(os.path.split(path))
+
+
+def watch(start_dir, on_change, quiet_seconds=2.0, poll_interval=30.0, native=True, ignored_folders=(),
+          stop=None, **discover_options):
+    # watches start_dir until stop (a threading.Event) is set and calls on_change(folder, names)
+    # for every folder with changed files, names is None if all datasets of the folder must be harvested.
+    # native          = use file system notifications if the watchdog package is installed
+    # poll_interval   = seconds between polls without notifications
+    # ignored_folders = folders written by the harvest itself, e.g. the sink folder
+    stop = stop or threading.Event()
+    ignored_folders = [os.path.normcase(os.path.normpath(folder)) for folder in ignored_folders]
+    debouncer = Debouncer(quiet_seconds)
+    changes = queue.Queue()
+
+    observer = None
+    watcher = None
+    if native and Observer is not None:
+        observer = Observer()
+        observer.schedule(_EventHandler(changes, ignored_folders), start_dir, recursive=True)
+        observer.start()
+        log.info("watching %s for file system notifications", start_dir)
+    else:
+        watcher = PollingWatcher(start_dir, ignored_folders, **discover_options)
+        watcher.poll()
+        log.info("polling %s every %s seconds", start_dir, poll_interval)
+
+    last_poll = time.monotonic()
+    try:
+        while not stop.is_set():
+            if watcher is not None and time.monotonic() - last_poll >= poll_interval:
+                last_poll = time.monotonic()
+                for change in watcher.poll():
+                    changes.put(change)
+
+            # wait for changes, but wake up in time to release quiet folders
+            try:
+                change = changes.get(timeout=min(quiet_seconds, poll_interval) / 2)
+                while True:
+                    debouncer.add(*change)
+                    change = changes.get_nowait()
+            except queue.Empty:
+                pass
+
+            for folder, names in debouncer.ready():
+                on_change(folder, names)
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
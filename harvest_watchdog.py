@@ -0,0 +1,312 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# time budgets of datasets and ArcGIS calls. a corrupt raster or an unreachable
+# enterprise geodatabase can hang arcpy for hours in a call that cannot be
+# interrupted from Python, so datasets are processed in supervised worker
+# processes. every worker keeps the deadlines of its current dataset and ArcGIS
+# call in shared memory. a watchdog thread in the worker ends the worker when a
+# deadline has passed, after flushing what it has published so far, and the
+# supervisor terminates workers that do not end themselves (e.g. a call that
+# holds the GIL) and starts a replacement.
+#
+# the supervisor hands out the datasets one at a time over a pipe per worker, in
+# two lanes: known-slow datasets go to the slow workers and cheap datasets are
+# handed out first, so that a few pathological files do not hold up the others.
+# items whose worker failed or timed out can be retried once at the end of the run.
+
+import os
+import time
+import logging
+import threading
+import contextlib
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+
+log = logging.getLogger(__name__)
+
+expired_exit_code = 3  # exit code of a worker that ended itself after a deadline passed
+grace_seconds = 30.0  # seconds after a deadline after which the supervisor terminates the worker
+lookahead = 1000  # items that are listed ahead to find an item for the lane of an idle worker
+
+_budget = None  # Budget of this worker process, None outside of supervised workers
+_call_timeout = None  # seconds per ArcGIS call in this worker process
+
+
+class Budget:
+    # the deadlines of the dataset and the ArcGIS call that a worker is working on, in
+    # shared memory so that both the worker and the supervisor can check them
+
+    def __init__(self):
+        self.deadlines = multiprocessing.RawArray('d', 2)  # dataset, call. 0 if there is none
+        self.stage = multiprocessing.RawArray('c', 32)  # name of the current call
+
+    def start_dataset(self, timeout):
+        self.deadlines[0] = time.monotonic() + timeout if timeout else 0.0
+
+    def end_dataset(self):
+        self.deadlines[0] = self.deadlines[1] = 0.0
+
+    def start_call(self, stage, timeout):
+        self.stage.value = stage.encode('ascii', 'replace')[:31]
+        self.deadlines[1] = time.monotonic() + timeout
+
+    def end_call(self):
+        self.deadlines[1] = 0.0
+
+    def expired(self, grace=0.0):
+        # returns the name of the call whose deadline passed more than grace seconds ago,
+        # 'dataset' if the deadline of the dataset passed, or None
+        now = time.monotonic() - grace
+        if self.deadlines[1] and now > self.deadlines[1]:
+            return self.stage.value.decode('ascii')
+        if self.deadlines[0] and now > self.deadlines[0]:
+            return 'dataset'
+        return None
+
+
+@contextlib.contextmanager
+def guard(stage):
+    # guards an ArcGIS call with the call budget of this worker process
+    budget = _budget
+    if budget is None or not _call_timeout:
+        yield
+        return
+    budget.start_call(stage, _call_timeout)
+    try:
+        yield
+    finally:
+        budget.end_call()
+
+
+def _watch(budget, on_expired):
+    # watchdog thread of a worker process
+    while True:
+        time.sleep(0.5)
+        stage = budget.expired()
+        if stage is not None:
+            try:
+                if on_expired is not None:
+                    on_expired(stage)
+            except Exception as e:
+                log.exception("watchdog: %s", e)
+            finally:
+                os._exit(expired_exit_code)
+
+
+def _work(connection, budget, task, initializer, initargs, call_timeout, on_expired):
+    # main function of a worker process: runs task(item) for every item received on connection
+    global _budget, _call_timeout
+    _budget = budget
+    _call_timeout = call_timeout
+    if initializer is not None:
+        initializer(*initargs)
+    threading.Thread(target=_watch, args=(budget, on_expired), name="watchdog", daemon=True).start()
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        item, timeout = message
+        budget.start_dataset(timeout)
+        try:
+            result = task(item)
+        finally:
+            budget.end_dataset()
+        connection.send(result)
+
+
+class _Worker:
+    # a worker process as seen by the supervisor
+
+    def __init__(self, pool, lane):
+        self.lane = lane
+        self.budget = Budget()
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_work, name=f"{lane}-worker",
+            args=(child_connection, self.budget, pool.task, pool.initializer, pool.initargs,
+                  pool.call_timeout, pool.on_expired))
+        self.process.start()
+        child_connection.close()
+        self.item = None  # item the worker is working on
+        self.tasks = 0
+
+    def send(self, item, timeout):
+        # hands out item, returns False if the worker ended in the meantime, e.g. after a crash
+        self.item = item
+        try:
+            self.connection.send((item, timeout))
+        except OSError:
+            return False
+        return True
+
+    def stop(self):
+        # asks the worker to end after its current item
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+
+
+class SupervisedPool:
+    # runs task(item) for many items in worker processes under the watchdog
+
+    def __init__(self, task, processes=1, slow_workers=0, initializer=None, initargs=(),
+                 recycle_after=None, dataset_timeout=None, call_timeout=None, on_expired=None):
+        # task            = function of one item that runs in the workers, its result is sent back
+        # slow_workers    = number of the processes that prefer the known-slow items
+        # recycle_after   = number of items after which a worker is replaced by a fresh process
+        # dataset_timeout = seconds per item, None for no limit
+        # call_timeout    = seconds per guarded call, see guard(), None for no limit
+        # on_expired      = function(stage) called in a worker that exceeded a budget, before it ends
+        self.task = task
+        self.processes = max(1, processes)
+        self.slow_workers = min(max(0, slow_workers), self.processes - 1) if self.processes > 1 else 0
+        self.initializer = initializer
+        self.initargs = initargs
+        self.recycle_after = recycle_after
+        self.dataset_timeout = dataset_timeout
+        self.call_timeout = call_timeout
+        self.on_expired = on_expired
+
+    def run(self, items, is_slow=None, on_result=None, on_timeout=None):
+        # hands out the items to the workers until all are done.
+        # is_slow(item)                = True for items of the slow lane
+        # on_result(item, result)      = called for every finished item
+        # on_timeout(item, stage, pid) = called for every item whose worker ended or was terminated,
+        #                                stage is the exceeded budget, or 'crashed'
+        # both callbacks may return True to retry the item once more at the end of the run
+        items = iter(items)
+        pending = {'fast': deque(), 'slow': deque()}
+        retries = deque()
+        retried = set()
+        exhausted = False
+
+        def next_item(lane):
+            # cheap items first, then items of the other lane, then the retries
+            nonlocal exhausted
+            if pending[lane]:
+                return pending[lane].popleft()
+            pulled = 0
+            while not exhausted and pulled < lookahead:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pulled += 1
+                item_lane = 'slow' if is_slow is not None and is_slow(item) else 'fast'
+                if item_lane == lane:
+                    return item
+                pending[item_lane].append(item)
+            other = 'slow' if lane == 'fast' else 'fast'
+            if pending[other]:
+                return pending[other].popleft()
+            if exhausted and retries:
+                return retries.popleft()
+            return None
+
+        def retry(item, again):
+            if again and item not in retried:
+                retried.add(item)
+                retries.append(item)
+
+        def replace(worker, stage):
+            # the worker ended or is stuck: give up on its item and replace it
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            worker.connection.close()
+            item, worker.item = worker.item, None
+            if on_timeout is not None:
+                retry(item, on_timeout(item, stage, worker.process.pid))
+            workers[workers.index(worker)] = _Worker(self, worker.lane)
+
+        def hand_out():
+            # gives an item to every idle worker. a worker that ended since its previous
+            # item is replaced, and its replacement gets the next item
+            index = 0
+            while index < len(workers):
+                worker = workers[index]
+                item = next_item(worker.lane) if worker.item is None else None
+                if item is not None and not worker.send(item, self.dataset_timeout):
+                    worker.process.join(grace_seconds)
+                    log.error("%s ended before it received an item, exit code %s",
+                              worker.process.name, worker.process.exitcode)
+                    replace(worker, 'crashed')
+                    continue
+                index += 1
+
+        lanes = ['slow'] * self.slow_workers + ['fast'] * (self.processes - self.slow_workers)
+        workers = [_Worker(self, lane) for lane in lanes]
+        retiring = []
+        try:
+            while True:
+                hand_out()
+                busy = [worker for worker in workers if worker.item is not None]
+                if not busy:
+                    break
+
+                ready = wait([worker.connection for worker in busy], timeout=0.5)
+                for worker in busy:
+                    stage = None
+                    if worker.connection in ready:
+                        try:
+                            result = worker.connection.recv()
+                        except (EOFError, OSError):
+                            worker.process.join(grace_seconds)
+                            if worker.process.exitcode == expired_exit_code:
+                                stage = worker.budget.expired() or 'dataset'
+                            else:
+                                stage = 'crashed'
+                        else:
+                            item, worker.item = worker.item, None
+                            worker.tasks += 1
+                            if on_result is not None:
+                                retry(item, on_result(item, result))
+                            if self.recycle_after and worker.tasks >= self.recycle_after:
+                                worker.stop()
+                                retiring.append(worker)
+                                workers[workers.index(worker)] = _Worker(self, worker.lane)
+                            continue
+                    else:
+                        stage = worker.budget.expired(grace_seconds)
+                        if stage is None:
+                            continue
+                        log.error("terminating %s, %s did not end %s seconds after its budget",
+                                  worker.process.name, stage, grace_seconds)
+
+                    replace(worker, stage)
+
+                for worker in [worker for worker in retiring if not worker.process.is_alive()]:
+                    worker.connection.close()
+                    retiring.remove(worker)
+        finally:
+            # after an interruption, busy workers get a grace period to end
+            for worker in workers:
+                worker.stop()
+            for worker in workers + retiring:
+                worker.process.join(grace_seconds if worker.item is not None else None)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+                    worker.process.join()
+                worker.connection.close()
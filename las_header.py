@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# reader of the public header block and the (extended) variable length records
+# of LAS 1.0 - 1.4 and LAZ files. the file is memory mapped and only the header
+# and the records that describe the coordinate reference system are touched,
+# the point records are never read, so a multi-GB tile is read in milliseconds.
+# the header of a LAZ file is not compressed and has the same layout.
+
+import os
+import mmap
+import struct
+from collections import namedtuple
+
+
+LasHeader = namedtuple('LasHeader', ['version', 'point_format', 'point_count', 'compressed',
+                                     'min_x', 'min_y', 'min_z', 'max_x', 'max_y', 'max_z',
+                                     'wkid', 'wkt'])
+
+_header = struct.Struct('<4sHH16sBB32s32sHHHIIBHI5I3d3d6d')  # LAS 1.0 - 1.2, 227 bytes
+_header_14 = struct.Struct('<QQIQ')  # start of waveform data, start and number of EVLRs, point count (1.4)
+_vlr = struct.Struct('<H16sHH32s')  # 54 bytes
+_evlr = struct.Struct('<H16sHQ32s')  # 60 bytes
+
+projection_user = b'LASF_Projection'
+geokey_directory_record = 34735
+wkt_records = [2112, 2111]  # OGC coordinate system WKT, OGC math transform WKT
+projected_cs_key = 3072  # ProjectedCSTypeGeoKey
+geographic_type_key = 2048  # GeographicTypeGeoKey
+
+
+def _geokey_wkid(data):
+    # returns the EPSG code of the projected or geographic CRS in a GeoKeyDirectoryTag record
+    if len(data) < 8:
+        return None
+    key_count = struct.unpack_from('<4H', data)[3]
+    keys = {}
+    for i in range(min(key_count, len(data) // 8 - 1)):
+        key_id, location, _, value = struct.unpack_from('<4H', data, 8 + 8 * i)
+        if location == 0:  # the value is stored in the key itself
+            keys[key_id] = value
+    for key_id in [projected_cs_key, geographic_type_key]:
+        value = keys.get(key_id)
+        if value and value != 32767:  # 32767 = user defined
+            return value
+    return None
+
+
+def _read_crs(records, wkid, wkt):
+    # updates wkid and wkt with the CRS records of the (user id, record id, data) records
+    for user, record_id, data in records:
+        if user != projection_user:
+            continue
+        if record_id == geokey_directory_record and wkid is None:
+            wkid = _geokey_wkid(data)
+        elif record_id in wkt_records and wkt is None:
+            wkt = bytes(data).split(b'\0', 1)[0].decode('UTF-8', 'replace').strip() or None
+    return wkid, wkt
+
+
+def read_las_header(path):
+    # returns the LasHeader of the LAS or LAZ file at path.
+    # raises ValueError if the file is not a LAS file, OSError if it cannot be read
+    with open(path, 'rb') as las_file:
+        size = os.fstat(las_file.fileno()).st_size
+        if size < _header.size:
+            raise ValueError(f"{path} is not a LAS file")
+        with mmap.mmap(las_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            values = _header.unpack_from(data)
+            if values[0] != b'LASF':
+                raise ValueError(f"{path} is not a LAS file")
+            version_major, version_minor = values[4], values[5]
+            header_size, offset_to_points, vlr_count = values[10], values[11], values[12]
+            point_format, point_count = values[13], values[15]
+            max_x, min_x, max_y, min_y, max_z, min_z = values[-6:]
+
+            evlr_start = evlr_count = 0
+            if (version_major, version_minor) >= (1, 4) and header_size >= 375:
+                _, evlr_start, evlr_count, point_count_14 = _header_14.unpack_from(data, 227)
+                point_count = point_count_14 or point_count
+
+            # variable length records between the header and the points
+            records = []
+            offset = header_size
+            for _ in range(vlr_count):
+                if offset + _vlr.size > min(size, offset_to_points):
+                    break
+                _, user, record_id, length, _ = _vlr.unpack_from(data, offset)
+                offset += _vlr.size
+                if user.rstrip(b'\0') == projection_user:
+                    records.append((projection_user, record_id, data[offset:offset + length]))
+                offset += length
+
+            # extended variable length records after the points (LAS 1.4)
+            offset = evlr_start
+            for _ in range(evlr_count if evlr_start else 0):
+                if offset + _evlr.size > size:
+                    break
+                _, user, record_id, length, _ = _evlr.unpack_from(data, offset)
+                offset += _evlr.size
+                if user.rstrip(b'\0') == projection_user:
+                    records.append((projection_user, record_id, data[offset:offset + length]))
+                offset += length
+
+            wkid, wkt = _read_crs(records, None, None)
+
+    return LasHeader(version=f"{version_major}.{version_minor}",
+                     point_format=point_format & 0x3f,
+                     point_count=point_count,
+                     compressed=bool(point_format & 0x80) or path.lower().endswith('.laz'),
+                     min_x=min_x, min_y=min_y, min_z=min_z, max_x=max_x, max_y=max_y, max_z=max_z,
+                     wkid=wkid, wkt=wkt)
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# layer file (.lyrx) emitter. a layer file is a JSON document with the CIM
+# definition of the layer. the download copy of a layer file is derived from the
+# layer file next to the data by patching its data connection, instead of saving
+# the layer a second time. for Shapefile, RasterDataset and LasDataset the layer
+# file can also be synthesised from a per-type template, without adding the
+# dataset to a map. templates are learned from the first layer file that ArcGIS
+# writes for a type, or loaded from a folder of template layer files.
+
+import os
+import re
+import copy
+import json
+import uuid
+import threading
+
+
+# data types whose layer files can be synthesised from a template
+synthesized_types = ['ShapeFile', 'RasterDataset', 'LasDataset']
+
+
+def write_json_atomic(path, document):
+    # writes the JSON document to path through a temporary file, so that readers
+    # of path never see a partially written layer file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w') as json_file:
+            json.dump(document, json_file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_json(path):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def data_connection(lyr_json, data_type):
+    # returns the data connection of the first layer of the layer file, or None
+    # for data types whose data connection is not known
+    layer_definition = lyr_json["layerDefinitions"][0]
+    if data_type in ["ShapeFile"]:
+        return layer_definition["featureTable"]["dataConnection"]
+    elif data_type in ["RasterDataset", "LasDataset"]:
+        return layer_definition["dataConnection"]
+    return None
+
+
+def patch_connection(lyr_json, data_type, folder):
+    # makes the data source of the layer file absolute, for layer files that are
+    # not stored next to the data. returns False for unknown data types
+    connection = data_connection(lyr_json, data_type)
+    if connection is None:
+        return False
+    connection["workspaceConnectionString"] = f"DATABASE={folder}"
+    return True
+
+
+def template_key(record):
+    # the symbology of a layer depends on the data type and, for feature classes,
+    # on the geometry type and, for rasters, on the number of bands
+    data_type = record.data_type
+    if data_type == "ShapeFile":
+        return f"{data_type}_{record.shape_type or ''}"
+    elif data_type == "RasterDataset":
+        return f"{data_type}_{record.band_count or ''}"
+    return data_type
+
+
+def _layer_uri(uri, data_file):
+    # derives the CIM path of a new layer from the CIM path of the template layer
+    prefix, _, name = uri.rpartition('/')
+    extension = os.path.splitext(name)[1]
+    stem = re.sub(r'[^0-9a-z_]', '_', os.path.splitext(data_file)[0].lower())
+    return f"{prefix}/{stem}{extension}"
+
+
+# properties of a layer definition that belong to the dataset the layer file was saved for
+dataset_layer_keys = ['labelClasses', 'popupInfo', 'featureTemplates', 'charts', 'metadataURI', 'sourceModifiedTime']
+
+# properties of a feature table that name fields or rows of the dataset
+dataset_table_keys = ['displayField', 'displayExpressionInfo', 'fieldDescriptions', 'definitionExpression',
+                      'definitionFilterChoices', 'timeFields', 'rangeDefinitions']
+
+# properties of a renderer that name fields of the dataset
+renderer_field_keys = ['field', 'fields', 'valueExpressionInfo', 'normalizationField', 'rotationXField',
+                       'rotationYField', 'rotationZField']
+
+
+def _first_symbol(renderer):
+    # the default symbol of a renderer, or the symbol of its first class
+    if renderer.get('defaultSymbol'):
+        return renderer['defaultSymbol']
+    for group in renderer.get('groups') or []:
+        for value_class in group.get('classes') or []:
+            if value_class.get('symbol'):
+                return value_class['symbol']
+    for value_class in renderer.get('breaks') or []:
+        if value_class.get('symbol'):
+            return value_class['symbol']
+    return None
+
+
+def generalize_layer(layer_definition):
+    # removes what is specific to the dataset of a feature layer from its definition,
+    # so that it can be the template of other datasets: labels, pop-ups, the display field
+    # and other field references of the feature table, and renderers by field values,
+    # which are replaced by a simple renderer with their default symbol
+    for key in dataset_layer_keys:
+        layer_definition.pop(key, None)
+    if 'labelVisibility' in layer_definition:
+        layer_definition['labelVisibility'] = False
+    for key in dataset_table_keys:
+        (layer_definition.get('featureTable') or {}).pop(key, None)
+    renderer = layer_definition.get('renderer')
+    if renderer is not None:
+        renderer.pop('visualVariables', None)
+        if any(key in renderer for key in renderer_field_keys):
+            symbol = _first_symbol(renderer)
+            if symbol is not None:
+                layer_definition['renderer'] = {'type': 'CIMSimpleRenderer', 'patch': 'Default', 'symbol': symbol}
+            else:
+                del layer_definition['renderer']
+
+
+def _remove_key(document, key):
+    # removes key from all objects in the JSON document
+    if isinstance(document, dict):
+        document.pop(key, None)
+        for value in document.values():
+            _remove_key(value, key)
+    elif isinstance(document, list):
+        for value in document:
+            _remove_key(value, key)
+
+
+class LayerTemplates:
+    # per-type layer file templates
+
+    def __init__(self, template_folder=None):
+        # template_folder = folder with template layer files named <key>.lyrx (see template_key).
+        #                   learned templates are saved to this folder too
+        self.template_folder = template_folder
+        self.templates = {}
+        self.lock = threading.Lock()
+        if template_folder is not None and os.path.isdir(template_folder):
+            for name in os.listdir(template_folder):
+                if name.endswith('.lyrx'):
+                    self.templates[name[:-5]] = read_json(os.path.join(template_folder, name))
+
+    def learn(self, record, lyr_json):
+        # keeps the layer file written by ArcGIS as the template of its type
+        if record.data_type not in synthesized_types:
+            return
+        key = template_key(record)
+        with self.lock:
+            if key in self.templates:
+                return
+            template = copy.deepcopy(lyr_json)
+            if record.data_type == "RasterDataset":
+                # raster statistics are specific to the dataset, let ArcGIS compute them
+                _remove_key(template, "stretchStats")
+            for layer_definition in template.get("layerDefinitions", []):
+                generalize_layer(layer_definition)
+            self.templates[key] = template
+        if self.template_folder is not None:
+            os.makedirs(self.template_folder, exist_ok=True)
+            write_json_atomic(os.path.join(self.template_folder, key + '.lyrx'), template)
+
+    def synthesize(self, record, folder, data_file):
+        # returns the layer file JSON for data_file in folder, or None if there is
+        # no template for the type of the dataset
+        template = self.templates.get(template_key(record))
+        if template is None:
+            return None
+
+        lyr_json = copy.deepcopy(template)
+        layer_definition = lyr_json["layerDefinitions"][0]
+        name = os.path.splitext(data_file)[0]
+        layer_definition["name"] = name
+        if "uRI" in layer_definition:
+            uri = _layer_uri(layer_definition["uRI"], data_file)
+            layer_definition["uRI"] = uri
+            lyr_json["layers"] = [uri]
+
+        connection = data_connection(lyr_json, record.data_type)
+        # the dataset name in the template tells whether the extension is included
+        connection["dataset"] = data_file if '.' in connection.get("dataset", "") else name
+        connection["workspaceConnectionString"] = f"DATABASE={folder}"
+        return lyr_json
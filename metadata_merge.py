@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# single pass merge of metadata trees. the metadata generated from the template
+# is merged with the metadata that already exists for a dataset in one walk over
+# both trees. FGDC sections of the existing metadata are dropped while merging,
+# since we're publishing ArcGIS XML metadata.
+
+from xml.etree import ElementTree
+
+
+# FGDC metadata sections that are not merged into the ArcGIS XML metadata
+fgdc_sections = frozenset(['idinfo', 'dataqual', 'spdoinfo', 'spref', 'eainfo', 'distinfo', 'metainfo', 'smusrdef'])
+
+
+def merge_element(base, overlay, drop=fgdc_sections):
+    # merges the element overlay into the element base, in place.
+    # children are matched on tag and position: the n-th <tag> of overlay is merged
+    # into the n-th <tag> of base, so repeated elements are merged pairwise.
+    # - matching leaf elements: base takes the text and attributes of overlay
+    # - matching nested elements: merged recursively
+    # - elements without a match in base: moved from overlay to base
+    # - elements with a tag in drop: skipped, together with their children
+
+    stack = [(base, overlay)]
+    while stack:
+        b_element, o_element = stack.pop()
+
+        # index the children of base by tag, in document order
+        b_children = {}
+        for child in b_element:
+            b_children.setdefault(child.tag, []).append(child)
+
+        o_counts = {}
+        for child in list(o_element):
+            tag = child.tag
+            if tag in drop or not isinstance(tag, str):
+                # dropped sections, comments and processing instructions
+                continue
+
+            n = o_counts.get(tag, 0)
+            o_counts[tag] = n + 1
+            matches = b_children.get(tag)
+            if matches is None or n >= len(matches):
+                # not in base: just add it
+                b_element.append(child)
+            elif len(child) == 0:
+                # not nested: update the text and attributes
+                matches[n].text = child.text
+                matches[n].attrib.update(child.attrib)
+            else:
+                # recursively process the element, and update it in the same way
+                stack.append((matches[n], child))
+
+    return base
+
+
+def merge_metadata(t_metadata, f_metadata, drop=fgdc_sections):
+    # merges existing metadata of a dataset into the metadata generated from the template.
+    # t_metadata = template-based metadata, an Element or an XML string
+    # f_metadata = existing metadata of the dataset, an Element, an XML string or None
+    # returns the merged metadata as an Element
+
+    t_xml = ElementTree.fromstring(t_metadata) if isinstance(t_metadata, (str, bytes)) else t_metadata
+    if f_metadata is None or (isinstance(f_metadata, (str, bytes)) and not f_metadata.strip()):
+        return t_xml
+
+    f_xml = ElementTree.fromstring(f_metadata) if isinstance(f_metadata, (str, bytes)) else f_metadata
+    return merge_element(t_xml, f_xml, drop)
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# compiled metadata template. the XML template is parsed once and the positions
+# of its $slots are recorded. rendering a dataset deep copies the parsed tree and
+# patches the values into the slots, instead of substituting the values into the
+# template text and parsing the result again. values are plain text and are
+# escaped when the tree is serialised.
+
+from string import Template
+from xml.etree import ElementTree
+
+
+class CompiledTemplate:
+    # XML template with $slots in element text and attribute values
+
+    def __init__(self, template_text):
+        self.root = ElementTree.fromstring(template_text)
+
+        # slots as (path, attribute, name, template):
+        # path      = list of child indexes from the root to the element
+        # attribute = name of the attribute, None for the element text
+        # name      = name of the slot if the text is exactly one $slot, otherwise None
+        # template  = Template of the text or attribute value
+        self.slots = []
+        stack = [(self.root, [])]
+        while stack:
+            element, path = stack.pop()
+            if element.text and '$' in element.text:
+                template = Template(element.text.strip())
+                self.slots.append((path, None, _single_slot(template), template))
+            for attribute, value in element.attrib.items():
+                if '$' in value:
+                    self.slots.append((path, attribute, None, Template(value)))
+            for index, child in enumerate(element):
+                stack.append((child, path + [index]))
+
+    def render(self, content):
+        # returns a new metadata tree with the values of content patched into the slots.
+        # a value can be text, or an Element or list of Elements that are added as
+        # children of the slot element (e.g. the keywords of searchKeys).
+        # raises KeyError if content has no value for a slot, like Template.substitute
+        root = _copy_element(self.root)
+
+        for path, attribute, name, template in self.slots:
+            element = root
+            for index in path:
+                element = element[index]
+
+            if attribute is not None:
+                element.set(attribute, template.substitute(content))
+            elif name is not None:
+                value = content[name]
+                if _is_element_value(value):
+                    element.text = None
+                    element.extend([value] if ElementTree.iselement(value) else value)
+                else:
+                    element.text = str(value)
+            else:
+                element.text = template.substitute(content)
+
+        return root
+
+
+def _copy_element(element):
+    # deep copy of an element. faster than copy.deepcopy, which also deep copies
+    # the (immutable) text and attribute values
+    copied = ElementTree.Element(element.tag, element.attrib)
+    copied.text = element.text
+    copied.tail = element.tail
+    copied.extend([_copy_element(child) for child in element])
+    return copied
+
+
+def _single_slot(template):
+    # returns the slot name if the template is exactly one $slot, e.g. "$searchKeys"
+    match = template.pattern.fullmatch(template.template)
+    if match is None:
+        return None
+    return match.group('named') or match.group('braced')
+
+
+def _is_element_value(value):
+    # True if value is an Element or a list of Elements
+    if ElementTree.iselement(value):
+        return True
+    return isinstance(value, (list, tuple)) and all(ElementTree.iselement(item) for item in value)
+
+
+def make_element(tag, text=None):
+    # returns a new element with text, e.g. make_element('keyword', 'ShapeFile')
+    element = ElementTree.Element(tag)
+    element.text = text
+    return element
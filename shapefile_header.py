@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# reader of the fixed 100 byte header of a shapefile (.shp) and of the WKT in
+# its .prj sidecar. the header holds the geometry type and the bounding box of
+# all shapes, so the facts needed for the metadata are read without arcpy.
+
+import os
+import math
+import struct
+from collections import namedtuple
+
+
+ShapefileHeader = namedtuple('ShapefileHeader', ['shape_type', 'extent', 'wkt'])
+
+header_size = 100
+
+# shape type codes of the shapefile specification and the arcpy shapeType they are described as
+shape_types = {
+    1: 'Point', 11: 'Point', 21: 'Point',
+    3: 'Polyline', 13: 'Polyline', 23: 'Polyline',
+    5: 'Polygon', 15: 'Polygon', 25: 'Polygon',
+    8: 'Multipoint', 18: 'Multipoint', 28: 'Multipoint',
+    31: 'MultiPatch',
+}
+
+
+def read_prj(path):
+    # returns the WKT in the .prj sidecar of the dataset at path, or None
+    try:
+        with open(os.path.splitext(path)[0] + '.prj', encoding='UTF-8', errors='replace') as prj_file:
+            return prj_file.read().strip() or None
+    except OSError:
+        return None
+
+
+def read_shapefile_header(path):
+    # returns the ShapefileHeader of the shapefile at path. the extent is None if the
+    # bounding box is not set. raises ValueError if the file is not a shapefile
+    with open(path, 'rb') as shp_file:
+        data = shp_file.read(header_size)
+    if len(data) < header_size:
+        raise ValueError(f"{path} is not a shapefile")
+    file_code = struct.unpack_from('>i', data)[0]
+    version, shape_type = struct.unpack_from('<2i', data, 28)
+    xmin, ymin, xmax, ymax = struct.unpack_from('<4d', data, 36)
+    if file_code != 9994 or version != 1000:
+        raise ValueError(f"{path} is not a shapefile")
+    if shape_type not in shape_types:
+        raise ValueError(f"{path} has unsupported shape type {shape_type}")
+
+    # shapefiles without shapes have an unset bounding box, written as zeros or NaN
+    extent = (xmin, ymin, xmax, ymax)
+    if not all(math.isfinite(value) for value in extent) or xmin > xmax or ymin > ymax \
+            or extent == (0.0, 0.0, 0.0, 0.0):
+        extent = None
+    return ShapefileHeader(shape_types[shape_type], extent, read_prj(path))
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+# See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# Esri Inc. licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# lookup of the well-known id of a coordinate reference system from its WKT,
+# e.g. the contents of a .prj file, without arcpy. WKT with an EPSG authority
+# (OGC WKT 1 and 2) carries its code. Esri WKT does not, its CRS is looked up by
+# name in a table of the common geographic (WGS 84, NAD83, NAD27), Web Mercator
+# and UTM systems, built once when the module is loaded. of the state plane
+# systems only the Tennessee zone is in the table, the data this harvester was
+# written for is in Tennessee (the CRS settings of generate_layer_files.py point
+# to the Tennessee systems). WKT that is not found, including the other state
+# plane zones, returns None, to be resolved with arcpy.
+
+import re
+
+
+_name = re.compile(r'^\s*(?:PROJCS|GEOGCS|GEOCCS|PROJCRS|GEOGCRS|GEODCRS|PROJECTEDCRS|GEOGRAPHICCRS)\s*\[\s*"([^"]*)"',
+                   re.IGNORECASE)
+_authority = re.compile(r'(?:AUTHORITY|ID)\[\s*"EPSG"\s*,\s*"?(\d+)"?[^\[\]]*\]\s*\]\s*$', re.IGNORECASE)
+
+
+def _key(name):
+    # names are compared without case and punctuation, so that the Esri name
+    # NAD_1983_UTM_Zone_16N and the EPSG name NAD83 / UTM zone 16N both match
+    return re.sub(r'[^0-9a-z]+', '_', name.lower()).strip('_')
+
+
+def _build_table():
+    table = {}
+
+    def add(wkid, *names):
+        for name in names:
+            table[_key(name)] = wkid
+
+    add(4326, 'GCS_WGS_1984', 'WGS 84')
+    add(4269, 'GCS_North_American_1983', 'NAD83')
+    add(4267, 'GCS_North_American_1927', 'NAD27')
+    add(6318, 'GCS_NAD_1983_2011', 'NAD83(2011)')
+    add(4152, 'GCS_North_American_1983_HARN', 'NAD83(HARN)')
+    add(3857, 'WGS_1984_Web_Mercator_Auxiliary_Sphere', 'WGS 84 / Pseudo-Mercator')
+    for zone in range(1, 61):
+        add(32600 + zone, f'WGS_1984_UTM_Zone_{zone}N', f'WGS 84 / UTM zone {zone}N')
+        add(32700 + zone, f'WGS_1984_UTM_Zone_{zone}S', f'WGS 84 / UTM zone {zone}S')
+    for zone in range(1, 24):
+        add(26900 + zone, f'NAD_1983_UTM_Zone_{zone}N', f'NAD83 / UTM zone {zone}N')
+    for zone in range(3, 23):
+        add(26700 + zone, f'NAD_1927_UTM_Zone_{zone}N', f'NAD27 / UTM zone {zone}N')
+    # Tennessee, the state plane zone of the harvested data
+    add(32136, 'NAD_1983_StatePlane_Tennessee_FIPS_4100', 'NAD83 / Tennessee')
+    add(2274, 'NAD_1983_StatePlane_Tennessee_FIPS_4100_Feet', 'NAD83 / Tennessee (ftUS)')
+    add(6575, 'NAD_1983_2011_StatePlane_Tennessee_FIPS_4100', 'NAD83(2011) / Tennessee')
+    add(6576, 'NAD_1983_2011_StatePlane_Tennessee_FIPS_4100_Ft_US', 'NAD83(2011) / Tennessee (ftUS)')
+    return table
+
+
+wkid_by_name = _build_table()
+
+
+def wkid_from_wkt(wkt):
+    # returns the well-known id of the CRS described by wkt, or None if it is not known
+    if not wkt:
+        return None
+    match = _authority.search(wkt)
+    if match:
+        return int(match.group(1))
+    match = _name.match(wkt)
+    if match:
+        return wkid_by_name.get(_key(match.group(1)))
+    return None